@@ -1,11 +1,26 @@
 import json
-import urllib.request
-import boto3
 import time
 import os
 from decimal import Decimal
-import jwt  # pyjwt 라이브러리 import
-import urllib.error # URLError, HTTPError를 잡기 위해 추가
+from lambda_runtime import get_table
+from lambda_log import get_logger, start_request
+from lambda_metrics import start_metrics
+from lambda_tracing import start_trace, finish_trace
+from gemini_client import get_gemini_client, GeminiAPIError  # Lambda Layer 공용 모듈
+from plan_cache import get_plan_cache, make_cache_key, wants_fresh_plan
+from plan_continuation import continue_if_truncated, PLAN_KEYS
+from plan_json import normalize_envelope_text
+from plan_storage import plan_item_attributes, plan_envelope
+from plan_summary_index import summary_attributes
+from plan_overflow import offload_large_attributes, restore_overflow
+from plan_versions import INITIAL_PLAN_VERSION
+from plan_schema import (PLAN_STRUCTURED_OUTPUT, PLAN_RESPONSE_SCHEMA, COMPACT_KEYS,
+                         structured_generation_config, expand_plan, expand_envelope_text)
+from plan_prompts import plan_instruction_text
+from gemini_context_cache import get_context_cache
+from plan_ledger import get_plan_ledger, new_plan_id, LEDGER_COMPLETED
+
+log = get_logger('create_mobile')
 
 # Decimal을 JSON으로 직렬화할 수 있게 도와주는 함수
 class DecimalEncoder(json.JSONEncoder):
@@ -14,7 +29,15 @@ class DecimalEncoder(json.JSONEncoder):
             return float(obj)
         return super(DecimalEncoder, self).default(obj)
 
+# Gemini 클라이언트는 컨테이너 초기화 시 한 번 생성하여 warm 호출 간 연결을 재사용
+gemini_client = get_gemini_client()
+
+# 요청마다 동일한 고정 지시문은 컨텍스트 캐시로 한 번만 처리 (캐시를 쓸 수 없으면 systemInstruction)
+context_cache = get_context_cache(gemini_client)
+PLAN_INSTRUCTION = plan_instruction_text()
+
 def decode_jwt(token):
+    import jwt  # pyjwt: Authorization 헤더가 있는 요청에서만 필요하므로 처음 쓸 때 import (콜드 스타트 단축)
     try:
         # 서명 검증 없이 디코딩 (보안상 권장하지 않음)
         decoded_token = jwt.decode(token, options={"verify_signature": False})
@@ -38,10 +61,19 @@ def lambda_handler(event, context):
             'body': json.dumps({ "message": "CORS preflight OK" })
         }
 
-    print("이벤트:", json.dumps(event))
+    # 요청 문맥: API Gateway 요청 ID 기준으로 DEBUG 샘플링 (본문의 이미지/항공편 원본은 요약해서 기록)
+    request_id = event.get('requestContext', {}).get('requestId') or getattr(context, 'aws_request_id', None)
+    # 요청 추적: 단계 타이머가 span으로 기록되고 finally에서 내보냄 (REST는 람다 하나라 여기서 traceId 발급)
+    trace = start_trace('create_mobile', requestId=request_id)
+    request_error = None
+    start_request(request_id, traceId=trace.trace_id)
+    log.debug('이벤트', event=event)
 
     # --- 전체 함수 실행 시작 시간 기록 ---
     lambda_start_time = time.time()
+    # 단계별 지연 시간 (EMF). 응답을 돌려주기 전에 finally에서 한 줄로 출력
+    metrics = start_metrics('create_mobile', model=gemini_client.model)
+    metrics.start('prompt_build')
 
     try:
         # 요청 본문 파싱
@@ -84,6 +116,30 @@ def lambda_handler(event, context):
         else:
             print('Authorization 헤더가 없거나 잘못된 형식, 기본 사용자 ID 사용')
 
+        # 멱등성 원장: 같은 clientRequestId의 재시도면 이미 생성된 계획을 그대로 반환 (Gemini 호출 생략)
+        client_request_id = body.get('clientRequestId')
+        plan_ledger = get_plan_ledger()
+        ledger_entry = plan_ledger.reserve(user_id, client_request_id) if plan_ledger and client_request_id else None
+        if ledger_entry and ledger_entry['status'] == LEDGER_COMPLETED:
+            saved_item = get_table('travel-plans').get_item(
+                Key={'planId': ledger_entry['plan_id']}).get('Item')
+            if saved_item:
+                print(f"[PlanLedger] 이미 생성된 계획 반환: {ledger_entry['plan_id']}, Gemini 호출 생략")
+                return {
+                    'statusCode': 200,
+                    'headers': {
+                        'Content-Type': 'application/json; charset=utf-8',
+                        'Access-Control-Allow-Origin': '*',
+                        'Access-Control-Allow-Methods': 'OPTIONS,POST,GET',
+                        'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token'
+                    },
+                    'body': json.dumps({
+                        'message': '여행 계획이 성공적으로 생성되었으며, ID로 조회 가능합니다.',
+                        'planId': ledger_entry['plan_id'],
+                        'plan': plan_envelope(restore_overflow(saved_item, names=('plan_blob', 'plan_data')))
+                    }, ensure_ascii=False, cls=DecimalEncoder)
+                }
+
         # 요청 파라미터 추출
         query_text = body.get('query', '')
         start_date = body.get('startDate')
@@ -96,6 +152,7 @@ def lambda_handler(event, context):
         # Base64 이미지 처리 추가
         images = body.get('images', [])  # Base64 이미지 배열
         has_images = len(images) > 0
+        metrics.set_dimension('has_images', has_images)
         print(f"수신된 이미지 개수: {len(images)}")
 
         # Geo 정보 기본값 초기화
@@ -156,7 +213,7 @@ def lambda_handler(event, context):
                     in_depart_geo_lng = return_first_segment.get('departure', {}).get('geoCode', {}).get('longitude')
                 
                 # 개발 디버그용 로그
-                print("항공편 정보 처리됨:", json.dumps(flight_info, cls=DecimalEncoder))
+                log.debug('항공편 정보 처리됨', flight_info=flight_info)
                 print("왕복 여부:", is_round_trip, "returnDate:", flight_info.get('returnDate'))
             
             # 기존 변환된 형식인 경우 (하위 호환성 유지)
@@ -258,7 +315,7 @@ def lambda_handler(event, context):
                         "경도": str(in_depart_geo_lng) if in_depart_geo_lng is not None else 'Unknown',
                         "출발공항이름": return_origin_airport_name
                     }
-                    print("왕복 항공편 정보 처리됨 (json):", json.dumps(log_data, ensure_ascii=False, cls=DecimalEncoder))
+                    log.debug('왕복 항공편 정보 처리됨', **log_data)
                 except Exception as e:
                     print("왕복 항공편 정보 처리 중 오류:", str(e))
 
@@ -308,45 +365,13 @@ def lambda_handler(event, context):
 - 이미지의 분위기나 테마를 고려하여 여행 스타일을 맞춰주세요.
 - 이미지에서 특정 관심사를 발견하면 관련된 장소나 활동을 추천해주세요."""
 
-        prompt_text += """
-<규칙>
-모든 장소는 실제로 있는 장소여야 해. 호텔, 장소, 식당을 너가 검색해서 잡아줘.
-"무조건 이름이 지도에 있는 이름이어야 해."
-현실적인 일정을 잡아야 하니, 하루 총 일정에 너무 많은 이동거리가 있으면 안 돼.
-그리고, 다음날의 첫 일정에는 전날의 호텔과 가까이 있는 걸로 해줘.
-이어지는 흐름으로 갈 수 있도록.
-그런데 장소와 장소 사이가 너무 가까워도 안됨.
-항공편 정보가 제공된 경우, 첫날 첫 번째 일정은 반드시 제공된 '가는 편' 항공편의 도착 공항에, 명시된 '도착 시간'에 도착하는 것으로 생성해야 하며, 해당 공항의 이름, 위도, 경도를 `schedules`에 포함해야 한다.
-마찬가지로, 복귀 항공편 정보가 제공된 경우, 마지막 날 마지막 일정은 제공된 '오는 편' 항공편의 출발 공항에서, 명시된 '출발 시간' 이전에 출발 준비를 마치는 것으로 생성하고, 해당 공항 이름, 위도, 경도를 `schedules`에 포함해야 한다.
-
-<답변형식>
-하루치 일정은 \\"(관광지)-(식당)-(관광지)-(관광지)-(관광지)-(관광지)-(마지막 관광지)\\" 이렇게 잡아줘.
-관광지 : 지도 상에 존재하는 명소나, 구경거리 (제외 : 호텔, 지하철역,항공 등등..) 만 넣어야해.
-추가로, 하루 일정의 마지막 장소의 위도(latitude)와 경도(longitude) 정보를 포함해야 해.
-항공편 도착/출발 공항도 '장소'로 취급하여 일정에 포함해야 한다.
-
-
-JSON 예시
-{5}
-저 구조로만 반환하세요.
-""".format(
-            query_text, 
-            start_date, 
-            end_date, 
-            adults, 
-            children,
-            """
-{{\\"title\\":\\"ㅁㅁ ㅁ박 ㅁ일 여행\\",\\"days\\":[{{\\"day\\":1,\\"date\\":\\"2025-05-12\\",\\"title\\":\\"1일차: 공항 도착 및 ㅁㅁ 방문\\",\\"schedules\\":[{{\\"id\\":\\"1-0\\",\\"name\\":\\"도착 공항 이름 (예: 인천 국제공항)\\",\\"time\\":\\"14:00\\",\\"lat\\":37.45584,\\"lng\\":126.4453,\\"category\\":\\"장소\\",\\"duration\\":\\"0.5시간\\",\\"notes\\":\\"공항 도착 및 입국 수속\\",\\"cost\\":\\"0\\",\\"address\\":\\"공항 주소\\"}},{{\\"id\\":\\"1-1\\",\\"name\\":\\"장소이름\\",\\"time\\":\\"15:30\\",\\"lat\\":123.1234,\\"lng\\":123.1234,\\"category\\":\\"장소\\",\\"duration\\":\\"1시간\\",\\"notes\\":\\"ㅁㅁ\\",\\"cost\\":\\"50000\\",\\"address\\":\\"ㅁㅁ 주소\\"}},{{\\"id\\":\\"1-2\\",\\"name\\":\\"ㅁㅁ\\",\\"time\\":\\"17:00\\",\\"lat\\":35.6936,\\"lng\\":139.7071,\\"category\\":\\"식당\\",\\"duration\\":\\"1시간\\",\\"notes\\":\\"현지 이자카야에서 다양한 음식 즐기기\\",\\"cost\\":\\"3000\\",\\"address\\":\\"ㅁㅁ 주소\\"}}]}},{{\\"day\\":2,\\"date\\":\\"2025-05-13\\",\\"title\\":\\"2일차: ㅁㅁ 여행\\",\\"schedules\\":[{{\\"id\\":\\"2-1\\",\\"name\\":\\"ㅁㅁ 타워\\",\\"time\\":\\"10:00\\",\\"lat\\":35.6585805,\\"lng\\":139.7454329,\\"category\\":\\"장소\\",\\"duration\\":\\"1시간\\",\\"notes\\":\\"ㅁㅁ 시내 전경을 감상할 수 있는 명소\\",\\"cost\\":\\"1200\\",\\"address\\":\\"ㅁㅁ 주소\\"}},{{\\"id\\":\\"2-2\\",\\"name\\":\\"ㅁㅁ 멘치\\",\\"time\\":\\"13:00\\",\\"lat\\":35.714765,\\"lng\\":139.79669,\\"category\\":\\"식당\\",\\"duration\\":\\"1시간\\",\\"notes\\":\\"유명한 ㅁㅁ 멘치카츠 맛보기\\",\\"cost\\":\\"800\\",\\"address\\":\\"ㅁㅁ 주소\\"}}]}},{{\\"day\\":3,\\"date\\":\\"2025-05-14\\",\\"title\\":\\"3일차: ㅁㅁ 온천 여행 및 출국\\",\\"schedules\\":[{{\\"id\\":\\"3-1\\",\\"name\\":\\"ㅁㅁ 역\\",\\"time\\":\\"09:00\\",\\"lat\\":35.6896342,\\"lng\\":139.700627,\\"category\\":\\"장소\\",\\"duration\\":\\"2시간\\",\\"notes\\":\\"ㅁㅁ에서 ㅁㅁ 온천 지역으로 이동\\",\\"cost\\":\\"2500\\",\\"address\\":\\"ㅁㅁ 주소\\"}},{{\\"id\\":\\"3-2\\",\\"name\\":\\"ㅁㅁ 유모토\\",\\"time\\":\\"11:00\\",\\"lat\\":35.232916,\\"lng\\":139.105582,\\"category\\":\\"장소\\",\\"duration\\":\\"1시간\\",\\"notes\\":\\"온천 마을 ㅁㅁ 유모토 도착 후 휴식\\",\\"cost\\":\\"0\\",\\"address\\":\\"ㅁㅁ 주소\\"}},{{\\"id\\":\\"3-3\\",\\"name\\":\\"ㅁㅁ 소바집\\",\\"time\\":\\"12:00\\",\\"lat\\":35.235083,\\"lng\\":139.108167,\\"category\\":\\"식당\\",\\"duration\\":\\"1시간\\",\\"notes\\":\\"ㅁㅁ 지역의 유명한 소바 맛집\\",\\"cost\\":\\"1500\\",\\"address\\":\\"ㅁㅁ 주소\\"}},{{\\"id\\":\\"3-4\\",\\"name\\":\\"출발 공항 이름 (예: 나리타 국제공항)\\",\\"time\\":\\"16:00\\",\\"lat\\":35.771987,\\"lng\\":140.392903,\\"category\\":\\"장소\\",\\"duration\\":\\"2시간\\",\\"notes\\":\\"출국 수속\\",\\"cost\\":\\"0\\",\\"address\\":\\"공항 주소\\"}}]}}]\n}}
-"""
-        )
+        # <규칙>/<답변형식>/응답 형식 고정 지시문은 plan_prompts에서 공유하며 컨텍스트 캐시(또는 systemInstruction)로 보냄
 
         # Gemini API 호출
         api_key = os.environ.get('GEMINI_API_KEY')
         if not api_key:
             print("환경변수 'GEMINI_API_KEY'가 설정되지 않았습니다.") # 로그 강화
             raise Exception("환경변수 'GEMINI_API_KEY'가 설정되지 않았습니다.") # 명시적 예외 발생
-            
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={api_key}"
 
         # 이미지가 있는 경우와 없는 경우 페이로드 구성
         if has_images:
@@ -389,60 +414,99 @@ JSON 예시
                 }
             }
 
-        headers = {
-            "Content-Type": "application/json"
-        }
+        if PLAN_STRUCTURED_OUTPUT:
+            payload['generationConfig'] = structured_generation_config(payload['generationConfig'], PLAN_RESPONSE_SCHEMA)
 
+        plan_cache = get_plan_cache()
+        cache_key = None
+        cached_response_text = None
+        schema_repairs = []
+        if plan_cache:
+            cache_key = make_cache_key(prompt_text + PLAN_INSTRUCTION, images, payload['generationConfig'], gemini_client.model)
+            # 다시 생성 요청이면 읽지 않고 새 결과로 갱신만 함
+            if not wants_fresh_plan(body):
+                cached_response_text = plan_cache.get(cache_key)
+
+        metrics.stop('prompt_build')
         gemini_request_start_time = time.time() # Gemini API 호출 시작 시간
-        print(f"[Gemini API] 요청 시작. URL: {url}")
-        print(f"[Gemini API] 요청 페이로드 (일부): {json.dumps(payload, cls=DecimalEncoder)[:500]}...") # 페이로드 일부 로깅
+        if cached_response_text:
+            # 동일 요청(더블 클릭, 재시도 등)의 이전 응답 재사용
+            metrics.count('plan_cache_hit')
+            gemini_result = json.loads(cached_response_text, parse_float=Decimal)
+            print(f"[PlanCache] 캐시 적중: Gemini 호출 생략. 통계: {plan_cache.stats}")
+        else:
+            print(f"[Gemini API] 요청 시작. 모델: {gemini_client.model}")
+            metrics.count('plan_cache_miss')
+            log.debug('Gemini API 요청 페이로드', payload=payload)  # 이미지(inline_data)는 크기만
 
-        req = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'), headers=headers) # 인코딩 명시
-        gemini_result_text = None
-        try:
-            # urlopen에 timeout 설정 (예: 50초)
-            with urllib.request.urlopen(req, timeout=50) as res: # timeout 초 단위
-                gemini_response_status = res.status
-                gemini_result_text = res.read().decode('utf-8') # 디코딩 명시
-            gemini_request_end_time = time.time() # Gemini API 호출 종료 시간
-            print(f"[Gemini API] 응답 수신 완료. 상태 코드: {gemini_response_status}, 소요 시간: {gemini_request_end_time - gemini_request_start_time:.2f}초")
+            try:
+                # timeout 초 단위 (예: 50초)
+                gemini_response = context_cache.call(lambda p: gemini_client.generate_content(p, timeout=50), payload, PLAN_INSTRUCTION)
+                gemini_request_end_time = time.time() # Gemini API 호출 종료 시간
+                timings = gemini_response.timings
+                metrics.put('gemini_ttfb', timings['ttfb'] * 1000)
+                print(f"[Gemini API] 응답 수신 완료. 상태 코드: {gemini_response.status}, 소요 시간: {gemini_request_end_time - gemini_request_start_time:.2f}초 (연결: {timings['connect']:.2f}초, 첫 바이트: {timings['ttfb']:.2f}초, 연결 재사용: {gemini_response.reused})")
             
-            gemini_result = json.loads(gemini_result_text, parse_float=Decimal)
-
-        except urllib.error.HTTPError as e:
-            gemini_request_end_time = time.time()
-            print(f"[Gemini API] HTTPError 발생. 상태 코드: {e.code}, 소요 시간: {gemini_request_end_time - gemini_request_start_time:.2f}초, 이유: {e.reason}")
-            print(f"[Gemini API] HTTPError 내용: {e.read().decode('utf-8', errors='replace')}") # 오류 내용 디코딩 시도
-            raise Exception(f"Gemini API HTTPError: {e.code} - {e.reason}")
-        except urllib.error.URLError as e:
-            gemini_request_end_time = time.time()
-            print(f"[Gemini API] URLError 발생. 소요 시간: {gemini_request_end_time - gemini_request_start_time:.2f}초, 이유: {e.reason}")
-            # e.reason이 문자열이 아닌 경우 처리 (예: socket.timeout 객체)
-            reason_str = str(e.reason) if hasattr(e.reason, '__str__') else repr(e.reason)
-            raise Exception(f"Gemini API URLError: {reason_str}")
-        except Exception as e: # 그 외 예외 (json.loads 등)
-            gemini_request_end_time = time.time()
-            print(f"[Gemini API] 처리 중 기타 오류 발생. 소요 시간: {gemini_request_end_time - gemini_request_start_time:.2f}초, 오류: {str(e)}")
-            if gemini_result_text: # 응답이 있었지만 파싱 실패한 경우 로그
-                 print(f"[Gemini API] 오류 발생 시 응답 텍스트 (일부): {gemini_result_text[:500]}...")
-            raise Exception(f"Gemini API 응답 처리 중 오류: {str(e)}")
-
-
-        print('Gemini 응답 (일부):', json.dumps(gemini_result, ensure_ascii=False, cls=DecimalEncoder)[:500] + "...") # 로그 길이 제한
+                gemini_result = gemini_response.json(parse_float=Decimal)
+
+                # maxOutputTokens에서 끊긴 경우 마지막 완성 일정부터 이어서 생성 (REST 응답 시간을 고려해 1회만)
+                continued_envelope, continuation_rounds = continue_if_truncated(
+                    gemini_client, context_cache.apply(payload, PLAN_INSTRUCTION), gemini_result, timeout=50, max_rounds=1,
+                    keys=COMPACT_KEYS if PLAN_STRUCTURED_OUTPUT else PLAN_KEYS)
+                if continuation_rounds:
+                    gemini_result = json.loads(json.dumps(continued_envelope, cls=DecimalEncoder), parse_float=Decimal)
+                    print(f"[Gemini API] 이어서 생성 완료: 추가 호출 {continuation_rounds}회, 누적 시간: {time.time() - gemini_request_start_time:.2f}초")
+
+                # 짧은 필드 이름 -> 프론트엔드가 읽는 days[].schedules[] 구조로 펼쳐서 저장
+                if PLAN_STRUCTURED_OUTPUT:
+                    _, schema_repairs = expand_envelope_text(gemini_result, expand_plan)
+                metrics.record_since('gemini_total', gemini_request_start_time)
+
+            except GeminiAPIError as e:
+                gemini_request_end_time = time.time()
+                metrics.count('gemini_error')
+                if e.status:
+                    print(f"[Gemini API] HTTPError 발생. 상태 코드: {e.status}, 소요 시간: {gemini_request_end_time - gemini_request_start_time:.2f}초")
+                    print(f"[Gemini API] HTTPError 내용: {e.body}")
+                    raise Exception(f"Gemini API HTTPError: {e.status}")
+                print(f"[Gemini API] 연결 오류 발생. 소요 시간: {gemini_request_end_time - gemini_request_start_time:.2f}초, 이유: {str(e)}")
+                raise Exception(f"Gemini API URLError: {str(e)}")
+            except Exception as e: # 그 외 예외 (json.loads 등)
+                gemini_request_end_time = time.time()
+                print(f"[Gemini API] 처리 중 기타 오류 발생. 소요 시간: {gemini_request_end_time - gemini_request_start_time:.2f}초, 오류: {str(e)}")
+                raise Exception(f"Gemini API 응답 처리 중 오류: {str(e)}")
+
+
+        log.debug('Gemini 응답', usage=gemini_result.get('usageMetadata'))
+
+        # 설명문/코드 블록/trailing comma 등이 섞인 응답은 저장 전에 정리된 JSON 텍스트로 교체
+        with metrics.timer('parse'):
+            final_parsed_plan_for_warning_check, json_repairs = normalize_envelope_text(gemini_result)
+        json_repairs = sorted(set(schema_repairs + json_repairs))
+        if json_repairs:
+            print(f"[PlanJSON] 응답 JSON 복구: {json_repairs}")
 
         # DynamoDB에 저장
         dynamodb_write_start_time = time.time() # DynamoDB 저장 시작 시간
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table('travel-plans')
+        table = get_table('travel-plans')  # warm 호출 간 재사용
 
-        plan_id = f'plan-{int(time.time())}'
+        # 원장에 예약된 ID(재시도해도 같은 항목에 저장) 또는 새 시간순 고유 ID (plan-밀리초-무작위)
+        plan_id = ledger_entry['plan_id'] if ledger_entry else new_plan_id()
         
         # 항공편 정보를 별도의 필드로 저장
         save_item = {
             'user_id': user_id,  # 이메일을 사용자 ID로 저장
             'planId': plan_id,
-            'plan_data': gemini_result,
         }
+        # 파싱된 계획을 압축해 plan_blob으로 저장 (파싱 실패 시 예전처럼 응답 envelope 그대로 plan_data)
+        save_item.update(plan_item_attributes(gemini_result, final_parsed_plan_for_warning_check, start_date, end_date))
+        # 목록 요약 인덱스(PlanSummaryIndex)에 투영되는 요약 속성 (제목, 기간, 목적지, 썸네일 도시 코드, 결제 여부)
+        save_item.update(summary_attributes(final_parsed_plan_for_warning_check,
+                                            [flight_info] if flight_info else None,
+                                            [accommodation_info] if accommodation_info else None,
+                                            start_date, end_date))
+        # 수정 람다(modifyPlanAsync)의 조건부 쓰기 기준 버전
+        save_item['plan_version'] = INITIAL_PLAN_VERSION
         
         # 항공편 정보가 있으면 추가
         if flight_info:
@@ -462,11 +526,17 @@ JSON 예시
             except Exception:
                 save_item['accmo_info'] = str(accommodation_info)
 
-        print("저장할 항목:", json.dumps(save_item, cls=DecimalEncoder))
+        log.debug('저장할 항목', item=save_item)
+        # 400KB 항목 한도에 가까우면 큰 속성(항공편/숙박 원본, 계획 본문)을 S3로 옮기고 포인터만 저장
+        save_item = offload_large_attributes(save_item)
         
-        table.put_item(Item=save_item)
-        dynamodb_write_end_time = time.time() # DynamoDB 저장 종료 시간
-        print(f"DynamoDB 저장 완료. 소요 시간: {dynamodb_write_end_time - dynamodb_write_start_time:.2f}초")
+        if ledger_entry:
+            table.put_item(Item=save_item)
+            plan_ledger.complete(ledger_entry)
+        else:
+            table.put_item(Item=save_item, ConditionExpression='attribute_not_exists(planId)')
+        dynamodb_write_duration = metrics.record_since('dynamodb_write', dynamodb_write_start_time)
+        print(f"DynamoDB 저장 완료. 소요 시간: {dynamodb_write_duration:.2f}초")
 
         # --- 전체 함수 실행 종료 시간 기록 ---
         lambda_end_time = time.time()
@@ -480,22 +550,12 @@ JSON 예시
             'plan': gemini_result
         }
 
-        # (선택 사항) Gemini 결과 파싱 시도 및 경고 추가
-        final_parsed_plan_for_warning_check = None
-        if gemini_result and 'candidates' in gemini_result and gemini_result['candidates']:
-            try:
-                plan_text_content = gemini_result['candidates'][0]['content']['parts'][0]['text']
-                cleaned_plan_text = plan_text_content.strip()
-                if cleaned_plan_text.startswith("```json"):
-                    cleaned_plan_text = cleaned_plan_text[7:]
-                if cleaned_plan_text.endswith("```"):
-                    cleaned_plan_text = cleaned_plan_text[:-3]
-                final_parsed_plan_for_warning_check = json.loads(cleaned_plan_text.strip(), parse_float=Decimal)
-            except Exception as e:
-                print(f"Error parsing Gemini response content (for warning check only): {str(e)}")
-        
-        if not final_parsed_plan_for_warning_check:
+        # 파싱에 실패했거나 끊긴 부분을 잘라내고 복구한 경우 경고
+        if not final_parsed_plan_for_warning_check or 'truncated' in json_repairs:
              client_response_body['warning'] = '계획 내용이 백엔드에서 완전히 파싱되지 않았을 수 있습니다. ID로 조회하여 확인하세요.'
+        elif plan_cache and not cached_response_text:
+            # 정상적으로 파싱된 응답만 캐시에 저장
+            plan_cache.put(cache_key, json.dumps(gemini_result, ensure_ascii=False, cls=DecimalEncoder))
 
         return {
             'statusCode': 200,
@@ -513,6 +573,7 @@ JSON 예시
         lambda_end_time = time.time()
         total_lambda_duration = lambda_end_time - lambda_start_time
         error_message = str(e)
+        request_error = e
         print(f'Lambda 함수 총 실행 시간 (오류 발생): {total_lambda_duration:.2f}초, 오류: {error_message}')
 
         # 오류 응답에도 CORS 헤더 포함
@@ -528,4 +589,8 @@ JSON 예시
                 'message': '오류가 발생했습니다.',
                 'error': error_message 
             }, ensure_ascii=False) # cls=DecimalEncoder 불필요할 수 있음
-        }
\ No newline at end of file
+        }
+
+    finally:
+        metrics.flush()
+        finish_trace(error=request_error)
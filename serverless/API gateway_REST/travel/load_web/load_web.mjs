@@ -1,13 +1,23 @@
 import { DynamoDBClient } from "@aws-sdk/client-dynamodb";
-import { DynamoDBDocumentClient, GetCommand, QueryCommand } from "@aws-sdk/lib-dynamodb";
+import { DynamoDBDocumentClient, GetCommand, QueryCommand, BatchGetCommand } from "@aws-sdk/lib-dynamodb";
+import { S3Client, GetObjectCommand } from "@aws-sdk/client-s3";
 import jwt from 'jsonwebtoken';
+import { inflateSync } from 'zlib';
+import { readFile } from 'fs/promises';
+import os from 'os';
+import path from 'path';
 
 // DynamoDB v3 클라이언트 설정
 const client = new DynamoDBClient({ region: process.env.AWS_REGION || "ap-northeast-2" });
 const docClient = DynamoDBDocumentClient.from(client); // DocumentClient
+const s3Client = new S3Client({ region: process.env.AWS_REGION || "ap-northeast-2" });
 
 const TABLE_NAME = 'travel-plans';
 const INDEX_NAME = 'UserIdIndex11'; // UserIdIndex11 인덱스 사용
+const BOOKING_ARTIFACT_TABLE = process.env.BOOKING_ARTIFACT_TABLE; // 항공편/숙박 원본 저장소 (booking_refs)
+const SUMMARY_INDEX_NAME = process.env.PLAN_SUMMARY_INDEX || 'PlanSummaryIndex'; // 목록 요약 인덱스 (희소 GSI)
+const LIST_DEFAULT_LIMIT = 20;
+const LIST_MAX_LIMIT = 50;
 
 // 공통 응답 헤더
 const responseHeaders = {
@@ -27,6 +37,154 @@ function decodeJwt(token) {
   }
 }
 
+// S3로 옮겨진 큰 속성 복원 (저장 쪽은 Lambda_Layer/python/plan_overflow.py)
+// overflow = { bucket, attributes: { 속성 이름: { key, type: 'S'|'B'|'J', size } } }
+// 포인터가 있는 항목만, 필요한 객체를 병렬로 읽는다. 항목에 이미 같은 속성이 있으면(이후 부분 업데이트 값) 그 값을 유지.
+async function restoreOverflow(item) {
+  const pointer = item && item.overflow;
+  if (!pointer || !pointer.attributes) return item;
+  const entries = Object.entries(pointer.attributes).filter(([name]) => item[name] === undefined);
+  await Promise.all(entries.map(async ([name, ref]) => {
+    try {
+      const data = await readOverflowObject(pointer.bucket, ref.key);
+      if (ref.type === 'B') {
+        item[name] = data;
+      } else {
+        item[name] = ref.type === 'J' ? JSON.parse(data.toString('utf8')) : data.toString('utf8');
+      }
+    } catch (error) {
+      console.error(`overflow 속성 ${name} 읽기 오류 (${ref.key}):`, error);
+    }
+  }));
+  delete item.overflow;
+  return item;
+}
+
+// 'local' 버킷은 파일 시스템 대체 구현 (테스트용, PLAN_OVERFLOW_LOCAL_DIR)
+async function readOverflowObject(bucket, key) {
+  if (bucket === 'local') {
+    const root = process.env.PLAN_OVERFLOW_LOCAL_DIR || path.join(os.tmpdir(), 'plan-overflow');
+    return readFile(path.join(root, bucket, key));
+  }
+  const result = await s3Client.send(new GetObjectCommand({ Bucket: bucket, Key: key }));
+  return Buffer.from(await result.Body.transformToByteArray());
+}
+
+// 항공편/숙박 참조 해석 (저장 쪽은 Lambda_Layer/python/booking_artifacts.py)
+// booking_refs = ['f:<해시>', ..., 'a:<해시>', ...] 를 원본 저장소에서 읽어 예전 속성
+// (flight_info_N, accmo_info_N, total_flights, total_accommodations)으로 채운다.
+// 항목에 이미 flight_info_N/accmo_info_N이 있으면(이후 부분 업데이트 값) 그 목록을 유지.
+async function resolveBookingRefs(item) {
+  const refs = item && item.booking_refs;
+  if (!Array.isArray(refs) || refs.length === 0) return item;
+  if (!BOOKING_ARTIFACT_TABLE) {
+    console.error('BOOKING_ARTIFACT_TABLE 환경 변수가 없어 booking_refs를 해석할 수 없습니다.');
+    return item;
+  }
+  const texts = {};
+  const uniqueRefs = [...new Set(refs)];
+  // BatchGet은 한 번에 100개까지, 처리되지 않은 키는 잠시 기다렸다가 다시 요청
+  for (let start = 0; start < uniqueRefs.length; start += 100) {
+    let keys = uniqueRefs.slice(start, start + 100).map(ref => ({ artifact_id: ref }));
+    for (let attempt = 0; keys.length > 0 && attempt < 5; attempt++) {
+      if (attempt > 0) await new Promise(resolve => setTimeout(resolve, 50 * 2 ** attempt));
+      const result = await docClient.send(new BatchGetCommand({ RequestItems: { [BOOKING_ARTIFACT_TABLE]: { Keys: keys } } }));
+      ((result.Responses || {})[BOOKING_ARTIFACT_TABLE] || []).forEach(artifact => {
+        texts[artifact.artifact_id] = artifact.data;
+      });
+      keys = ((result.UnprocessedKeys || {})[BOOKING_ARTIFACT_TABLE] || {}).Keys || [];
+    }
+  }
+  fillNumberedAttributes(item, refs.filter(ref => ref.startsWith('f:')), 'flight_info_', 'total_flights', texts);
+  fillNumberedAttributes(item, refs.filter(ref => ref.startsWith('a:')), 'accmo_info_', 'total_accommodations', texts);
+  delete item.booking_refs;
+  return item;
+}
+
+function fillNumberedAttributes(item, refs, prefix, totalName, texts) {
+  if (refs.length === 0 || Object.keys(item).some(name => name.startsWith(prefix))) return;
+  refs.forEach((ref, index) => {
+    if (texts[ref] !== undefined) {
+      item[`${prefix}${index + 1}`] = texts[ref];
+    } else {
+      console.error('참조한 항공편/숙박 정보가 없습니다:', ref);
+    }
+  });
+  item[totalName] = refs.length;
+}
+
+// 저장 형식 차이(S3 오프로드, 항공편/숙박 참조, 압축 계획)를 풀어 예전 항목 구조로 복원
+async function restoreStoredItem(item) {
+  await restoreOverflow(item);
+  await resolveBookingRefs(item);
+  return expandStoredPlan(item);
+}
+
+// 계획 목록: 요약 인덱스(희소 GSI, 저장 쪽은 Lambda_Layer/python/plan_summary_index.py)만 Query
+// 인덱스에는 제목/기간/목적지/썸네일 도시 코드/결제 여부만 투영되어 계획 본문과 항공편/숙박 원본을 읽지 않는다.
+// 커서는 LastEvaluatedKey를 base64url JSON으로 감싼 값 (다른 사용자의 파티션으로 이어 읽지 못하도록 user_id 확인)
+function encodeListCursor(key) {
+  return key ? Buffer.from(JSON.stringify(key)).toString('base64url') : null;
+}
+
+function decodeListCursor(cursor, userId) {
+  if (!cursor) return undefined;
+  let key = null;
+  try {
+    key = JSON.parse(Buffer.from(String(cursor), 'base64url').toString('utf8'));
+  } catch (err) {
+    key = null;
+  }
+  if (!key || key.user_id !== userId) {
+    throw new Error('잘못된 목록 커서입니다.');
+  }
+  return key;
+}
+
+function listQueryParams(userId, requestBody) {
+  const limit = Math.min(Math.max(parseInt(requestBody.limit, 10) || LIST_DEFAULT_LIMIT, 1), LIST_MAX_LIMIT);
+  const params = {
+    TableName: TABLE_NAME,
+    IndexName: SUMMARY_INDEX_NAME,
+    KeyConditionExpression: 'user_id = :uid',
+    ExpressionAttributeValues: { ':uid': userId },
+    ScanIndexForward: false, // 최근 생성/수정 순
+    Limit: limit
+  };
+  const startKey = decodeListCursor(requestBody.cursor, userId);
+  if (startKey) params.ExclusiveStartKey = startKey;
+  return params;
+}
+
+// 압축 저장 형식(plan_blob) 해제: 헤더 'TP' + 형식 버전(1) + 압축 방식(1 = zlib) + zlib(계획 JSON)
+// (저장 쪽은 Lambda_Layer/python/plan_storage.py)
+function decodePlanBlob(blob) {
+  const data = Buffer.from(blob);
+  if (data.length < 4 || data.toString('latin1', 0, 2) !== 'TP') {
+    throw new Error('plan_blob 헤더가 올바르지 않습니다');
+  }
+  if (data[2] !== 1 || data[3] !== 1) {
+    throw new Error(`지원하지 않는 plan_blob 형식입니다 (버전 ${data[2]}, 압축 ${data[3]})`);
+  }
+  return JSON.parse(inflateSync(data.subarray(4)).toString('utf8'));
+}
+
+// plan_blob으로 저장된 항목의 plan_data를 예전 형식(Gemini 응답 구조)으로 복원
+// 이후 처리와 클라이언트 응답(originalData 포함)은 저장 형식을 구분하지 않는다.
+function expandStoredPlan(item) {
+  if (!item || !item.plan_blob) return item;
+  try {
+    const plan = decodePlanBlob(item.plan_blob);
+    item.plan_data = {
+      candidates: [{ content: { parts: [{ text: JSON.stringify(plan) }], role: 'model' }, finishReason: 'STOP' }]
+    };
+  } catch (error) {
+    console.error('plan_blob 해제 오류:', error);
+  }
+  delete item.plan_blob;
+  return item;
+}
+
 // Gemini API 응답에서 JSON 데이터 추출
 function extractGeminiJsonData(planData) {
   try {
@@ -316,7 +474,7 @@ export const handler = async (event) => {
           body: JSON.stringify({ message: '해당 ID의 여행 계획을 찾을 수 없습니다.' })
         };
       }
-      const planItem = result.Item;
+      const planItem = await restoreStoredItem(result.Item);
       const processedData = processItemData(planItem);
       
       // travel-plans 테이블에서 다중 항공편/숙박편 정보 추출 (saved-plans와 동일한 로직)
@@ -392,6 +550,42 @@ export const handler = async (event) => {
         })
       };
     }
+  } else if (requestBody.list === true) {
+    // 계획 목록 조회 (요약 인덱스 페이지 단위)
+    let params;
+    try {
+      params = listQueryParams(userId, requestBody);
+    } catch (err) {
+      return {
+        statusCode: 400,
+        headers: responseHeaders,
+        body: JSON.stringify({ message: err.message })
+      };
+    }
+    try {
+      console.log('목록 QueryCommand 파라미터:', JSON.stringify(params));
+      const result = await docClient.send(new QueryCommand(params));
+      console.log(`목록 QueryCommand 결과: ${(result.Items || []).length}개, 다음 페이지 ${result.LastEvaluatedKey ? '있음' : '없음'}`);
+      return {
+        statusCode: 200,
+        headers: responseHeaders,
+        body: JSON.stringify({
+          message: '여행 계획 목록을 성공적으로 불러왔습니다.',
+          plans: result.Items || [],
+          nextCursor: encodeListCursor(result.LastEvaluatedKey)
+        })
+      };
+    } catch (err) {
+      console.error('목록 Query 오류:', err);
+      return {
+        statusCode: 500,
+        headers: responseHeaders,
+        body: JSON.stringify({
+          message: '여행 계획 목록 조회 중 오류가 발생했습니다.',
+          error: err.message
+        })
+      };
+    }
   } else if (requestBody.newest === true || Object.keys(requestBody).length === 0) {
     const params = {
       TableName: TABLE_NAME,
@@ -415,7 +609,7 @@ export const handler = async (event) => {
           body: JSON.stringify({ message: '여행 계획을 찾을 수 없습니다.' })
         };
       }
-      const planItem = result.Items[0];
+      const planItem = await restoreStoredItem(result.Items[0]);
       const processedData = processItemData(planItem);
       
       // travel-plans 테이블에서 다중 항공편/숙박편 정보 추출 (saved-plans와 동일한 로직)
@@ -496,7 +690,7 @@ export const handler = async (event) => {
       statusCode: 400,
       headers: responseHeaders,
       body: JSON.stringify({
-        message: '잘못된 요청 형식입니다. "newest: true" 또는 "id: [플랜ID]"를 지정해주세요.'
+        message: '잘못된 요청 형식입니다. "newest: true", "list: true" 또는 "id: [플랜ID]"를 지정해주세요.'
       })
     };
   }
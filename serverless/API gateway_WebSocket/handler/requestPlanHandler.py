@@ -1,21 +1,18 @@
 import json
-import boto3
 import os
+import uuid
+from lambda_runtime import get_client, get_websocket_client  # Lambda Layer 공용 모듈
+from lambda_log import get_logger, start_request
+from lambda_tracing import start_trace, finish_trace, current_trace, span
 
-# SQS 클라이언트 초기화
-sqs = boto3.client('sqs')
+log = get_logger('requestPlanHandler')
+
+# SQS/WebSocket client는 lambda_runtime에서 처음 쓸 때 만들어 warm 호출 간 재사용
 SQS_QUEUE_URL = os.environ.get('SQS_QUEUE_URL')  # 환경 변수에서 SQS 큐 URL 가져오기
 
-# WebSocket 메시지 전송 클라이언트 (선택적 초기 응답용)
-apigw_management_client = None
-WEBSOCKET_API_ENDPOINT = os.environ.get('WEBSOCKET_API_ENDPOINT') # Lambda ②와 동일한 환경변수 사용 가능
-if WEBSOCKET_API_ENDPOINT:
-    apigw_management_client = boto3.client(
-        'apigatewaymanagementapi',
-        endpoint_url=WEBSOCKET_API_ENDPOINT
-    )
 
 def send_websocket_message(connection_id, message_data):
+    apigw_management_client = get_websocket_client()
     if not apigw_management_client:
         print(f"WebSocket 클라이언트(apigw_management_client)가 초기화되지 않아 초기 응답을 보낼 수 없습니다.")
         return
@@ -30,22 +27,33 @@ def send_websocket_message(connection_id, message_data):
 
 
 def lambda_handler(event, context):
-    print("Lambda ① (요청 수신) 이벤트:", json.dumps(event, ensure_ascii=False))
+    # 요청 추적 시작: 여기서 발급한 traceId를 SQS 메시지 속성으로 createPlanAsync까지 넘김
+    start_trace('requestPlanHandler')
+    response = None
+    try:
+        response = handle_request(event, context)
+        return response
+    finally:
+        finish_trace(error=None if response and response.get('statusCode') == 200 else (response or {}).get('body'))
 
+
+def handle_request(event, context):
     connection_id = event.get('requestContext', {}).get('connectionId')
+    trace = current_trace()
     
     # API Gateway v2 HTTP API (WebSocket) 페이로드에서 body 추출
     # event['body']는 문자열 형태일 수 있음
     raw_body = event.get('body', '{}') 
+    # 본문(이미지 base64 포함)은 통째로 남기지 않고 크기만 기록
+    log.info('Lambda ① (요청 수신)', connectionId=connection_id, bodyChars=len(raw_body or ''))
     
     try:
         # 클라이언트가 JSON 문자열을 보냈다고 가정하고 파싱
         client_request_data = json.loads(raw_body)
-        print(f"파싱된 클라이언트 요청 데이터 ({connection_id}): {json.dumps(client_request_data, ensure_ascii=False)}")
     except json.JSONDecodeError as e:
-        print(f"본문 파싱 오류 ({connection_id}): 유효한 JSON이 아님 - '{raw_body}', 오류: {str(e)}")
+        log.error('본문 파싱 오류: 유효한 JSON이 아님', connectionId=connection_id, body=raw_body, error=str(e))
         # 오류 응답을 클라이언트에게 보낼 수도 있음
-        if connection_id and apigw_management_client:
+        if connection_id and get_websocket_client():
             send_websocket_message(connection_id, {
                 "action": "error", 
                 "message": "요청 형식이 올바르지 않습니다."
@@ -59,7 +67,7 @@ def lambda_handler(event, context):
     if not SQS_QUEUE_URL:
         print("SQS_QUEUE_URL 환경 변수가 설정되지 않았습니다.")
         # 필요시 클라이언트에게 오류 알림
-        if connection_id and apigw_management_client:
+        if connection_id and get_websocket_client():
              send_websocket_message(connection_id, {
                 "action": "error", 
                 "message": "서버 내부 구성 오류로 요청을 처리할 수 없습니다."
@@ -69,27 +77,40 @@ def lambda_handler(event, context):
     # SQS로 보낼 메시지 구성
     # Lambda ② (createPlanAsync.py)가 기대하는 형식에 맞춰야 함
     # requestData 필드에 클라이언트가 보낸 원본 요청 전체를 넣음
+    # clientRequestId: 같은 요청의 재시도/중복 전달을 createPlanAsync 멱등성 원장에서 식별하는 ID
+    # (클라이언트가 보내지 않으면 여기서 발급하여 SQS 중복 전달만이라도 걸러냄)
+    client_request_id = client_request_data.get('clientRequestId') or str(uuid.uuid4())
+    # createPlanAsync와 같은 clientRequestId로 샘플링하여 한 요청의 로그를 두 람다에서 함께 볼 수 있게 함
+    start_request(client_request_id, connectionId=connection_id, traceId=trace.trace_id)
+    trace.attributes.update(clientRequestId=client_request_id, connectionId=connection_id)
+    log.debug('파싱된 클라이언트 요청 데이터', request=client_request_data)
     message_to_sqs = {
         'connectionId': connection_id,
+        'clientRequestId': client_request_id,
         'requestData': client_request_data  # 클라이언트가 보낸 body 전체
     }
 
     try:
-        print(f"SQS로 메시지 전송 시도 ({connection_id}): Queue - {SQS_QUEUE_URL}")
-        print(f"전송할 메시지 내용: {json.dumps(message_to_sqs, ensure_ascii=False)}")
+        # 메시지는 한 번만 직렬화하여 전송에 사용 (로그에는 크기만)
+        message_body = json.dumps(message_to_sqs, ensure_ascii=False)
+        log.info('SQS로 메시지 전송 시도', queue=SQS_QUEUE_URL, messageChars=len(message_body))
         
-        response = sqs.send_message(
-            QueueUrl=SQS_QUEUE_URL,
-            MessageBody=json.dumps(message_to_sqs, ensure_ascii=False),
-            # MessageGroupId, MessageDeduplicationId 등 FIFO 큐 사용 시 필요할 수 있음
-        )
+        with span('sqs_send'):
+            response = get_client('sqs').send_message(
+                QueueUrl=SQS_QUEUE_URL,
+                MessageBody=message_body,
+                MessageAttributes=trace.message_attributes(),  # traceId, parentSpanId
+                # MessageGroupId, MessageDeduplicationId 등 FIFO 큐 사용 시 필요할 수 있음
+            )
         print(f"SQS 메시지 성공적으로 전송 ({connection_id}). MessageId: {response.get('MessageId')}")
 
         # (선택 사항) 클라이언트에게 요청 접수 확인 메시지 전송
-        if apigw_management_client:
+        if get_websocket_client():
             send_websocket_message(connection_id, {
                 "action": "request_received", 
-                "message": "요청이 성공적으로 접수되었습니다. AI가 계획 생성을 시작합니다."
+                "message": "요청이 성공적으로 접수되었습니다. AI가 계획 생성을 시작합니다.",
+                "clientRequestId": client_request_id,
+                "traceId": trace.trace_id  # 문의 시 이 ID로 전체 처리 과정을 조회
             })
         
         # API Gateway WebSocket 통합은 일반적으로 200 OK 응답을 기대함
@@ -98,7 +119,7 @@ def lambda_handler(event, context):
     except Exception as e:
         print(f"SQS 메시지 전송 실패 ({connection_id}): {str(e)}")
         # 클라이언트에게 오류 알림 (선택적)
-        if connection_id and apigw_management_client:
+        if connection_id and get_websocket_client():
             send_websocket_message(connection_id, {
                 "action": "error", 
                 "message": "요청 처리 중 서버 내부 오류가 발생했습니다.",
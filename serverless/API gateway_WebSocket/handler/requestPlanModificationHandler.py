@@ -1,22 +1,18 @@
 import json
-import boto3
 import os
+from lambda_runtime import get_client, get_websocket_client  # Lambda Layer 공용 모듈
+from lambda_log import get_logger, start_request
+from lambda_tracing import start_trace, finish_trace, current_trace, span
 
-# SQS 클라이언트 초기화
-sqs = boto3.client('sqs')
+log = get_logger('requestPlanModificationHandler')
+
+# SQS/WebSocket client는 lambda_runtime에서 처음 쓸 때 만들어 warm 호출 간 재사용
 # 생성하신 modifyPlanQueue의 URL을 환경 변수로 설정해야 합니다.
 SQS_QUEUE_URL = os.environ.get('MODIFY_PLAN_SQS_QUEUE_URL') # 예: https://sqs.ap-northeast-2.amazonaws.com/977099017123/modifyPlanQueue
 
-# WebSocket 메시지 전송 클라이언트 (초기 응답용)
-apigw_management_client = None
-WEBSOCKET_API_ENDPOINT = os.environ.get('WEBSOCKET_API_ENDPOINT')
-if WEBSOCKET_API_ENDPOINT:
-    apigw_management_client = boto3.client(
-        'apigatewaymanagementapi',
-        endpoint_url=WEBSOCKET_API_ENDPOINT
-    )
 
 def send_websocket_message(connection_id, message_data):
+    apigw_management_client = get_websocket_client()
     if not apigw_management_client:
         print(f"WebSocket 클라이언트(apigw_management_client)가 초기화되지 않아 초기 응답을 보낼 수 없습니다.")
         return
@@ -30,17 +26,31 @@ def send_websocket_message(connection_id, message_data):
         print(f"Failed to send initial response to {connection_id}: {str(e)}")
 
 def lambda_handler(event, context):
-    print("Lambda (Plan Modification Request) 이벤트:", json.dumps(event, ensure_ascii=False))
+    # 요청 추적 시작: 여기서 발급한 traceId를 SQS 메시지 속성으로 modifyPlanAsync까지 넘김
+    start_trace('requestPlanModificationHandler')
+    response = None
+    try:
+        response = handle_request(event, context)
+        return response
+    finally:
+        finish_trace(error=None if response and response.get('statusCode') == 200 else (response or {}).get('body'))
 
+
+def handle_request(event, context):
     connection_id = event.get('requestContext', {}).get('connectionId')
     raw_body = event.get('body', '{}')
+    trace = current_trace()
+    trace.attributes.update(connectionId=connection_id)
+    start_request(event.get('requestContext', {}).get('requestId'), connectionId=connection_id, traceId=trace.trace_id)
+    # 본문(travelPlans 전체 포함)은 통째로 남기지 않고 크기만 기록
+    log.info('Lambda (Plan Modification Request) 요청 수신', bodyChars=len(raw_body or ''))
 
     try:
         client_request_data = json.loads(raw_body)
-        print(f"파싱된 클라이언트 수정 요청 데이터 ({connection_id}): {json.dumps(client_request_data, ensure_ascii=False)}")
+        log.debug('파싱된 클라이언트 수정 요청 데이터', request=client_request_data)
     except json.JSONDecodeError as e:
-        print(f"본문 파싱 오류 ({connection_id}): 유효한 JSON이 아님 - '{raw_body}', 오류: {str(e)}")
-        if connection_id and apigw_management_client:
+        log.error('본문 파싱 오류: 유효한 JSON이 아님', body=raw_body, error=str(e))
+        if connection_id and get_websocket_client():
             send_websocket_message(connection_id, {
                 "action": "ai_modification_error", # 프론트엔드와 일치하는 오류 액션
                 "message": "요청 형식이 올바르지 않습니다 (JSON 파싱 실패)."
@@ -54,7 +64,7 @@ def lambda_handler(event, context):
 
     if not SQS_QUEUE_URL:
         print("MODIFY_PLAN_SQS_QUEUE_URL 환경 변수가 설정되지 않았습니다.")
-        if connection_id and apigw_management_client:
+        if connection_id and get_websocket_client():
              send_websocket_message(connection_id, {
                 "action": "ai_modification_error",
                 "message": "서버 내부 구성 오류로 계획 수정 요청을 처리할 수 없습니다."
@@ -75,26 +85,30 @@ def lambda_handler(event, context):
     # authToken은 modifyPlanAsync.py에서 JWT 디코딩에 사용됩니다.
 
     try:
-        print(f"SQS (ModifyPlanQueue)로 메시지 전송 시도 ({connection_id}): Queue - {SQS_QUEUE_URL}")
-        print(f"전송할 메시지 내용: {json.dumps(message_to_sqs, ensure_ascii=False)}")
+        # 메시지는 한 번만 직렬화하여 전송에 사용 (로그에는 크기만)
+        message_body = json.dumps(message_to_sqs, ensure_ascii=False)
+        log.info('SQS (ModifyPlanQueue)로 메시지 전송 시도', queue=SQS_QUEUE_URL, messageChars=len(message_body))
 
-        response = sqs.send_message(
-            QueueUrl=SQS_QUEUE_URL,
-            MessageBody=json.dumps(message_to_sqs, ensure_ascii=False)
-        )
+        with span('sqs_send'):
+            response = get_client('sqs').send_message(
+                QueueUrl=SQS_QUEUE_URL,
+                MessageBody=message_body,
+                MessageAttributes=trace.message_attributes()  # traceId, parentSpanId
+            )
         print(f"SQS 메시지 성공적으로 전송 ({connection_id}) to ModifyPlanQueue. MessageId: {response.get('MessageId')}")
 
-        if apigw_management_client:
+        if get_websocket_client():
             send_websocket_message(connection_id, {
                 "action": "modification_request_received", # 새로운 액션으로 변경 가능
-                "message": "계획 수정 요청이 성공적으로 접수되었습니다. AI가 계획 수정을 시작합니다."
+                "message": "계획 수정 요청이 성공적으로 접수되었습니다. AI가 계획 수정을 시작합니다.",
+                "traceId": trace.trace_id
             })
         
         return {'statusCode': 200, 'body': 'Modification request successfully sent to SQS'}
 
     except Exception as e:
         print(f"SQS 메시지 전송 실패 ({connection_id}) to ModifyPlanQueue: {str(e)}")
-        if connection_id and apigw_management_client:
+        if connection_id and get_websocket_client():
             send_websocket_message(connection_id, {
                 "action": "ai_modification_error",
                 "message": "계획 수정 요청 처리 중 서버 내부 오류가 발생했습니다.",
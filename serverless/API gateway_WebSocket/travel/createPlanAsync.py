@@ -1,11 +1,34 @@
 import json
-import urllib.request
-import boto3
 import time
 import os
 from decimal import Decimal
-import jwt  # pyjwt 라이브러리 import
-import urllib.error
+from lambda_runtime import get_table
+from lambda_log import get_logger, start_request, bind
+from lambda_metrics import start_metrics, current_metrics, queue_wait_seconds
+from lambda_tracing import start_trace_from_record, finish_trace
+from websocket_push import (ConnectionGoneError, should_cancel, is_connection_gone,
+                            is_gone_error, post_message)
+from gemini_client import get_gemini_client, GeminiAPIError, chunk_text, build_envelope  # Lambda Layer 공용 모듈
+from plan_json import DaysStreamReader, extract_json, normalize_envelope_text
+from plan_cache import get_plan_cache, make_cache_key, wants_fresh_plan
+from plan_sharding import GenerationCancelled, ShardedPlanGenerator, trip_dates
+from plan_storage import plan_item_attributes
+from plan_summary_index import summary_attributes
+from plan_overflow import offload_large_attributes
+from booking_artifacts import booking_attributes
+from plan_versions import INITIAL_PLAN_VERSION
+from plan_continuation import continue_if_truncated, PLAN_KEYS
+from plan_prompts import plan_instruction_text
+from gemini_context_cache import get_context_cache
+from sqs_batch import (process_records, batch_item_failures, time_left,
+                       should_retry, send_to_dead_letter_queue, receive_count, RetryableRecordError,
+                       RecordAbandonedError, ensure_record_active, record_abandoned)
+from plan_ledger import get_plan_ledger, new_plan_id, LEDGER_COMPLETED
+from plan_single_flight import get_single_flight, flight_key, FLIGHT_LEADER, FLIGHT_FOLLOWER
+from plan_schema import (PLAN_STRUCTURED_OUTPUT, PLAN_RESPONSE_SCHEMA, COMPACT_KEYS,
+                         structured_generation_config, expand_day, expand_plan, expand_envelope_text)
+
+log = get_logger('createPlanAsync')
 
 # Decimal을 JSON으로 직렬화할 수 있게 도와주는 함수
 class DecimalEncoder(json.JSONEncoder):
@@ -16,6 +39,7 @@ class DecimalEncoder(json.JSONEncoder):
 
 # JWT 디코딩 함수 (기존과 동일)
 def decode_jwt(token):
+    import jwt  # pyjwt: 토큰이 있는 요청에서만 필요하므로 처음 쓸 때 import (콜드 스타트 단축)
     try:
         decoded_token = jwt.decode(token, options={"verify_signature": False})
         return decoded_token
@@ -25,327 +49,418 @@ def decode_jwt(token):
         print('유효하지 않은 토큰입니다.')
     return None
 
-# WebSocket 메시지 전송을 위한 API Gateway Management API 클라이언트
+# WebSocket 메시지 전송을 위한 API Gateway Management API 클라이언트는 처음 보낼 때 만들어 warm 호출 간 재사용 (lambda_runtime)
 # WEBSOCKET_API_ENDPOINT 환경 변수 설정 필요 (예: 'https://{api_id}.execute-api.{region}.amazonaws.com/{stage}')
-apigw_management_client = None
-if 'WEBSOCKET_API_ENDPOINT' in os.environ:
-    apigw_management_client = boto3.client(
-        'apigatewaymanagementapi', 
-        endpoint_url=os.environ['WEBSOCKET_API_ENDPOINT']
-    )
-else:
+if 'WEBSOCKET_API_ENDPOINT' not in os.environ:
     print("환경변수 'WEBSOCKET_API_ENDPOINT'가 설정되지 않았습니다. WebSocket 메시지를 보낼 수 없습니다.")
 
+# Gemini 클라이언트는 컨테이너 초기화 시 한 번 생성하여 warm 호출 간 연결을 재사용
+gemini_client = get_gemini_client()
+
+# 요청마다 동일한 고정 지시문(<규칙>/<답변형식>/응답 형식)은 컨텍스트 캐시로 한 번만 처리 (캐시를 쓸 수 없으면 systemInstruction)
+context_cache = get_context_cache(gemini_client)
+PLAN_INSTRUCTION = plan_instruction_text()
+
+# 스트리밍 모드: streamGenerateContent로 받으면서 완성된 day를 plan_day_ready 액션으로 즉시 전송
+GEMINI_STREAMING = os.environ.get('GEMINI_STREAMING', 'true').lower() == 'true'
+
+# 일차별 병렬 생성: 여행 일수가 PLAN_SHARDING_MIN_DAYS 이상이거나 요청에 generationMode='sharded'가 있으면 사용
+PLAN_SHARDING_ENABLED = os.environ.get('PLAN_SHARDING_ENABLED', 'true').lower() == 'true'
+PLAN_SHARDING_MIN_DAYS = int(os.environ.get('PLAN_SHARDING_MIN_DAYS', '5'))
+
+# 구조화 출력(PLAN_STRUCTURED_OUTPUT)이면 Gemini 응답은 짧은 키(ds, s, ...)를 사용하고, 저장 전에 펼친다
+PLAN_RESPONSE_KEYS = COMPACT_KEYS if PLAN_STRUCTURED_OUTPUT else PLAN_KEYS
 
-def send_websocket_message(connection_id, message_data):
-    if not apigw_management_client:
-        print(f"WebSocket 클라이언트가 초기화되지 않아 메시지를 보낼 수 없습니다: {message_data.get('action', 'N/A')}")
-        return
 
+def send_websocket_message(connection_id, message_data):
+    """전송에 성공하면 True. 이미 끊긴 것으로 알려진 연결에는 보내지 않음 (생성/저장은 계속 진행)."""
+    if is_connection_gone(connection_id) or record_abandoned():
+        return False
+    action = message_data.get('action', 'N/A')
     try:
         message_json = json.dumps(message_data, ensure_ascii=False, cls=DecimalEncoder)
-        print(f"WebSocket 메시지 전송 시도 ({connection_id}): {message_json[:200]}...")
-        
-        apigw_management_client.post_to_connection(
-            ConnectionId=connection_id,
-            Data=message_json
-        )
-        print(f"Sent WebSocket message to {connection_id}: Action - {message_data.get('action', 'N/A')}")
-    except apigw_management_client.exceptions.GoneException:
-        print(f"클라이언트 연결이 끊어짐 ({connection_id}): Action - {message_data.get('action', 'N/A')}")
+        log.debug('WebSocket 메시지 전송 시도', connectionId=connection_id, preview=message_json[:200])
+        # 128KB를 넘는 메시지는 websocket_push가 압축/분할하여 frame_manifest + frame_chunk로 전송
+        with current_metrics().timer('websocket_push'):
+            sent = post_message(connection_id, message_json, action=action)
+        if not sent:
+            return False
+        log.debug('WebSocket 메시지 전송 완료', connectionId=connection_id, action=action)
+        return True
     except Exception as e:
-        print(f"Failed to send WebSocket message to {connection_id}: {str(e)}. Action - {message_data.get('action', 'N/A')}")
+        if is_gone_error(e):
+            # 이후 전송은 생략하고, WS_DISCONNECT_POLICY='cancel'이면 진행 중인 생성도 중단
+            current_metrics().count('websocket_gone')
+            print(f"클라이언트 연결이 끊어짐 ({connection_id}): Action - {action}")
+            return False
+        print(f"Failed to send WebSocket message to {connection_id}: {str(e)}. Action - {action}")
         print(f"에러 타입: {type(e).__name__}")
         if hasattr(e, 'response'):
             print(f"AWS 응답: {e.response}")
+    return False
+
+
+def generation_cancel_check(connection_id, single_flight=None, single_flight_key=None):
+    """생성을 중단할지 확인하는 함수. cancel 정책에서 연결이 끊겨도 같은 요청을 기다리는 구독자가 있으면
+    이후로는 persist 정책처럼 끝까지 생성해 구독자에게 전달 (기다리는 연결이 없을 때만 중단)."""
+    persist = []
+
+    def cancelled():
+        if persist or not should_cancel(connection_id):
+            return False
+        if single_flight and single_flight.has_subscribers(single_flight_key):
+            print(f"[SingleFlight] 연결이 끊겼지만 같은 요청을 기다리는 구독자가 있어 생성을 계속합니다 ({connection_id})")
+            persist.append(True)
+            return False
+        return True
+
+    return cancelled
+
+
+def generate_plan_streaming(connection_id, payload, timeout, cancelled):
+    stream_start_time = time.time()
+    stream = gemini_client.stream_generate_content(payload, timeout=timeout)
+    reader = DaysStreamReader(PLAN_RESPONSE_KEYS['days'])
+    text_parts = []
+    last_chunk = None
+    day_index = 0
+
+    chunks = iter(stream)
+    for chunk in chunks:
+        if cancelled():
+            # 응답을 끝까지 읽지 않고 닫으면 Gemini 연결도 끊겨 생성이 중단됨 (해당 연결은 풀에 반납하지 않음)
+            chunks.close()
+            raise ConnectionGoneError(connection_id)
+        last_chunk = chunk
+        text = chunk_text(chunk)
+        if not text:
+            continue
+        text_parts.append(text)
+        for day in reader.feed(text):
+            if day_index == 0:
+                print(f"[Gemini API] 첫째 날 일정 수신 ({connection_id}): {time.time() - stream_start_time:.2f}초")
+            send_websocket_message(connection_id, {
+                "action": "plan_day_ready",
+                "dayIndex": day_index,
+                "day": expand_day(day) if PLAN_STRUCTURED_OUTPUT else day
+            })
+            day_index += 1
+
+    print(f"[Gemini API] 스트림 수신 완료 ({connection_id}): 청크 {len(text_parts)}개, 전송한 day {day_index}개")
+    return build_envelope(''.join(text_parts), last_chunk), stream, day_index
+
+
+def generate_plan_sharded(connection_id, context_prompt, plan_dates, flights, accommodations, image_parts, timeout, cancelled):
+    generator = ShardedPlanGenerator(gemini_client, timeout=timeout, context_cache=context_cache)
+
+    def on_day_ready(day_index, day):
+        # cancel 정책이면 남은 일차는 기다리지 않음 (대기 중인 일차는 취소, 이미 시작한 호출은 기다리지 않음)
+        if cancelled():
+            raise ConnectionGoneError(connection_id)
+        send_websocket_message(connection_id, {
+            "action": "plan_day_ready",
+            "dayIndex": day_index,
+            "day": day
+        })
 
+    try:
+        envelope, timings = generator.generate(
+            context_prompt, plan_dates, flights, accommodations,
+            image_parts=image_parts, on_day_ready=on_day_ready,
+            should_cancel=cancelled)
+    except GenerationCancelled:
+        raise ConnectionGoneError(connection_id) from None
+    print(f"[Gemini API] 일차별 병렬 생성 완료 ({connection_id}): {len(plan_dates)}일, 뼈대 {timings['skeleton']:.2f}초, "
+          f"일차 생성 {timings['days_wall']:.2f}초 (가장 느린 날 {timings['days_slowest']:.2f}초, 합계 {timings['days_sum']:.2f}초)")
+    return envelope
+
+
+def generate_plan_blocking(payload, timeout):
+    """비스트리밍 생성 (WebSocket 없이 쓰는 배치 CLI용): 끊긴 응답 이어서 생성, 구조화 응답 펼치기, JSON 정리까지.
+    반환: (저장 형식 envelope, 구간별 시간(초), 이어서 생성한 횟수, 적용한 JSON 복구 목록)"""
+    gemini_request_start_time = time.time()
+    gemini_response = context_cache.call(
+        lambda p: gemini_client.generate_content(p, timeout=timeout), payload, PLAN_INSTRUCTION)
+    gemini_result = gemini_response.json(parse_float=Decimal)
+    continued_envelope, continuation_rounds = continue_if_truncated(
+        gemini_client, context_cache.apply(payload, PLAN_INSTRUCTION), gemini_result, timeout=timeout, keys=PLAN_RESPONSE_KEYS)
+    if continuation_rounds:
+        gemini_result = json.loads(json.dumps(continued_envelope, cls=DecimalEncoder), parse_float=Decimal)
+    timings = {'ttfb': gemini_response.timings['ttfb'], 'gemini_total': time.time() - gemini_request_start_time}
+
+    parse_start_time = time.time()
+    schema_repairs = []
+    if PLAN_STRUCTURED_OUTPUT:
+        _, schema_repairs = expand_envelope_text(gemini_result, expand_plan)
+    _, json_repairs = normalize_envelope_text(gemini_result)
+    timings['parse'] = time.time() - parse_start_time
+    return gemini_result, timings, continuation_rounds, sorted(set(schema_repairs + json_repairs))
+
+
+def replay_cached_days(connection_id, gemini_result, start_index=0):
+    # 캐시 적중 시에도 스트리밍과 같은 plan_day_ready 프레임을 보내 클라이언트 동작을 맞춤
+    # start_index: 이미 전송한 day 수 (이어서 생성한 경우 나머지만 전송)
+    reader = DaysStreamReader('days')
+    for day_index, day in enumerate(reader.feed(chunk_text(gemini_result))):
+        if day_index < start_index:
+            continue
+        send_websocket_message(connection_id, {
+            "action": "plan_day_ready",
+            "dayIndex": day_index,
+            "day": day
+        })
+
+
+def plan_created_message(plan_id):
+    # 클라이언트에게 반환할 최종 응답 (원본과 동일한 구조)
+    return {
+        "action": "plan_created",
+        "message": f"여행 계획이 성공적으로 생성되었습니다! ID: {plan_id}",
+        "planId": plan_id,
+        "redirectUrl": f"/planner/{plan_id}" # 프론트엔드 라우팅 경로
+    }
 
-def lambda_handler(event, context):
-    print("SQS 이벤트 수신:", json.dumps(event, ensure_ascii=False))
-
-    for record in event.get('Records', []):
-        lambda_start_time = time.time()
-        connection_id = None # 오류 발생 시 WebSocket 알림을 위해 미리 선언
 
-        try:
-            sqs_body_str = record.get('body')
-            if not sqs_body_str:
-                print("빈 SQS 메시지 본문입니다. 다음 레코드로 넘어갑니다.")
-                continue
-            
-            sqs_body = json.loads(sqs_body_str)
+def gemini_result_structure(gemini_result):
+    # candidate별 키와 part별 text 길이 (본문 없이 구조만)
+    if 'candidates' not in gemini_result:
+        return {'keys': list(gemini_result.keys())}
+    return [{'keys': list(candidate.keys()),
+             'textLengths': [len(part.get('text') or '') for part in candidate.get('content', {}).get('parts', [])
+                             if isinstance(part, dict)]}
+            for candidate in gemini_result['candidates']]
+
+
+def build_plan_request(request_data, connection_id):
+    """생성 요청(requestData)에서 Gemini 페이로드 구성. connection_id는 로그 구분용 (배치 CLI에서는 요청 ID).
+    반환: prompt_text, payload, images, flights/accommodations(저장용 목록), is_round_trip, start_date, end_date"""
+    query_text = request_data.get('query', '')
+    start_date = request_data.get('startDate')
+    end_date = request_data.get('endDate')
+    adults = request_data.get('adults', 1)
+    children = request_data.get('children', 0)
+    
+    # Base64 이미지 처리 추가
+    images = request_data.get('images', [])  # Base64 이미지 배열
+    has_images = len(images) > 0
+    print(f"수신된 이미지 개수 ({connection_id}): {len(images)}")
+    
+    # 다중 항공편/숙박편 지원 (하위 호환성 유지)
+    flight_info = request_data.get('flightInfo', None)  # 단일 항공편 (하위 호환성)
+    flight_infos = request_data.get('flightInfos', None)  # 다중 항공편 (새로운 방식)
+    accommodation_info = request_data.get('accommodationInfo', None)  # 단일 숙박편 (하위 호환성)
+    accommodation_infos = request_data.get('accommodationInfos', None)  # 다중 숙박편 (새로운 방식)
+    
+    # 다중 데이터가 있으면 우선 사용, 없으면 단일 데이터 사용
+    if flight_infos and len(flight_infos) > 0:
+        flights_to_process = flight_infos
+        print(f"다중 항공편 모드: {len(flight_infos)}개 항공편 처리 ({connection_id})")
+    elif flight_info:
+        flights_to_process = [flight_info]
+        print(f"단일 항공편 모드: 1개 항공편 처리 ({connection_id})")
+    else:
+        flights_to_process = []
+        print(f"항공편 없음 ({connection_id})")
+    
+    if accommodation_infos and len(accommodation_infos) > 0:
+        accommodations_to_process = accommodation_infos
+        print(f"다중 숙박편 모드: {len(accommodation_infos)}개 숙박편 처리 ({connection_id})")
+    elif accommodation_info:
+        accommodations_to_process = [accommodation_info]
+        print(f"단일 숙박편 모드: 1개 숙박편 처리 ({connection_id})")
+    else:
+        accommodations_to_process = []
+        print(f"숙박편 없음 ({connection_id})")
+    
+    is_round_trip = False # 기본값
+
+    print(f"요청 파라미터 ({connection_id}): query={query_text}, start_date={start_date}, end_date={end_date}, adults={adults}, children={children}")
+    print(f"처리할 항공편 수: {len(flights_to_process)}, 처리할 숙박편 수: {len(accommodations_to_process)} ({connection_id})")
+
+    # Geo 정보 기본값 초기화
+    out_arrival_geo_lat = None
+    out_arrival_geo_lng = None
+    in_depart_geo_lat = None
+    in_depart_geo_lng = None
+
+    # 프롬프트 구성 시작
+    prompt_text = ""
+
+    # 다중 항공편 정보 처리
+    if flights_to_process:
+        print(f"항공편 정보 처리 중 ({connection_id}): {len(flights_to_process)}개")
+        
+        # 왕복편 여부 확인 (첫 번째 항공편 기준)
+        if flights_to_process[0] and 'itineraries' in flights_to_process[0]:
+            is_round_trip = len(flights_to_process[0].get('itineraries', [])) > 1
+        
+        if is_round_trip and len(flights_to_process) == 1:
+            # 단일 왕복편 처리 (기존 로직 유지)
+            flight_info = flights_to_process[0]
+            first_itinerary = flight_info['itineraries'][0]
+            first_segment = first_itinerary['segments'][0]
+            last_segment = first_itinerary['segments'][-1]
+            origin_code = first_segment['departure']['iataCode']
+            destination_code = last_segment['arrival']['iataCode']
+            departure_date = first_segment['departure']['at']
+            departure_time = departure_date.split('T')[1][:5] if 'T' in departure_date else departure_date
+            arrival_date = last_segment['arrival']['at']
+            arrival_time = arrival_date.split('T')[1][:5] if 'T' in arrival_date else arrival_date
+            out_arrival_geo_lat = last_segment.get('arrival', {}).get('geoCode', {}).get('latitude')
+            out_arrival_geo_lng = last_segment.get('arrival', {}).get('geoCode', {}).get('longitude')
             
-            connection_id = sqs_body.get('connectionId')
-            request_data = sqs_body.get('requestData') # 프론트엔드에서 보낸 원본 요청
-
-            if not connection_id or not request_data:
-                print(f"SQS 메시지에 connectionId 또는 requestData가 누락되었습니다: {sqs_body_str}")
-                continue
+            # 도착 공항 한글명 추출
+            arrival_airport_info = last_segment.get('arrival', {}).get('airportInfo', {})
+            arrival_airport_name = arrival_airport_info.get('koreanName', destination_code)
             
-            print(f"Processing for connectionId: {connection_id}")
-            send_websocket_message(connection_id, {"action": "status_update", "message": "여행 계획 생성 요청을 수신하여 처리를 시작합니다..."})
-
-            # 사용자 ID 추출 (원본 createFunction_python.py와 동일한 방식)
-            user_id = 'anonymous'
-            auth_token_from_payload = request_data.get('authToken') # 예: "Bearer eyJ..." 또는 "eyJ..."
+            prompt_text += f"<항공편 정보>\n출발지: {origin_code}\n도착지: {destination_code}\n출발 시간: {departure_time}\n도착 시간: {arrival_time}\n도착 공항 이름: {arrival_airport_name} (공항 코드는 {destination_code})\n도착 공항 위도/경도: {out_arrival_geo_lat or 'Unknown'}/{out_arrival_geo_lng or 'Unknown'}\n\n*** 중요: 첫날 첫 번째 일정은 반드시 <항공편 정보>의 '도착지' 공항에 '도착 시간'에 도착하는 것으로 생성하고, 해당 공항의 이름, 위도, 경도를 `schedules`에 포함하세요. ***\n\n"
             
-            if auth_token_from_payload:
-                print(f'수신된 토큰 형태 ({connection_id}): {auth_token_from_payload[:30]}...')
+            # 복귀 항공편 정보
+            if len(flight_info['itineraries']) > 1:
+                return_itinerary = flight_info['itineraries'][1]
+                return_first_segment = return_itinerary['segments'][0]
+                return_last_segment = return_itinerary['segments'][-1]
+                return_departure_date = return_first_segment['departure']['at']
+                return_departure_time = return_departure_date.split('T')[1][:5] if 'T' in return_departure_date else return_departure_date
+                return_arrival_date = return_last_segment['arrival']['at']
+                return_arrival_time = return_arrival_date.split('T')[1][:5] if 'T' in return_arrival_date else return_arrival_date
+                in_depart_geo_lat = return_first_segment.get('departure', {}).get('geoCode', {}).get('latitude')
+                in_depart_geo_lng = return_first_segment.get('departure', {}).get('geoCode', {}).get('longitude')
                 
-                # "Bearer " 접두사가 있는 경우 제거 (원본과 동일)
-                if auth_token_from_payload.startswith('Bearer '):
-                    token = auth_token_from_payload[7:]  # 'Bearer ' 이후 부분 추출
-                else:
-                    token = auth_token_from_payload
+                # 출발 공항 한글명 추출
+                departure_airport_info = return_first_segment.get('departure', {}).get('airportInfo', {})
+                departure_airport_name = departure_airport_info.get('koreanName', destination_code)
                 
-                print(f'처리할 토큰 (앞부분) ({connection_id}): {token[:50]}...')
-                
-                # 개발 환경에서 test-token인 경우 처리
-                if token == 'test-token':
-                    user_id = 'dev@example.com'  # AuthContext의 개발 유저와 일치
-                    print(f'테스트 토큰 사용, 사용자 ID: {user_id} ({connection_id})')
-                else:
-                    # 실제 JWT 토큰 디코딩 시도 (원본과 동일)
-                    decoded_token = decode_jwt(token)
-                    if decoded_token:
-                        # 이메일을 사용자 ID로 사용 (원본과 동일)
-                        user_id = decoded_token.get('email', 'anonymous')
-                        print(f'토큰에서 추출한 사용자 이메일 ({connection_id}): {user_id}')
-                    else:
-                        print(f'토큰 디코딩 실패, 기본 사용자 ID 사용 ({connection_id})')
-            else:
-                print(f'Authorization 헤더가 없거나 잘못된 형식, 기본 사용자 ID 사용 ({connection_id})')
-                
-            print(f'최종 사용자 ID ({connection_id}): {user_id}')
-
-            # 요청 파라미터 추출 (request_data에서 가져옴)
-            query_text = request_data.get('query', '')
-            start_date = request_data.get('startDate')
-            end_date = request_data.get('endDate')
-            adults = request_data.get('adults', 1)
-            children = request_data.get('children', 0)
-            
-            # Base64 이미지 처리 추가
-            images = request_data.get('images', [])  # Base64 이미지 배열
-            has_images = len(images) > 0
-            print(f"수신된 이미지 개수 ({connection_id}): {len(images)}")
-            
-            # 다중 항공편/숙박편 지원 (하위 호환성 유지)
-            flight_info = request_data.get('flightInfo', None)  # 단일 항공편 (하위 호환성)
-            flight_infos = request_data.get('flightInfos', None)  # 다중 항공편 (새로운 방식)
-            accommodation_info = request_data.get('accommodationInfo', None)  # 단일 숙박편 (하위 호환성)
-            accommodation_infos = request_data.get('accommodationInfos', None)  # 다중 숙박편 (새로운 방식)
-            
-            # 다중 데이터가 있으면 우선 사용, 없으면 단일 데이터 사용
-            if flight_infos and len(flight_infos) > 0:
-                flights_to_process = flight_infos
-                print(f"다중 항공편 모드: {len(flight_infos)}개 항공편 처리 ({connection_id})")
-            elif flight_info:
-                flights_to_process = [flight_info]
-                print(f"단일 항공편 모드: 1개 항공편 처리 ({connection_id})")
-            else:
-                flights_to_process = []
-                print(f"항공편 없음 ({connection_id})")
-            
-            if accommodation_infos and len(accommodation_infos) > 0:
-                accommodations_to_process = accommodation_infos
-                print(f"다중 숙박편 모드: {len(accommodation_infos)}개 숙박편 처리 ({connection_id})")
-            elif accommodation_info:
-                accommodations_to_process = [accommodation_info]
-                print(f"단일 숙박편 모드: 1개 숙박편 처리 ({connection_id})")
-            else:
-                accommodations_to_process = []
-                print(f"숙박편 없음 ({connection_id})")
+                prompt_text += f"<복귀 항공편 정보>\n출발지: {destination_code}\n도착지: {origin_code}\n출발 시간: {return_departure_time}\n출발 공항 이름: {departure_airport_name} (공항 코드는 {destination_code})\n출발 공항 위도/경도: {in_depart_geo_lat or 'Unknown'}/{in_depart_geo_lng or 'Unknown'}\n도착 시간: {return_arrival_time}\n\n*** 중요: 마지막 날 마지막 일정은 복귀 항공편 출발 시간({return_departure_time}) 최소 2시간 전에 해당 공항({departure_airport_name})에서 출발 준비를 마치는 것으로 생성하세요. 모든 시간은 해당 공항의 현지 시간대입니다.***\n\n"
+        
+        else:
+            # 다중 편도 항공편 처리 (새로운 로직)
+            prompt_text += f"<다중 항공편 정보>\n총 {len(flights_to_process)}개의 편도 항공편이 있습니다.\n\n"
             
-            is_round_trip = False # 기본값
-
-            print(f"요청 파라미터 ({connection_id}): query={query_text}, start_date={start_date}, end_date={end_date}, adults={adults}, children={children}")
-            print(f"처리할 항공편 수: {len(flights_to_process)}, 처리할 숙박편 수: {len(accommodations_to_process)} ({connection_id})")
-
-            # Geo 정보 기본값 초기화
-            out_arrival_geo_lat = None
-            out_arrival_geo_lng = None
-            in_depart_geo_lat = None
-            in_depart_geo_lng = None
-
-            # 프롬프트 구성 시작
-            prompt_text = ""
-
-            # 다중 항공편 정보 처리
-            if flights_to_process:
-                print(f"항공편 정보 처리 중 ({connection_id}): {len(flights_to_process)}개")
-                
-                # 왕복편 여부 확인 (첫 번째 항공편 기준)
-                if flights_to_process[0] and 'itineraries' in flights_to_process[0]:
-                    is_round_trip = len(flights_to_process[0].get('itineraries', [])) > 1
-                
-                if is_round_trip and len(flights_to_process) == 1:
-                    # 단일 왕복편 처리 (기존 로직 유지)
-                    flight_info = flights_to_process[0]
-                    first_itinerary = flight_info['itineraries'][0]
-                    first_segment = first_itinerary['segments'][0]
-                    last_segment = first_itinerary['segments'][-1]
+            for i, flight in enumerate(flights_to_process):
+                if 'itineraries' in flight and len(flight['itineraries']) > 0:
+                    itinerary = flight['itineraries'][0]  # 편도이므로 첫 번째 itinerary만
+                    first_segment = itinerary['segments'][0]
+                    last_segment = itinerary['segments'][-1]
                     origin_code = first_segment['departure']['iataCode']
                     destination_code = last_segment['arrival']['iataCode']
                     departure_date = first_segment['departure']['at']
                     departure_time = departure_date.split('T')[1][:5] if 'T' in departure_date else departure_date
                     arrival_date = last_segment['arrival']['at']
                     arrival_time = arrival_date.split('T')[1][:5] if 'T' in arrival_date else arrival_date
-                    out_arrival_geo_lat = last_segment.get('arrival', {}).get('geoCode', {}).get('latitude')
-                    out_arrival_geo_lng = last_segment.get('arrival', {}).get('geoCode', {}).get('longitude')
                     
-                    # 도착 공항 한글명 추출
+                    # 공항 정보 추출
+                    departure_airport_info = first_segment.get('departure', {}).get('airportInfo', {})
+                    departure_airport_name = departure_airport_info.get('koreanName', origin_code)
                     arrival_airport_info = last_segment.get('arrival', {}).get('airportInfo', {})
                     arrival_airport_name = arrival_airport_info.get('koreanName', destination_code)
                     
-                    prompt_text += f"<항공편 정보>\n출발지: {origin_code}\n도착지: {destination_code}\n출발 시간: {departure_time}\n도착 시간: {arrival_time}\n도착 공항 이름: {arrival_airport_name} (공항 코드는 {destination_code})\n도착 공항 위도/경도: {out_arrival_geo_lat or 'Unknown'}/{out_arrival_geo_lng or 'Unknown'}\n\n*** 중요: 첫날 첫 번째 일정은 반드시 <항공편 정보>의 '도착지' 공항에 '도착 시간'에 도착하는 것으로 생성하고, 해당 공항의 이름, 위도, 경도를 `schedules`에 포함하세요. ***\n\n"
+                    # 위경도 정보
+                    departure_geo_lat = first_segment.get('departure', {}).get('geoCode', {}).get('latitude')
+                    departure_geo_lng = first_segment.get('departure', {}).get('geoCode', {}).get('longitude')
+                    arrival_geo_lat = last_segment.get('arrival', {}).get('geoCode', {}).get('latitude')
+                    arrival_geo_lng = last_segment.get('arrival', {}).get('geoCode', {}).get('longitude')
                     
-                    # 복귀 항공편 정보
-                    if len(flight_info['itineraries']) > 1:
-                        return_itinerary = flight_info['itineraries'][1]
-                        return_first_segment = return_itinerary['segments'][0]
-                        return_last_segment = return_itinerary['segments'][-1]
-                        return_departure_date = return_first_segment['departure']['at']
-                        return_departure_time = return_departure_date.split('T')[1][:5] if 'T' in return_departure_date else return_departure_date
-                        return_arrival_date = return_last_segment['arrival']['at']
-                        return_arrival_time = return_arrival_date.split('T')[1][:5] if 'T' in return_arrival_date else return_arrival_date
-                        in_depart_geo_lat = return_first_segment.get('departure', {}).get('geoCode', {}).get('latitude')
-                        in_depart_geo_lng = return_first_segment.get('departure', {}).get('geoCode', {}).get('longitude')
-                        
-                        # 출발 공항 한글명 추출
-                        departure_airport_info = return_first_segment.get('departure', {}).get('airportInfo', {})
-                        departure_airport_name = departure_airport_info.get('koreanName', destination_code)
+                    # 첫 번째 항공편인 경우
+                    if i == 0:
+                        prompt_text += f"항공편 {i+1} (출국편): {origin_code}({departure_airport_name}) -> {destination_code}({arrival_airport_name})\n"
+                        prompt_text += f"출발: {departure_time}, 도착: {arrival_time}\n"
+                        prompt_text += f"도착 공항 위도/경도: {arrival_geo_lat or 'Unknown'}/{arrival_geo_lng or 'Unknown'}\n"
+                        prompt_text += f"*** 중요: 첫날 첫 번째 일정은 반드시 {arrival_airport_name}({destination_code}) 공항에 {arrival_time}에 도착하는 것으로 생성하세요. ***\n\n"
                         
-                        prompt_text += f"<복귀 항공편 정보>\n출발지: {destination_code}\n도착지: {origin_code}\n출발 시간: {return_departure_time}\n출발 공항 이름: {departure_airport_name} (공항 코드는 {destination_code})\n출발 공항 위도/경도: {in_depart_geo_lat or 'Unknown'}/{in_depart_geo_lng or 'Unknown'}\n도착 시간: {return_arrival_time}\n\n*** 중요: 마지막 날 마지막 일정은 복귀 항공편 출발 시간({return_departure_time}) 최소 2시간 전에 해당 공항({departure_airport_name})에서 출발 준비를 마치는 것으로 생성하세요. 모든 시간은 해당 공항의 현지 시간대입니다.***\n\n"
-                
-                else:
-                    # 다중 편도 항공편 처리 (새로운 로직)
-                    prompt_text += f"<다중 항공편 정보>\n총 {len(flights_to_process)}개의 편도 항공편이 있습니다.\n\n"
+                        # 첫 번째 항공편의 도착지 정보를 전역 변수에 저장
+                        out_arrival_geo_lat = arrival_geo_lat
+                        out_arrival_geo_lng = arrival_geo_lng
                     
-                    for i, flight in enumerate(flights_to_process):
-                        if 'itineraries' in flight and len(flight['itineraries']) > 0:
-                            itinerary = flight['itineraries'][0]  # 편도이므로 첫 번째 itinerary만
-                            first_segment = itinerary['segments'][0]
-                            last_segment = itinerary['segments'][-1]
-                            origin_code = first_segment['departure']['iataCode']
-                            destination_code = last_segment['arrival']['iataCode']
-                            departure_date = first_segment['departure']['at']
-                            departure_time = departure_date.split('T')[1][:5] if 'T' in departure_date else departure_date
-                            arrival_date = last_segment['arrival']['at']
-                            arrival_time = arrival_date.split('T')[1][:5] if 'T' in arrival_date else arrival_date
-                            
-                            # 공항 정보 추출
-                            departure_airport_info = first_segment.get('departure', {}).get('airportInfo', {})
-                            departure_airport_name = departure_airport_info.get('koreanName', origin_code)
-                            arrival_airport_info = last_segment.get('arrival', {}).get('airportInfo', {})
-                            arrival_airport_name = arrival_airport_info.get('koreanName', destination_code)
-                            
-                            # 위경도 정보
-                            departure_geo_lat = first_segment.get('departure', {}).get('geoCode', {}).get('latitude')
-                            departure_geo_lng = first_segment.get('departure', {}).get('geoCode', {}).get('longitude')
-                            arrival_geo_lat = last_segment.get('arrival', {}).get('geoCode', {}).get('latitude')
-                            arrival_geo_lng = last_segment.get('arrival', {}).get('geoCode', {}).get('longitude')
-                            
-                            # 첫 번째 항공편인 경우
-                            if i == 0:
-                                prompt_text += f"항공편 {i+1} (출국편): {origin_code}({departure_airport_name}) -> {destination_code}({arrival_airport_name})\n"
-                                prompt_text += f"출발: {departure_time}, 도착: {arrival_time}\n"
-                                prompt_text += f"도착 공항 위도/경도: {arrival_geo_lat or 'Unknown'}/{arrival_geo_lng or 'Unknown'}\n"
-                                prompt_text += f"*** 중요: 첫날 첫 번째 일정은 반드시 {arrival_airport_name}({destination_code}) 공항에 {arrival_time}에 도착하는 것으로 생성하세요. ***\n\n"
-                                
-                                # 첫 번째 항공편의 도착지 정보를 전역 변수에 저장
-                                out_arrival_geo_lat = arrival_geo_lat
-                                out_arrival_geo_lng = arrival_geo_lng
-                            
-                            # 마지막 항공편인 경우 (귀국편)
-                            elif i == len(flights_to_process) - 1:
-                                prompt_text += f"항공편 {i+1} (귀국편): {origin_code}({departure_airport_name}) -> {destination_code}({arrival_airport_name})\n"
-                                prompt_text += f"출발: {departure_time}, 도착: {arrival_time}\n"
-                                prompt_text += f"출발 공항 위도/경도: {departure_geo_lat or 'Unknown'}/{departure_geo_lng or 'Unknown'}\n"
-                                prompt_text += f"*** 중요: 마지막 날 마지막 일정은 {departure_airport_name}({origin_code}) 공항에서 {departure_time} 최소 2시간 전에 출발 준비를 마치는 것으로 생성하세요. ***\n\n"
-                                
-                                # 마지막 항공편의 출발지 정보를 전역 변수에 저장
-                                in_depart_geo_lat = departure_geo_lat
-                                in_depart_geo_lng = departure_geo_lng
-                            
-                            # 중간 항공편인 경우
-                            else:
-                                prompt_text += f"항공편 {i+1} (중간편): {origin_code}({departure_airport_name}) -> {destination_code}({arrival_airport_name})\n"
-                                prompt_text += f"출발: {departure_time}, 도착: {arrival_time}\n"
-                                prompt_text += f"출발 공항 위도/경도: {departure_geo_lat or 'Unknown'}/{departure_geo_lng or 'Unknown'}\n"
-                                prompt_text += f"도착 공항 위도/경도: {arrival_geo_lat or 'Unknown'}/{arrival_geo_lng or 'Unknown'}\n"
-                                prompt_text += f"*** 중요: 해당 날짜에 {departure_airport_name}({origin_code}) 공항에서 출발하여 {arrival_airport_name}({destination_code}) 공항에 도착하는 일정을 포함하세요. ***\n\n"
+                    # 마지막 항공편인 경우 (귀국편)
+                    elif i == len(flights_to_process) - 1:
+                        prompt_text += f"항공편 {i+1} (귀국편): {origin_code}({departure_airport_name}) -> {destination_code}({arrival_airport_name})\n"
+                        prompt_text += f"출발: {departure_time}, 도착: {arrival_time}\n"
+                        prompt_text += f"출발 공항 위도/경도: {departure_geo_lat or 'Unknown'}/{departure_geo_lng or 'Unknown'}\n"
+                        prompt_text += f"*** 중요: 마지막 날 마지막 일정은 {departure_airport_name}({origin_code}) 공항에서 {departure_time} 최소 2시간 전에 출발 준비를 마치는 것으로 생성하세요. ***\n\n"
+                        
+                        # 마지막 항공편의 출발지 정보를 전역 변수에 저장
+                        in_depart_geo_lat = departure_geo_lat
+                        in_depart_geo_lng = departure_geo_lng
                     
-                    prompt_text += "*** 전체 항공편 연결 규칙: 각 항공편의 출발지 공항에 도착하는 일정과 도착지 공항에서 출발하는 일정을 반드시 포함하세요. ***\n\n"
+                    # 중간 항공편인 경우
+                    else:
+                        prompt_text += f"항공편 {i+1} (중간편): {origin_code}({departure_airport_name}) -> {destination_code}({arrival_airport_name})\n"
+                        prompt_text += f"출발: {departure_time}, 도착: {arrival_time}\n"
+                        prompt_text += f"출발 공항 위도/경도: {departure_geo_lat or 'Unknown'}/{departure_geo_lng or 'Unknown'}\n"
+                        prompt_text += f"도착 공항 위도/경도: {arrival_geo_lat or 'Unknown'}/{arrival_geo_lng or 'Unknown'}\n"
+                        prompt_text += f"*** 중요: 해당 날짜에 {departure_airport_name}({origin_code}) 공항에서 출발하여 {arrival_airport_name}({destination_code}) 공항에 도착하는 일정을 포함하세요. ***\n\n"
+            
+            prompt_text += "*** 전체 항공편 연결 규칙: 각 항공편의 출발지 공항에 도착하는 일정과 도착지 공항에서 출발하는 일정을 반드시 포함하세요. ***\n\n"
 
-            # 다중 숙박 정보 처리
-            if accommodations_to_process:
-                print(f"숙박 정보 처리 중 ({connection_id}): {len(accommodations_to_process)}개")
+    # 다중 숙박 정보 처리
+    if accommodations_to_process:
+        print(f"숙박 정보 처리 중 ({connection_id}): {len(accommodations_to_process)}개")
+        
+        if len(accommodations_to_process) == 1:
+            # 단일 숙박편 처리 (기존 로직 유지)
+            accommodation_info = accommodations_to_process[0]
+            hotel = accommodation_info.get('hotel', {})
+            room = accommodation_info.get('room', {})
+            hotel_name = hotel.get('hotel_name_trans') or hotel.get('hotel_name') or hotel.get('name') or 'Unknown Hotel'
+            room_name = room.get('name', 'Standard Room')
+            
+            prompt_text += f"<숙박 정보>\n호텔명: {hotel_name}\n객실 타입: {room_name}\n체크인: {accommodation_info.get('checkIn', start_date)}\n체크아웃: {accommodation_info.get('checkOut', end_date)}\n주소: {hotel.get('address', '정보 없음')}\n\n***  중요: 첫날 일정에 호텔 체크인을 포함하고, 매일 일정은 호텔에서 시작하여 호텔로 돌아오는 구조로 작성하세요. 마지막 날 일정은 호텔 체크아웃 이후, 복귀 항공편 출발 공항으로 이동하는 루트를 포함해야 합니다. 모든 시간은 호텔 위치의 현지 시간대입니다. ***\n\n"
+        
+        else:
+            # 다중 숙박편 처리 (새로운 로직)
+            prompt_text += f"<다중 숙박 정보>\n총 {len(accommodations_to_process)}개의 숙박편이 있습니다.\n\n"
+            
+            for i, accommodation in enumerate(accommodations_to_process):
+                hotel = accommodation.get('hotel', {})
+                room = accommodation.get('room', {})
+                hotel_name = hotel.get('hotel_name_trans') or hotel.get('hotel_name') or hotel.get('name') or f'Unknown Hotel {i+1}'
+                room_name = room.get('name', 'Standard Room')
+                check_in = accommodation.get('checkIn', start_date)
+                check_out = accommodation.get('checkOut', end_date)
+                hotel_address = hotel.get('address', '정보 없음')
                 
-                if len(accommodations_to_process) == 1:
-                    # 단일 숙박편 처리 (기존 로직 유지)
-                    accommodation_info = accommodations_to_process[0]
-                    hotel = accommodation_info.get('hotel', {})
-                    room = accommodation_info.get('room', {})
-                    hotel_name = hotel.get('hotel_name_trans') or hotel.get('hotel_name') or hotel.get('name') or 'Unknown Hotel'
-                    room_name = room.get('name', 'Standard Room')
-                    
-                    prompt_text += f"<숙박 정보>\n호텔명: {hotel_name}\n객실 타입: {room_name}\n체크인: {accommodation_info.get('checkIn', start_date)}\n체크아웃: {accommodation_info.get('checkOut', end_date)}\n주소: {hotel.get('address', '정보 없음')}\n\n***  중요: 첫날 일정에 호텔 체크인을 포함하고, 매일 일정은 호텔에서 시작하여 호텔로 돌아오는 구조로 작성하세요. 마지막 날 일정은 호텔 체크아웃 이후, 복귀 항공편 출발 공항으로 이동하는 루트를 포함해야 합니다. 모든 시간은 호텔 위치의 현지 시간대입니다. ***\n\n"
+                # 체크인/체크아웃 날짜 포맷팅
+                if isinstance(check_in, str):
+                    check_in_date = check_in
+                else:
+                    check_in_date = check_in.strftime('%Y-%m-%d') if check_in else start_date
                 
+                if isinstance(check_out, str):
+                    check_out_date = check_out
                 else:
-                    # 다중 숙박편 처리 (새로운 로직)
-                    prompt_text += f"<다중 숙박 정보>\n총 {len(accommodations_to_process)}개의 숙박편이 있습니다.\n\n"
-                    
-                    for i, accommodation in enumerate(accommodations_to_process):
-                        hotel = accommodation.get('hotel', {})
-                        room = accommodation.get('room', {})
-                        hotel_name = hotel.get('hotel_name_trans') or hotel.get('hotel_name') or hotel.get('name') or f'Unknown Hotel {i+1}'
-                        room_name = room.get('name', 'Standard Room')
-                        check_in = accommodation.get('checkIn', start_date)
-                        check_out = accommodation.get('checkOut', end_date)
-                        hotel_address = hotel.get('address', '정보 없음')
-                        
-                        # 체크인/체크아웃 날짜 포맷팅
-                        if isinstance(check_in, str):
-                            check_in_date = check_in
-                        else:
-                            check_in_date = check_in.strftime('%Y-%m-%d') if check_in else start_date
-                        
-                        if isinstance(check_out, str):
-                            check_out_date = check_out
-                        else:
-                            check_out_date = check_out.strftime('%Y-%m-%d') if check_out else end_date
-                        
-                        prompt_text += f"숙박편 {i+1}: {hotel_name}\n"
-                        prompt_text += f"객실 타입: {room_name}\n"
-                        prompt_text += f"체크인: {check_in_date}\n"
-                        prompt_text += f"체크아웃: {check_out_date}\n"
-                        prompt_text += f"주소: {hotel_address}\n"
-                        
-                        # 첫 번째 숙박편인 경우
-                        if i == 0:
-                            prompt_text += f"*** 중요: 첫날 일정에 {hotel_name} 체크인을 포함하세요. ***\n"
-                        
-                        # 마지막 숙박편인 경우
-                        if i == len(accommodations_to_process) - 1:
-                            prompt_text += f"*** 중요: 마지막 날 일정은 {hotel_name} 체크아웃 이후, 복귀 항공편 출발 공항으로 이동하는 루트를 포함하세요. ***\n"
-                        
-                        # 중간 숙박편인 경우
-                        if i > 0 and i < len(accommodations_to_process) - 1:
-                            prev_accommodation = accommodations_to_process[i-1]
-                            prev_hotel_name = prev_accommodation.get('hotel', {}).get('hotel_name_trans') or prev_accommodation.get('hotel', {}).get('hotel_name') or f'이전 호텔'
-                            prompt_text += f"*** 중요: {prev_hotel_name} 체크아웃 후 {hotel_name}으로 이동하여 체크인하는 일정을 포함하세요. ***\n"
-                        
-                        prompt_text += "\n"
-                    
-                    prompt_text += "*** 전체 숙박편 연결 규칙: 각 숙박편에서 체크인/체크아웃 일정을 포함하고, 매일 일정은 해당 숙박편에서 시작하여 돌아오는 구조로 작성하세요. 숙박편 간 이동 시에는 체크아웃 후 다음 숙박편으로 이동하는 일정을 포함하세요. ***\n\n"
+                    check_out_date = check_out.strftime('%Y-%m-%d') if check_out else end_date
+                
+                prompt_text += f"숙박편 {i+1}: {hotel_name}\n"
+                prompt_text += f"객실 타입: {room_name}\n"
+                prompt_text += f"체크인: {check_in_date}\n"
+                prompt_text += f"체크아웃: {check_out_date}\n"
+                prompt_text += f"주소: {hotel_address}\n"
+                
+                # 첫 번째 숙박편인 경우
+                if i == 0:
+                    prompt_text += f"*** 중요: 첫날 일정에 {hotel_name} 체크인을 포함하세요. ***\n"
+                
+                # 마지막 숙박편인 경우
+                if i == len(accommodations_to_process) - 1:
+                    prompt_text += f"*** 중요: 마지막 날 일정은 {hotel_name} 체크아웃 이후, 복귀 항공편 출발 공항으로 이동하는 루트를 포함하세요. ***\n"
+                
+                # 중간 숙박편인 경우
+                if i > 0 and i < len(accommodations_to_process) - 1:
+                    prev_accommodation = accommodations_to_process[i-1]
+                    prev_hotel_name = prev_accommodation.get('hotel', {}).get('hotel_name_trans') or prev_accommodation.get('hotel', {}).get('hotel_name') or f'이전 호텔'
+                    prompt_text += f"*** 중요: {prev_hotel_name} 체크아웃 후 {hotel_name}으로 이동하여 체크인하는 일정을 포함하세요. ***\n"
+                
+                prompt_text += "\n"
             
-            else:
-                # 숙박편이 선택되지 않은 경우 - AI가 추천하는 숙소를 개인 숙소 박스에 들어가도록 생성
-                prompt_text += "<숙박 정보 없음>\n사용자가 숙박편을 선택하지 않았습니다.\n\n*** 중요: 각 날마다 'category': '숙소'인 추천 숙소 일정을 포함하세요. 이 숙소들은 TravelPlanner의 개인 숙소 박스(일반 일정)에 표시되어야 합니다. 여행 목적지에 맞는 실제 존재하는 호텔, 게스트하우스, 펜션 등을 검색하여 추천해주세요.\n\n반드시 다음 형식으로 생성하세요:\n- id: 'custom-숙소고유번호' (예: 'custom-1234567890')\n- name: '실제 숙소명 (예: 서울 롯데호텔, 부산 파라다이스 호텔 등)'\n- address: '실제 숙소 주소'\n- lat: 실제 위도 (숫자)\n- lng: 실제 경도 (숫자)\n- category: '숙소' (반드시 포함)\n- time: '22:00' (체크인 시간)\n- duration: '8시간' (숙박 시간)\n- notes: '숙소 특징, 편의시설, 추천 이유, 체크인/체크아웃 시간, 연락처 등을 포함한 상세 설명. 예: 시내 중심가 위치, 무료 Wi-Fi, 조식 제공, 체크인 14:00, 체크아웃 11:00, 연락처: 02-1234-5678'\n- cost: '예상 1박 요금 (원 단위, 숫자만)'\n\n이렇게 생성된 숙소는 개인 숙소 폼과 동일한 구조로 처리되어 일반 일정에 표시됩니다. ***\n\n"
-             
-            # 메인 요구사항 추가
-            prompt_text += f"""
+            prompt_text += "*** 전체 숙박편 연결 규칙: 각 숙박편에서 체크인/체크아웃 일정을 포함하고, 매일 일정은 해당 숙박편에서 시작하여 돌아오는 구조로 작성하세요. 숙박편 간 이동 시에는 체크아웃 후 다음 숙박편으로 이동하는 일정을 포함하세요. ***\n\n"
+    
+    else:
+        # 숙박편이 선택되지 않은 경우 - AI가 추천하는 숙소를 개인 숙소 박스에 들어가도록 생성
+        prompt_text += "<숙박 정보 없음>\n사용자가 숙박편을 선택하지 않았습니다.\n\n*** 중요: 각 날마다 'category': '숙소'인 추천 숙소 일정을 포함하세요. 이 숙소들은 TravelPlanner의 개인 숙소 박스(일반 일정)에 표시되어야 합니다. 여행 목적지에 맞는 실제 존재하는 호텔, 게스트하우스, 펜션 등을 검색하여 추천해주세요.\n\n반드시 다음 형식으로 생성하세요:\n- id: 'custom-숙소고유번호' (예: 'custom-1234567890')\n- name: '실제 숙소명 (예: 서울 롯데호텔, 부산 파라다이스 호텔 등)'\n- address: '실제 숙소 주소'\n- lat: 실제 위도 (숫자)\n- lng: 실제 경도 (숫자)\n- category: '숙소' (반드시 포함)\n- time: '22:00' (체크인 시간)\n- duration: '8시간' (숙박 시간)\n- notes: '숙소 특징, 편의시설, 추천 이유, 체크인/체크아웃 시간, 연락처 등을 포함한 상세 설명. 예: 시내 중심가 위치, 무료 Wi-Fi, 조식 제공, 체크인 14:00, 체크아웃 11:00, 연락처: 02-1234-5678'\n- cost: '예상 1박 요금 (원 단위, 숫자만)'\n\n이렇게 생성된 숙소는 개인 숙소 폼과 동일한 구조로 처리되어 일반 일정에 표시됩니다. ***\n\n"
+     
+    # 메인 요구사항 추가
+    prompt_text += f"""
 <요구사항>
 {query_text}
 
@@ -357,9 +472,9 @@ def lambda_handler(event, context):
 <인원수>
 어른 : {adults}, 유아 {children}"""
 
-            # 이미지가 있는 경우 추가 안내
-            if has_images:
-                prompt_text += f"""
+    # 이미지가 있는 경우 추가 안내
+    if has_images:
+        prompt_text += f"""
 
 <첨부된 이미지>
 사용자가 {len(images)}개의 이미지를 첨부했습니다. 이 이미지들을 분석하여 여행 계획에 반영해주세요.
@@ -367,120 +482,282 @@ def lambda_handler(event, context):
 - 이미지의 분위기나 테마를 고려하여 여행 스타일을 맞춰주세요.
 - 이미지에서 특정 관심사를 발견하면 관련된 장소나 활동을 추천해주세요."""
 
-            prompt_text += """
+    # prompt_text에는 요청별 정보(항공편/숙박/요구사항/날짜/인원/이미지)만 담고,
+    # 고정 지시문(PLAN_INSTRUCTION)은 컨텍스트 캐시 또는 systemInstruction으로 따로 보냄
+    print(f"프롬프트 생성 완료 ({connection_id}), 길이: {len(prompt_text)} 문자 (고정 지시문 {len(PLAN_INSTRUCTION)} 문자 별도)")
+
+    # 이미지가 있는 경우와 없는 경우 페이로드 구성
+    if has_images:
+        # 이미지가 있는 경우: 텍스트와 이미지를 함께 전송
+        parts = [{"text": prompt_text}]
+        
+        # Base64 이미지들을 parts에 추가
+        for i, image_data in enumerate(images):
+            # "data:image/jpeg;base64," 접두사 제거
+            if image_data.startswith('data:image/'):
+                mime_type = image_data.split(';')[0].split(':')[1]  # "image/jpeg" 추출
+                base64_data = image_data.split(',')[1]  # Base64 데이터만 추출
+            else:
+                # 접두사가 없는 경우 기본값 사용
+                mime_type = "image/jpeg"
+                base64_data = image_data
+            
+            parts.append({
+                "inline_data": {
+                    "mime_type": mime_type,
+                    "data": base64_data
+                }
+            })
+            print(f"이미지 {i+1} 추가됨 ({connection_id}): {mime_type}, 데이터 길이: {len(base64_data)}")
+        
+        payload = {
+            "contents": [{"parts": parts}],
+            "generationConfig": {
+                "temperature": 0.3,
+                "maxOutputTokens": 8192
+            }
+        }
+    else:
+        # 이미지가 없는 경우: 기존 방식 (텍스트만)
+        payload = {
+            "contents": [{"parts": [{"text": prompt_text}]}], 
+            "generationConfig": {
+                "temperature": 0.3,
+                "maxOutputTokens": 8192  # 출력 토큰 제한을 8192로 증가 (기본값보다 높게 설정)
+            }
+        }
 
-<규칙>
-모든 장소는 실제로 있는 장소여야 해. 호텔, 장소, 식당을 너가 검색해서 잡아줘.
-"무조건 이름이 지도에 있는 이름이어야 해."
-현실적인 일정을 잡아야 하니, 하루 총 일정에 너무 많은 이동거리가 있으면 안 돼.
-그리고, 다음날의 첫 일정에는 전날의 호텔과 가까이 있는 걸로 해줘.
-이어지는 흐름으로 갈 수 있도록.
-그런데 장소와 장소 사이가 너무 가까워도 안됨.
-항공편 정보가 제공된 경우, 첫날 첫 번째 일정은 반드시 제공된 '가는 편' 항공편의 도착 공항에, 명시된 '도착 시간'에 도착하는 것으로 생성해야 하며, 해당 공항의 이름, 위도, 경도를 `schedules`에 포함해야 한다.
-마찬가지로, 복귀 항공편 정보가 제공된 경우, 마지막 날 마지막 일정은 제공된 '오는 편' 항공편의 출발 공항에서, 명시된 '출발 시간' 이전에 출발 준비를 마치는 것으로 생성하고, 해당 공항 이름, 위도, 경도를 `schedules`에 포함해야 한다.
+    if PLAN_STRUCTURED_OUTPUT:
+        payload['generationConfig'] = structured_generation_config(payload['generationConfig'], PLAN_RESPONSE_SCHEMA)
 
-<답변형식>
-하루치 일정은 \\"(관광지)-(식당)-(관광지)-(관광지)-(관광지)-(관광지)-(마지막 관광지)\\" 이렇게 잡아줘.
-관광지 : 지도 상에 존재하는 명소나, 구경거리 (제외 : 호텔, 지하철역, 항공 등등..) 만 넣어야해.
-추가로, 하루 일정의 마지막 장소의 위도(latitude)와 경도(longitude) 정보를 포함해야 해.
-항공편 도착/출발 공항도 '장소'로 취급하여 일정에 포함해야 한다.
+    return {
+        'prompt_text': prompt_text,
+        'payload': payload,
+        'images': images,
+        'has_images': has_images,
+        'flights': flights_to_process,
+        'accommodations': accommodations_to_process,
+        'is_round_trip': is_round_trip,
+        'start_date': start_date,
+        'end_date': end_date,
+    }
 
 
-JSON 예시
-{{\\"title\\":\\"ㅁㅁ ㅁ박 ㅁ일 여행\\",\\"days\\":[{{\\"day\\":1,\\"date\\":\\"2025-05-12\\",\\"title\\":\\"1일차: 공항 도착 및 ㅁㅁ 방문\\",\\"schedules\\":[{{\\"id\\":\\"1-0\\",\\"name\\":\\"도착 공항 이름 (예: 인천 국제공항)\\",\\"time\\":\\"14:00\\",\\"lat\\":37.45584,\\"lng\\":126.4453,\\"category\\":\\"장소\\",\\"duration\\":\\"0.5시간\\",\\"notes\\":\\"공항 도착 및 입국 수속\\",\\"cost\\":\\"0\\",\\"address\\":\\"공항 주소\\"}},{{\\"id\\":\\"1-1\\",\\"name\\":\\"장소이름\\",\\"time\\":\\"15:30\\",\\"lat\\":123.1234,\\"lng\\":123.1234,\\"category\\":\\"장소\\",\\"duration\\":\\"1시간\\",\\"notes\\":\\"ㅁㅁ\\",\\"cost\\":\\"50000\\",\\"address\\":\\"ㅁㅁ 주소\\"}},{{\\"id\\":\\"1-2\\",\\"name\\":\\"ㅁㅁ\\",\\"time\\":\\"17:00\\",\\"lat\\":35.6936,\\"lng\\":139.7071,\\"category\\":\\"식당\\",\\"duration\\":\\"1시간\\",\\"notes\\":\\"현지 이자카야에서 다양한 음식 즐기기\\",\\"cost\\":\\"3000\\",\\"address\\":\\"ㅁㅁ 주소\\"}},{{\\"id\\":\\"custom-1234567890\\",\\"name\\":\\"ㅁㅁ 호텔\\",\\"time\\":\\"22:00\\",\\"lat\\":35.6762,\\"lng\\":139.6503,\\"category\\":\\"숙소\\",\\"duration\\":\\"8시간\\",\\"notes\\":\\"시내 중심가에 위치한 4성급 호텔. 무료 Wi-Fi, 조식 제공, 지하철역 도보 5분 거리. 체크인 14:00, 체크아웃 11:00, 연락처: 02-1234-5678\\",\\"cost\\":\\"120000\\",\\"address\\":\\"ㅁㅁ시 ㅁㅁ구 ㅁㅁ동 123-45\\"}}]}},{{\\"day\\":2,\\"date\\":\\"2025-05-13\\",\\"title\\":\\"2일차: ㅁㅁ 여행\\",\\"schedules\\":[{{\\"id\\":\\"2-1\\",\\"name\\":\\"ㅁㅁ 타워\\",\\"time\\":\\"10:00\\",\\"lat\\":35.6585805,\\"lng\\":139.7454329,\\"category\\":\\"장소\\",\\"duration\\":\\"1시간\\",\\"notes\\":\\"ㅁㅁ 시내 전경을 감상할 수 있는 명소\\",\\"cost\\":\\"1200\\",\\"address\\":\\"ㅁㅁ 주소\\"}},{{\\"id\\":\\"2-2\\",\\"name\\":\\"ㅁㅁ 멘치\\",\\"time\\":\\"13:00\\",\\"lat\\":35.714765,\\"lng\\":139.79669,\\"category\\":\\"식당\\",\\"duration\\":\\"1시간\\",\\"notes\\":\\"유명한 ㅁㅁ 멘치카츠 맛보기\\",\\"cost\\":\\"800\\",\\"address\\":\\"ㅁㅁ 주소\\"}},{{\\"id\\":\\"custom-0987654321\\",\\"name\\":\\"ㅁㅁ 게스트하우스\\",\\"time\\":\\"22:00\\",\\"lat\\":35.6895,\\"lng\\":139.6917,\\"category\\":\\"숙소\\",\\"duration\\":\\"8시간\\",\\"notes\\":\\"현지 분위기를 느낄 수 있는 전통 게스트하우스. 온천 시설, 한식 조식 제공. 체크인 15:00, 체크아웃 10:00, 연락처: 02-9876-5432\\",\\"cost\\":\\"80000\\",\\"address\\":\\"ㅁㅁ시 ㅁㅁ구 ㅁㅁ동 456-78\\"}}]}},{{\\"day\\":3,\\"date\\":\\"2025-05-14\\",\\"title\\":\\"3일차: ㅁㅁ 온천 여행 및 출국\\",\\"schedules\\":[{{\\"id\\":\\"3-1\\",\\"name\\":\\"ㅁㅁ 역\\",\\"time\\":\\"09:00\\",\\"lat\\":35.6896342,\\"lng\\":139.700627,\\"category\\":\\"장소\\",\\"duration\\":\\"2시간\\",\\"notes\\":\\"ㅁㅁ에서 ㅁㅁ 온천 지역으로 이동\\",\\"cost\\":\\"2500\\",\\"address\\":\\"ㅁㅁ 주소\\"}},{{\\"id\\":\\"3-2\\",\\"name\\":\\"ㅁㅁ 유모토\\",\\"time\\":\\"11:00\\",\\"lat\\":35.232916,\\"lng\\":139.105582,\\"category\\":\\"장소\\",\\"duration\\":\\"1시간\\",\\"notes\\":\\"온천 마을 ㅁㅁ 유모토 도착 후 휴식\\",\\"cost\\":\\"0\\",\\"address\\":\\"ㅁㅁ 주소\\"}},{{\\"id\\":\\"3-3\\",\\"name\\":\\"ㅁㅁ 소바집\\",\\"time\\":\\"12:00\\",\\"lat\\":35.235083,\\"lng\\":139.108167,\\"category\\":\\"식당\\",\\"duration\\":\\"1시간\\",\\"notes\\":\\"ㅁㅁ 지역의 유명한 소바 맛집\\",\\"cost\\":\\"1500\\",\\"address\\":\\"ㅁㅁ 주소\\"}},{{\\"id\\":\\"3-4\\",\\"name\\":\\"출발 공항 이름 (예: 나리타 국제공항)\\",\\"time\\":\\"16:00\\",\\"lat\\":35.771987,\\"lng\\":140.392903,\\"category\\":\\"장소\\",\\"duration\\":\\"2시간\\",\\"notes\\":\\"출국 수속\\",\\"cost\\":\\"0\\",\\"address\\":\\"공항 주소\\"}}]}}]\n}}
-저 구조로만 반환하세요.
-"""
+def process_record(record, deadline):
+    """SQS 레코드 하나(여행 계획 생성 요청) 처리. deadline: 람다 남은 시간 기준 마감 시각"""
+    lambda_start_time = time.time()
+    # 단계별 지연 시간 (EMF). 레코드 처리가 끝나면 finally에서 한 줄로 출력
+    metrics = start_metrics('createPlanAsync', model=gemini_client.model)
+    queue_wait = queue_wait_seconds(record)
+    if queue_wait is not None:
+        metrics.put('queue_wait', queue_wait * 1000)
+    # requestPlanHandler가 SQS 메시지 속성으로 넘긴 traceId를 이어받음 (단계 타이머가 span으로 기록됨)
+    trace = start_trace_from_record('createPlanAsync', record)
+    record_error = None
+    connection_id = None # 오류 발생 시 WebSocket 알림을 위해 미리 선언
+    single_flight = None # 같은 요청을 대신 생성하는 경우 오류 시 구독자에게 알리기 위해 미리 선언
+    single_flight_key = None
 
-            print(f"프롬프트 생성 완료 ({connection_id}), 길이: {len(prompt_text)} 문자")
+    try:
+        sqs_body_str = record.get('body')
+        if not sqs_body_str:
+            print("빈 SQS 메시지 본문입니다. 다음 레코드로 넘어갑니다.")
+            send_to_dead_letter_queue(record, '빈 SQS 메시지 본문', label='createPlanAsync')
+            return
+        
+        sqs_body = json.loads(sqs_body_str)
+        
+        connection_id = sqs_body.get('connectionId')
+        request_data = sqs_body.get('requestData') # 프론트엔드에서 보낸 원본 요청
+        # 이 레코드의 로그에 요청 ID를 붙이고 DEBUG 샘플링 여부를 정함 (requestPlanHandler와 같은 clientRequestId 기준)
+        start_request(sqs_body.get('clientRequestId') or record.get('messageId'), connectionId=connection_id, traceId=trace.trace_id)
+        trace.attributes.update(connectionId=connection_id, clientRequestId=sqs_body.get('clientRequestId'))
+
+        if not connection_id or not request_data:
+            log.error('SQS 메시지에 connectionId 또는 requestData가 누락되었습니다', body=sqs_body)
+            send_to_dead_letter_queue(record, 'connectionId 또는 requestData 누락', label='createPlanAsync')
+            return
+        
+        print(f"Processing for connectionId: {connection_id}")
+        send_websocket_message(connection_id, {"action": "status_update", "message": "여행 계획 생성 요청을 수신하여 처리를 시작합니다..."})
 
-            send_websocket_message(connection_id, {"action": "status_update", "message": "AI 모델과 통신을 시작합니다..."})
+        # 사용자 ID 추출 (원본 createFunction_python.py와 동일한 방식)
+        user_id = 'anonymous'
+        auth_token_from_payload = request_data.get('authToken') # 예: "Bearer eyJ..." 또는 "eyJ..."
+        
+        if auth_token_from_payload:
+            print(f'수신된 토큰 형태 ({connection_id}): {auth_token_from_payload[:30]}...')
             
-            api_key = os.environ.get('GEMINI_API_KEY')
-            if not api_key:
-                raise Exception("환경변수 'GEMINI_API_KEY'가 설정되지 않았습니다.")
+            # "Bearer " 접두사가 있는 경우 제거 (원본과 동일)
+            if auth_token_from_payload.startswith('Bearer '):
+                token = auth_token_from_payload[7:]  # 'Bearer ' 이후 부분 추출
+            else:
+                token = auth_token_from_payload
             
-            url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={api_key}"
+            print(f'처리할 토큰 (앞부분) ({connection_id}): {token[:50]}...')
             
-            # 이미지가 있는 경우와 없는 경우 페이로드 구성
-            if has_images:
-                # 이미지가 있는 경우: 텍스트와 이미지를 함께 전송
-                parts = [{"text": prompt_text}]
-                
-                # Base64 이미지들을 parts에 추가
-                for i, image_data in enumerate(images):
-                    # "data:image/jpeg;base64," 접두사 제거
-                    if image_data.startswith('data:image/'):
-                        mime_type = image_data.split(';')[0].split(':')[1]  # "image/jpeg" 추출
-                        base64_data = image_data.split(',')[1]  # Base64 데이터만 추출
-                    else:
-                        # 접두사가 없는 경우 기본값 사용
-                        mime_type = "image/jpeg"
-                        base64_data = image_data
-                    
-                    parts.append({
-                        "inline_data": {
-                            "mime_type": mime_type,
-                            "data": base64_data
-                        }
-                    })
-                    print(f"이미지 {i+1} 추가됨 ({connection_id}): {mime_type}, 데이터 길이: {len(base64_data)}")
-                
-                payload = {
-                    "contents": [{"parts": parts}],
-                    "generationConfig": {
-                        "temperature": 0.3,
-                        "maxOutputTokens": 8192
-                    }
-                }
+            # 개발 환경에서 test-token인 경우 처리
+            if token == 'test-token':
+                user_id = 'dev@example.com'  # AuthContext의 개발 유저와 일치
+                print(f'테스트 토큰 사용, 사용자 ID: {user_id} ({connection_id})')
             else:
-                # 이미지가 없는 경우: 기존 방식 (텍스트만)
-                payload = {
-                    "contents": [{"parts": [{"text": prompt_text}]}], 
-                    "generationConfig": {
-                        "temperature": 0.3,
-                        "maxOutputTokens": 8192  # 출력 토큰 제한을 8192로 증가 (기본값보다 높게 설정)
-                    }
-                }
+                # 실제 JWT 토큰 디코딩 시도 (원본과 동일)
+                decoded_token = decode_jwt(token)
+                if decoded_token:
+                    # 이메일을 사용자 ID로 사용 (원본과 동일)
+                    user_id = decoded_token.get('email', 'anonymous')
+                    print(f'토큰에서 추출한 사용자 이메일 ({connection_id}): {user_id}')
+                else:
+                    print(f'토큰 디코딩 실패, 기본 사용자 ID 사용 ({connection_id})')
+        else:
+            print(f'Authorization 헤더가 없거나 잘못된 형식, 기본 사용자 ID 사용 ({connection_id})')
             
-            headers = {"Content-Type": "application/json"}
-
-            gemini_request_start_time = time.time()
-            req = urllib.request.Request(url, data=json.dumps(payload).encode('utf-8'), headers=headers)
-            gemini_result_text = None
+        print(f'최종 사용자 ID ({connection_id}): {user_id}')
+        bind(userId=user_id)
+
+        # 멱등성 원장: 같은 요청(clientRequestId)의 재시도/SQS 중복 전달이면 이미 생성된 계획을 그대로 돌려줌
+        # clientRequestId가 없는 이전 클라이언트는 SQS messageId(중복 전달 시 동일)로 대신함
+        client_request_id = sqs_body.get('clientRequestId') or request_data.get('clientRequestId') or record.get('messageId')
+        plan_ledger = get_plan_ledger()
+        ledger_entry = plan_ledger.reserve(user_id, client_request_id) if plan_ledger and client_request_id else None
+        if ledger_entry and ledger_entry['status'] == LEDGER_COMPLETED:
+            print(f"[PlanLedger] 이미 생성된 계획 반환 ({connection_id}): {ledger_entry['plan_id']}, Gemini 호출 생략")
+            send_websocket_message(connection_id, plan_created_message(ledger_entry['plan_id']))
+            return
+
+        # 요청 파라미터 추출 (request_data에서 가져옴)
+        metrics.start('prompt_build')
+        plan_request = build_plan_request(request_data, connection_id)
+        prompt_text = plan_request['prompt_text']
+        payload = plan_request['payload']
+        images = plan_request['images']
+        has_images = plan_request['has_images']
+        flights_to_process = plan_request['flights']
+        accommodations_to_process = plan_request['accommodations']
+        is_round_trip = plan_request['is_round_trip']
+        start_date, end_date = plan_request['start_date'], plan_request['end_date']
+        metrics.set_dimension('has_images', has_images)
+
+        send_websocket_message(connection_id, {"action": "status_update", "message": "AI 모델과 통신을 시작합니다..."})
+        
+        api_key = os.environ.get('GEMINI_API_KEY')
+        if not api_key:
+            raise Exception("환경변수 'GEMINI_API_KEY'가 설정되지 않았습니다.")
+        
+        plan_dates = trip_dates(start_date, end_date)
+        use_sharding = PLAN_SHARDING_ENABLED and len(plan_dates) > 1 and (
+            request_data.get('generationMode') == 'sharded' or len(plan_dates) >= PLAN_SHARDING_MIN_DAYS)
+        print(f"생성 방식 ({connection_id}): {'일차별 병렬' if use_sharding else '단일 호출'}, 여행 일수: {len(plan_dates)}")
+
+        # 요청 지문: 응답 캐시 키와 single-flight 키로 사용 (생성 방식이 다르면 결과도 다르므로 포함)
+        cache_config = dict(payload['generationConfig'], generationMode='sharded') if use_sharding else payload['generationConfig']
+        request_fingerprint = make_cache_key(prompt_text + PLAN_INSTRUCTION, images, cache_config, gemini_client.model)
+        metrics.stop('prompt_build')
+
+        plan_cache = get_plan_cache()
+        cache_key = None
+        cached_response_text = None
+        schema_repairs = []
+        if plan_cache:
+            cache_key = request_fingerprint
+            # 다시 생성 요청이면 읽지 않고 새 결과로 갱신만 함
+            if not wants_fresh_plan(request_data):
+                cached_response_text = plan_cache.get(cache_key)
+
+        # single-flight: 같은 사용자의 같은 요청이 이미 생성 중이면 Gemini를 다시 호출하지 않고 결과를 구독
+        if not cached_response_text and get_single_flight():
+            single_flight_key = flight_key(user_id, request_fingerprint)
+            flight_owner = record.get('messageId') or connection_id
+            flight_role, flight_plan_id = get_single_flight().acquire(single_flight_key, flight_owner)
+            if flight_role == FLIGHT_LEADER:
+                single_flight = get_single_flight()
+            else:
+                if flight_role == FLIGHT_FOLLOWER:
+                    # 원장 항목도 함께 남겨 리더가 저장을 마치면 같은 planId로 완료 처리 (이 레코드는 바로 끝남)
+                    flight_plan_id = get_single_flight().subscribe(single_flight_key, connection_id, ledger_entry)
+                if flight_plan_id:
+                    print(f"[SingleFlight] 같은 요청의 결과 전달 ({connection_id}): {flight_plan_id}")
+                    if ledger_entry:
+                        plan_ledger.complete(dict(ledger_entry, plan_id=flight_plan_id))
+                    send_websocket_message(connection_id, plan_created_message(flight_plan_id))
+                else:
+                    print(f"[SingleFlight] 같은 요청을 다른 워커가 생성 중, 결과 구독 ({connection_id})")
+                    send_websocket_message(connection_id, {"action": "status_update", "message": "같은 요청을 이미 처리하고 있습니다. 완료되면 결과를 전달합니다..."})
+                return
+
+        # 비싼 단계(Gemini 호출) 전에 연결 확인. 끊겼으면 cancel 정책은 여기서 종료, persist 정책은 전송 없이 생성/저장만 진행
+        # (cancel 정책이어도 같은 요청을 구독한 연결이 있으면 끝까지 생성해 구독자에게 전달)
+        cancelled = generation_cancel_check(connection_id, single_flight, single_flight_key)
+        if cancelled():
+            raise ConnectionGoneError(connection_id)
+
+        gemini_request_start_time = time.time()
+        if cached_response_text:
+            # 동일 요청(더블 클릭, 재시도 등)의 이전 응답 재사용
+            gemini_result = json.loads(cached_response_text, parse_float=Decimal)
+            print(f"[PlanCache] 캐시 적중 ({connection_id}): Gemini 호출 생략. 통계: {plan_cache.stats}")
+            metrics.count('plan_cache_hit')
+            if GEMINI_STREAMING or use_sharding:
+                replay_cached_days(connection_id, gemini_result)
+        else:
+            print(f"[PlanCache] 캐시 미스 ({connection_id}). 통계: {plan_cache.stats if plan_cache else '비활성'}")
+            metrics.count('plan_cache_miss')
             try:
-                with urllib.request.urlopen(req, timeout=120) as res: # 타임아웃 증가
-                    gemini_response_status = res.status
-                    gemini_result_text = res.read().decode('utf-8')
-                gemini_request_end_time = time.time()
-                print(f"[Gemini API] 응답 ({connection_id}). 상태: {gemini_response_status}, 시간: {gemini_request_end_time - gemini_request_start_time:.2f}초")
-                gemini_result = json.loads(gemini_result_text, parse_float=Decimal)
-                
-                # Gemini 응답 구조 로깅 (디버깅용)
-                print(f"[Gemini API] 응답 구조 ({connection_id}):")
-                if 'candidates' in gemini_result:
-                    print(f"  - candidates 개수: {len(gemini_result['candidates'])}")
-                    for i, candidate in enumerate(gemini_result['candidates']):
-                        print(f"  - candidate[{i}] 키들: {list(candidate.keys())}")
-                        if 'content' in candidate:
-                            print(f"    - content 키들: {list(candidate['content'].keys())}")
-                            if 'parts' in candidate['content']:
-                                print(f"    - parts 개수: {len(candidate['content']['parts'])}")
-                                for j, part in enumerate(candidate['content']['parts']):
-                                    if isinstance(part, dict) and 'text' in part:
-                                        text_len = len(part['text']) if part['text'] else 0
-                                        print(f"      - part[{j}] text 길이: {text_len}")
+                if use_sharding:
+                    gemini_envelope = generate_plan_sharded(
+                        connection_id, prompt_text, plan_dates, flights_to_process, accommodations_to_process,
+                        payload['contents'][0]['parts'][1:], timeout=time_left(deadline, 120), cancelled=cancelled)
+                    # 저장 형식(parse_float=Decimal)은 비스트리밍 응답과 동일하게 맞춤
+                    gemini_result = json.loads(json.dumps(gemini_envelope), parse_float=Decimal)
+                    gemini_request_end_time = time.time()
+                    print(f"[Gemini API] 응답 ({connection_id}). 시간: {gemini_request_end_time - gemini_request_start_time:.2f}초 (일차별 병렬)")
                 else:
-                    print(f"  - candidates 키가 없음. 응답 키들: {list(gemini_result.keys())}")
-                
-            except urllib.error.HTTPError as e:
-                gemini_request_end_time = time.time()
-                error_body = e.read().decode('utf-8') if hasattr(e, 'read') else 'No response body'
-                error_details = f"Gemini API HTTP 오류 ({connection_id}): {e.code} {e.reason}. 시간: {gemini_request_end_time - gemini_request_start_time:.2f}초. 응답: {error_body}"
-                print(error_details)
-                raise Exception(error_details)
-            except urllib.error.URLError as e:
+                    days_sent = 0
+                    if GEMINI_STREAMING:
+                        gemini_envelope, gemini_response, days_sent = context_cache.call(
+                            lambda p: generate_plan_streaming(connection_id, p, timeout=time_left(deadline, 120), cancelled=cancelled), payload, PLAN_INSTRUCTION)
+                        # 저장 형식(parse_float=Decimal)은 비스트리밍 응답과 동일하게 맞춤
+                        gemini_result = json.loads(json.dumps(gemini_envelope), parse_float=Decimal)
+                    else:
+                        gemini_response = context_cache.call(
+                            lambda p: gemini_client.generate_content(p, timeout=time_left(deadline, 120)), payload, PLAN_INSTRUCTION) # 타임아웃 증가
+                        gemini_result = gemini_response.json(parse_float=Decimal)
+                    timings = gemini_response.timings
+                    metrics.put('gemini_ttfb', timings['ttfb'] * 1000)
+                    print(f"[Gemini API] 응답 ({connection_id}). 상태: {gemini_response.status}, 시간: {time.time() - gemini_request_start_time:.2f}초 (연결: {timings['connect']:.2f}초, 첫 바이트: {timings['ttfb']:.2f}초, 연결 재사용: {gemini_response.reused}, 스트리밍: {GEMINI_STREAMING})")
+
+                    # maxOutputTokens에서 끊긴 경우 마지막 완성 일정부터 이어서 생성 (전체 재생성 대신 짧은 호출)
+                    if cancelled():
+                        raise ConnectionGoneError(connection_id)
+                    continued_envelope, continuation_rounds = continue_if_truncated(
+                        gemini_client, context_cache.apply(payload, PLAN_INSTRUCTION), gemini_result, timeout=time_left(deadline, 120), keys=PLAN_RESPONSE_KEYS)
+                    if continuation_rounds:
+                        send_websocket_message(connection_id, {"action": "status_update", "message": "길이 제한으로 끊긴 일정을 이어서 생성했습니다..."})
+                        gemini_result = json.loads(json.dumps(continued_envelope, cls=DecimalEncoder), parse_float=Decimal)
+                        print(f"[Gemini API] 이어서 생성 완료 ({connection_id}): 추가 호출 {continuation_rounds}회, 누적 시간: {time.time() - gemini_request_start_time:.2f}초")
+
+                    # 짧은 필드 이름 -> 프론트엔드가 읽는 days[].schedules[] 구조로 펼쳐서 저장
+                    if PLAN_STRUCTURED_OUTPUT:
+                        _, schema_repairs = expand_envelope_text(gemini_result, expand_plan)
+
+                    if continuation_rounds and GEMINI_STREAMING:
+                        replay_cached_days(connection_id, gemini_result, start_index=days_sent)
+                    gemini_request_end_time = time.time()
+            
+                metrics.record_since('gemini_total', gemini_request_start_time)
+
+                # Gemini 응답 구조 로깅 (디버깅용, DEBUG가 켜진 요청만 계산)
+                log.debug('Gemini 응답 구조', structure=lambda: gemini_result_structure(gemini_result))
+            
+            except ConnectionGoneError:
+                raise
+            except GeminiAPIError as e:
                 gemini_request_end_time = time.time()
-                error_details = f"Gemini API URL 오류 ({connection_id}): {str(e)}. 시간: {gemini_request_end_time - gemini_request_start_time:.2f}초"
+                metrics.count('gemini_error')
+                if e.status:
+                    error_details = f"Gemini API HTTP 오류 ({connection_id}): {e.status}. 시간: {gemini_request_end_time - gemini_request_start_time:.2f}초. 응답: {e.body}"
+                else:
+                    error_details = f"Gemini API 연결 오류 ({connection_id}): {str(e)}. 시간: {gemini_request_end_time - gemini_request_start_time:.2f}초"
                 print(error_details)
                 raise Exception(error_details)
             except Exception as e:
@@ -489,115 +766,197 @@ JSON 예시
                 print(error_details)
                 raise Exception(error_details)
 
-            send_websocket_message(connection_id, {"action": "status_update", "message": "생성된 여행 계획을 저장 중입니다..."})
-            
-            dynamodb_write_start_time = time.time()
-            dynamodb = boto3.resource('dynamodb')
-            table = dynamodb.Table('travel-plans')
-            
-            # planId를 plan-xxxxxxxxxx 형식으로 생성 (원본과 같은 형식)
-            plan_id = f'plan-{int(time.time())}'
-            
-            # 원본 createFunction_python.py와 같은 구조로 저장
-            save_item = {
-                'user_id': user_id,  # 이메일을 사용자 ID로 저장
-                'planId': plan_id,   # plan-xxxxxxxxxx 형식
-                'plan_data': gemini_result,
-            }
-            
-            # 다중 항공편 정보 저장 (새로운 방식만 사용)
+        # 설명문/코드 블록/trailing comma 등이 섞인 응답은 저장 전에 정리된 JSON 텍스트로 교체
+        with metrics.timer('parse'):
+            normalized_plan, json_repairs = normalize_envelope_text(gemini_result)
+        json_repairs = sorted(set(schema_repairs + json_repairs))
+        if json_repairs:
+            print(f"[PlanJSON] 응답 JSON 복구 ({connection_id}): {json_repairs}")
+
+        send_websocket_message(connection_id, {"action": "status_update", "message": "생성된 여행 계획을 저장 중입니다..."})
+        
+        dynamodb_write_start_time = time.time()
+        table = get_table('travel-plans')  # 스레드별 Table 리소스를 warm 호출 간 재사용
+        
+        # planId: 원장에 예약된 ID(재시도해도 같은 항목에 저장) 또는 새 시간순 고유 ID (plan-밀리초-무작위)
+        plan_id = ledger_entry['plan_id'] if ledger_entry else new_plan_id()
+        
+        # 원본 createFunction_python.py와 같은 구조로 저장
+        save_item = {
+            'user_id': user_id,  # 이메일을 사용자 ID로 저장
+            'planId': plan_id,   # plan-xxxxxxxxxxxxx-xxxxxxxxxx 형식
+        }
+        # 파싱된 계획을 압축해 plan_blob으로 저장 (파싱 실패 시 예전처럼 응답 envelope 그대로 plan_data)
+        save_item.update(plan_item_attributes(gemini_result, normalized_plan, start_date, end_date))
+        # 목록 요약 인덱스(PlanSummaryIndex)에 투영되는 요약 속성 (제목, 기간, 목적지, 썸네일 도시 코드, 결제 여부)
+        save_item.update(summary_attributes(normalized_plan, flights_to_process, accommodations_to_process, start_date, end_date))
+        # 수정 람다(modifyPlanAsync)의 조건부 쓰기 기준 버전
+        save_item['plan_version'] = INITIAL_PLAN_VERSION
+        
+        if flights_to_process:
+            save_item['is_round_trip'] = is_round_trip
+
+        # 항공편/숙박 원본은 내용 해시로 한 번만 저장하고 계획에는 참조 목록(booking_refs)만 저장
+        # (원본 저장소를 쓰지 않으면 예전처럼 flight_info_N / accmo_info_N)
+        booking_refs = booking_attributes(flights_to_process, accommodations_to_process)
+        if booking_refs:
+            save_item.update(booking_refs)
+            print(f"항공편/숙박 참조 저장 ({connection_id}): 항공편 {len(flights_to_process)}개, 숙박편 {len(accommodations_to_process)}개")
+        else:
+            # 다중 항공편: flight_info_1, flight_info_2, ... 형태로 저장
             if flights_to_process:
-                save_item['is_round_trip'] = is_round_trip
-                
-                # 다중 항공편: flight_info_1, flight_info_2, ... 형태로 저장
                 for i, flight in enumerate(flights_to_process):
                     save_item[f'flight_info_{i+1}'] = json.dumps(flight, cls=DecimalEncoder)
-                
-                # 총 항공편 개수 저장
                 save_item['total_flights'] = len(flights_to_process)
                 print(f"다중 항공편 저장 ({connection_id}): {len(flights_to_process)}개 항공편")
-            
-            # 다중 숙박 정보 저장 (새로운 방식만 사용)
+
+            # 다중 숙박편: accmo_info_1, accmo_info_2, ... 형태로 저장
             if accommodations_to_process:
-                # 다중 숙박편: accmo_info_1, accmo_info_2, ... 형태로 저장
                 for i, accommodation in enumerate(accommodations_to_process):
                     save_item[f'accmo_info_{i+1}'] = json.dumps(accommodation, cls=DecimalEncoder)
-                
-                # 총 숙박편 개수 저장
                 save_item['total_accommodations'] = len(accommodations_to_process)
                 print(f"다중 숙박편 저장 ({connection_id}): {len(accommodations_to_process)}개 숙박편")
 
-            print("저장할 항목:", json.dumps(save_item, cls=DecimalEncoder))
-            
+        log.debug('저장할 항목', item=save_item)
+        # 400KB 항목 한도에 가까우면 큰 속성(항공편/숙박 원본, 계획 본문)을 S3로 옮기고 포인터만 저장
+        save_item = offload_large_attributes(save_item)
+        
+        # 마감으로 배치가 이 레코드를 포기했으면 다시 전달된 메시지와 겹쳐 저장하지 않음
+        ensure_record_active()
+        if ledger_entry:
+            # 완료 전에 실패했던 요청의 재시도는 같은 planId 항목을 덮어씀 (계획이 두 벌 생기지 않음)
             table.put_item(Item=save_item)
-            dynamodb_write_end_time = time.time()
-            print(f"DynamoDB 저장 완료 ({connection_id}). planId: {plan_id}, 시간: {dynamodb_write_end_time - dynamodb_write_start_time:.2f}초")
-
-            lambda_end_time = time.time()
-            total_lambda_duration = lambda_end_time - lambda_start_time
-            print(f"Lambda 함수 총 실행 시간 ({connection_id}): {total_lambda_duration:.2f}초")
-
-            # 클라이언트에게 반환할 최종 응답 (원본과 동일한 구조)
-            final_response_data = {
-                "action": "plan_created",
-                "message": f"여행 계획이 성공적으로 생성되었습니다! ID: {plan_id}",
-                "planId": plan_id,
-                "redirectUrl": f"/planner/{plan_id}" # 프론트엔드 라우팅 경로
-            }
-            
-            # Gemini 결과 파싱 검증
-            final_parsed_plan_for_warning_check = None
-            if gemini_result and 'candidates' in gemini_result and gemini_result['candidates']:
-                try:
-                    candidate = gemini_result['candidates'][0]
-                    if 'content' in candidate and 'parts' in candidate['content']:
-                        parts = candidate['content']['parts']
-                        if parts and len(parts) > 0:
-                            text_content = parts[0].get('text', '').strip()
-                            print(f"Gemini 응답 텍스트 길이 ({connection_id}): {len(text_content)}")
-                            
-                            if text_content:
-                                # JSON 파싱 시도
-                                try:
-                                    parsed_plan = json.loads(text_content)
-                                    final_parsed_plan_for_warning_check = parsed_plan
-                                    print(f"Gemini 응답 파싱 성공 ({connection_id})")
-                                except json.JSONDecodeError as json_e:
-                                    print(f"Gemini 응답 JSON 파싱 실패 ({connection_id}): {str(json_e)}")
-                                    print(f"응답 텍스트 앞부분 (200자): {text_content[:200]}")
-                            else:
-                                print(f"Gemini 응답 텍스트가 비어있음 ({connection_id})")
+            plan_ledger.complete(ledger_entry)
+        else:
+            table.put_item(Item=save_item, ConditionExpression='attribute_not_exists(planId)')
+        flight_subscribers = single_flight.complete(single_flight_key, flight_owner, plan_id) if single_flight else []
+        # 생성 중에 구독한 같은 요청들의 원장 항목도 이 planId로 완료 (재시도/중복 전달이 다시 생성하지 않도록)
+        for _, subscriber_ledger_entry in flight_subscribers:
+            if plan_ledger and subscriber_ledger_entry:
+                plan_ledger.complete(dict(subscriber_ledger_entry, plan_id=plan_id))
+        dynamodb_write_duration = metrics.record_since('dynamodb_write', dynamodb_write_start_time)
+        metrics.set_property('planId', plan_id)
+        trace.attributes['planId'] = plan_id
+        print(f"DynamoDB 저장 완료 ({connection_id}). planId: {plan_id}, 시간: {dynamodb_write_duration:.2f}초")
+
+        lambda_end_time = time.time()
+        total_lambda_duration = lambda_end_time - lambda_start_time
+        print(f"Lambda 함수 총 실행 시간 ({connection_id}): {total_lambda_duration:.2f}초")
+
+        final_response_data = plan_created_message(plan_id)
+        
+        # Gemini 결과 파싱 검증
+        final_parsed_plan_for_warning_check = None
+        if gemini_result and 'candidates' in gemini_result and gemini_result['candidates']:
+            try:
+                candidate = gemini_result['candidates'][0]
+                if 'content' in candidate and 'parts' in candidate['content']:
+                    parts = candidate['content']['parts']
+                    if parts and len(parts) > 0:
+                        text_content = parts[0].get('text', '').strip()
+                        print(f"Gemini 응답 텍스트 길이 ({connection_id}): {len(text_content)}")
+                        
+                        if text_content:
+                            # JSON 파싱 시도
+                            try:
+                                parsed_plan, _ = extract_json(text_content)
+                                final_parsed_plan_for_warning_check = parsed_plan
+                                print(f"Gemini 응답 파싱 성공 ({connection_id})")
+                            except ValueError as json_e:
+                                print(f"Gemini 응답 JSON 파싱 실패 ({connection_id}): {str(json_e)}")
+                                print(f"응답 텍스트 앞부분 (200자): {text_content[:200]}")
                         else:
-                            print(f"Gemini 응답에 parts가 없음 ({connection_id})")
+                            print(f"Gemini 응답 텍스트가 비어있음 ({connection_id})")
                     else:
-                        print(f"Gemini 응답에 content 또는 parts가 없음 ({connection_id})")
-                except Exception as parse_e:
-                    print(f"Gemini 응답 구조 파싱 실패 ({connection_id}): {str(parse_e)}")
+                        print(f"Gemini 응답에 parts가 없음 ({connection_id})")
+                else:
+                    print(f"Gemini 응답에 content 또는 parts가 없음 ({connection_id})")
+            except Exception as parse_e:
+                print(f"Gemini 응답 구조 파싱 실패 ({connection_id}): {str(parse_e)}")
+        else:
+            print(f"Gemini 응답에 candidates가 없음 ({connection_id})")
+                
+        # 파싱에 실패했거나 끊긴 부분을 잘라내고 복구한 경우 경고
+        if not final_parsed_plan_for_warning_check or 'truncated' in json_repairs:
+            final_response_data['warning'] = '계획 내용이 백엔드에서 완전히 파싱되지 않았을 수 있습니다. ID로 조회하여 확인하세요.'
+        elif plan_cache and not cached_response_text:
+            # 정상적으로 파싱된 응답만 캐시에 저장
+            plan_cache.put(cache_key, json.dumps(gemini_result, ensure_ascii=False, cls=DecimalEncoder))
+
+        print(f"최종 응답 데이터 ({connection_id}): planId={plan_id}")
+
+        send_websocket_message(connection_id, final_response_data)
+        # 생성 중에 같은 요청을 보낸 연결들에도 같은 결과 전달
+        for subscriber_id, _ in flight_subscribers:
+            if subscriber_id != connection_id:
+                send_websocket_message(subscriber_id, final_response_data)
+
+    except ConnectionGoneError as e:
+        # 클라이언트가 떠나 생성을 중단한 경우: 재시도/DLQ 없이 완료 처리 (같은 clientRequestId로 다시 요청하면 같은 planId로 생성)
+        print(f"{e}, 총 시간: {time.time() - lambda_start_time:.2f}초")
+        metrics.count('record_cancelled')
+        record_error = e
+        if single_flight:
+            # 중단을 정할 때는 구독자가 없었음 (그 뒤에 구독한 연결에만 다시 요청하도록 알림)
+            for subscriber_id in single_flight.fail(single_flight_key, flight_owner):
+                send_websocket_message(subscriber_id, {"action": "error", "message": "여행 계획 생성이 중단되었습니다. 다시 요청해 주세요."})
+
+    except RecordAbandonedError as e:
+        # 다시 전달된 메시지가 처리하므로 리스/구독, 재시도, DLQ 모두 건드리지 않음
+        print(f"{e} ({connection_id})")
+        record_error = e
+
+    except Exception as e:
+        lambda_end_time = time.time()
+        total_lambda_duration = lambda_end_time - lambda_start_time
+        error_message_str = str(e)
+        print(f'Lambda 함수 오류 ({connection_id if connection_id else "Unknown ConnectionId"}): {error_message_str}, 총 시간: {total_lambda_duration:.2f}초')
+        record_error = e
+
+        retry = should_retry(record, e)
+        if single_flight:
+            # 재시도하면 리스만 놓고 구독은 유지 (다음 시도가 결과 전달), 아니면 구독자에게도 오류 알림
+            if retry:
+                single_flight.release(single_flight_key, flight_owner)
             else:
-                print(f"Gemini 응답에 candidates가 없음 ({connection_id})")
-                    
-            if not final_parsed_plan_for_warning_check:
-                final_response_data['warning'] = '계획 내용이 백엔드에서 완전히 파싱되지 않았을 수 있습니다. ID로 조회하여 확인하세요.'
+                for subscriber_id in single_flight.fail(single_flight_key, flight_owner):
+                    send_websocket_message(subscriber_id, {"action": "error", "message": "여행 계획 생성 중 서버에서 오류가 발생했습니다.", "error_details": error_message_str})
+
+        # 일시적 오류(타임아웃, 429/5xx 등)는 SQS가 이 레코드만 다시 전달하도록 batchItemFailures로 보고
+        if retry:
+            print(f"일시적 오류로 재시도 예정 ({connection_id}): 시도 {receive_count(record)}회")
+            if connection_id:
+                send_websocket_message(connection_id, {"action": "status_update", "message": "일시적인 오류가 발생하여 잠시 후 다시 시도합니다..."})
+            metrics.count('record_retry')
+            raise RetryableRecordError(error_message_str) from e
+
+        if connection_id: # 연결 ID가 있으면 클라이언트에게 오류 알림
+            error_payload = {
+                "action": "error",
+                "message": "여행 계획 생성 중 서버에서 오류가 발생했습니다.",
+                "error_details": error_message_str 
+            }
+            send_websocket_message(connection_id, error_payload)
+        # 영구 오류이거나 시도 횟수를 다 쓴 메시지는 재시도하지 않고 DLQ로
+        send_to_dead_letter_queue(record, e, label='createPlanAsync')
+        metrics.count('record_dead_letter')
 
-            print(f"최종 응답 데이터 ({connection_id}): planId={plan_id}")
+    finally:
+        metrics.flush()
+        finish_trace(error=record_error)
 
-            send_websocket_message(connection_id, final_response_data)
 
-        except Exception as e:
-            lambda_end_time = time.time()
-            total_lambda_duration = lambda_end_time - lambda_start_time
-            error_message_str = str(e)
-            print(f'Lambda 함수 오류 ({connection_id if connection_id else "Unknown ConnectionId"}): {error_message_str}, 총 시간: {total_lambda_duration:.2f}초')
-            
-            if connection_id: # 연결 ID가 있으면 클라이언트에게 오류 알림
-                error_payload = {
-                    "action": "error",
-                    "message": "여행 계획 생성 중 서버에서 오류가 발생했습니다.",
-                    "error_details": error_message_str 
-                }
-                send_websocket_message(connection_id, error_payload)
+def lambda_handler(event, context):
+    records = event.get('Records', [])
+    log.info('SQS 이벤트 수신', records=len(records), messageIds=[record.get('messageId') for record in records])
+    log.debug('SQS 이벤트', event=event)
+
+    # 배치 안의 레코드를 제한된 스레드 풀에서 동시에 처리 (SQS_BATCH_MAX_WORKERS). 레코드별 오류는 process_record 안에서 처리
+    results = process_records(records, process_record, context, label='createPlanAsync')
 
+    # 다시 처리할 레코드만 SQS에 알림 (나머지는 삭제됨)
     return {
         'statusCode': 200,
-        'body': json.dumps('SQS 메시지 처리 완료', ensure_ascii=False)
+        'body': json.dumps('SQS 메시지 처리 완료', ensure_ascii=False),
+        'batchItemFailures': batch_item_failures(results)
     }
@@ -0,0 +1,226 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+
+from lambda_runtime import get_resource, get_table
+
+# 항공편/숙박 원본 저장소 (Python Lambda Layer)
+# 예전 형식: 계획마다 flight_info_1..N / accmo_info_1..N 에 json.dumps 문자열을 따로 저장하고 total_flights/total_accommodations
+#           개수를 함께 관리 -> 인기 항공편/호텔 객체가 계획 수만큼 중복 저장됨
+# 새 형식: 항공편/숙박 객체를 정규화(키 정렬, 공백 없는 JSON)해 내용 해시로 한 번만 저장하고,
+#         계획에는 booking_refs = ['f:<해시>', ..., 'a:<해시>', ...] (항공편 순서 -> 숙박 순서) 목록 하나만 둔다.
+#
+# 테이블 스키마: 파티션 키 artifact_id (S) = '<종류>:<sha256 앞 32자>', 속성 kind, data(정규화 JSON 문자열), created_at
+# 내용이 같으면 ID가 같으므로 한 번 쓴 항목은 바뀌지 않는다 (컨테이너 LRU로 이미 있는 항목은 다시 쓰지 않음).
+# 읽기: resolve_booking_refs(item)가 예전 속성(flight_info_N, accmo_info_N, total_*)을 채워 주므로 기존 코드는 그대로 동작.
+#      항목에 flight_info_N이 이미 있으면(이후 부분 업데이트로 다시 쓴 목록) 그 목록을 우선한다.
+# Node 로더(load_web, load_mobile)의 resolveBookingRefs도 같은 형식을 읽는다.
+#
+# BOOKING_ARTIFACT_TABLE이 없으면 비활성 (예전처럼 번호 붙은 속성으로 저장), 'local'이면 메모리 내 LocalTable 사용 (테스트용)
+# 계획이 삭제되어도 공유 항목은 남는다 (다른 계획이 참조할 수 있음).
+
+BOOKING_ARTIFACT_TABLE = os.environ.get('BOOKING_ARTIFACT_TABLE')
+BOOKING_ARTIFACT_LRU_SIZE = int(os.environ.get('BOOKING_ARTIFACT_LRU_SIZE', '512'))
+
+KIND_FLIGHT = 'flight'
+KIND_ACCOMMODATION = 'accommodation'
+_KIND_PREFIXES = {KIND_FLIGHT: 'f', KIND_ACCOMMODATION: 'a'}
+# 예전 형식의 번호 붙은 속성 이름과 개수 속성
+_LEGACY_ATTRIBUTES = {'f': ('flight_info_', 'total_flights'), 'a': ('accmo_info_', 'total_accommodations')}
+
+_BATCH_GET_SIZE = 100  # BatchGetItem 한 번에 요청할 수 있는 최대 키 수
+_BATCH_GET_MAX_ATTEMPTS = 5
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f'{type(value).__name__}은(는) JSON으로 변환할 수 없습니다')
+
+
+def canonical_json(value):
+    """키 정렬 + 공백 없는 JSON (같은 내용이면 같은 문자열)."""
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(',', ':'), default=_json_default)
+
+
+def artifact_id(kind, data):
+    """정규화 JSON 문자열의 내용 해시로 만든 ID."""
+    prefix = _KIND_PREFIXES[kind]
+    return f"{prefix}:{hashlib.sha256(data.encode('utf-8')).hexdigest()[:32]}"
+
+
+class BookingArtifactStore:
+    def __init__(self, table_factory, batch_get_item=None, max_entries=BOOKING_ARTIFACT_LRU_SIZE):
+        self.table_factory = table_factory  # 현재 스레드의 Table 리소스를 반환
+        self.batch_get_item = batch_get_item  # 없으면 키마다 get_item (LocalTable)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # artifact_id -> data (쓴/읽은 항목, 내용이 바뀌지 않으므로 만료 없음)
+        self._lock = threading.Lock()
+        self.stats = {'put_refs': 0, 'written': 0, 'local_hits': 0, 'fetched': 0}
+
+    def _remember(self, entries):
+        with self._lock:
+            for key, data in entries.items():
+                self._entries[key] = data
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _cached(self, keys):
+        with self._lock:
+            found = {key: self._entries[key] for key in keys if key in self._entries}
+            for key in found:
+                self._entries.move_to_end(key)
+            self.stats['local_hits'] += len(found)
+        return found
+
+    def _batch_get(self, keys, projection=None):
+        """artifact_id -> 항목. BatchGetItem은 100개씩, 처리되지 않은 키는 짧게 기다렸다가 다시 요청."""
+        table = self.table_factory()
+        if self.batch_get_item is None:
+            items = (table.get_item(Key={'artifact_id': key}).get('Item') for key in keys)
+            return {item['artifact_id']: item for item in items if item}
+        found = {}
+        for start in range(0, len(keys), _BATCH_GET_SIZE):
+            request = {'Keys': [{'artifact_id': key} for key in keys[start:start + _BATCH_GET_SIZE]]}
+            if projection:
+                request['ProjectionExpression'] = projection
+            for attempt in range(_BATCH_GET_MAX_ATTEMPTS):
+                response = self.batch_get_item(RequestItems={table.name: request})
+                for item in response.get('Responses', {}).get(table.name, []):
+                    found[item['artifact_id']] = item
+                request = response.get('UnprocessedKeys', {}).get(table.name)
+                if not request:
+                    break
+                time.sleep(0.05 * 2 ** attempt)
+        return found
+
+    def put_many(self, artifacts):
+        """[(종류, 객체)] -> 같은 순서의 artifact_id 목록. 테이블에 없는 항목만 batch_writer로 쓴다."""
+        refs, pending = [], {}
+        for kind, value in artifacts:
+            data = canonical_json(value)
+            key = artifact_id(kind, data)
+            refs.append(key)
+            pending[key] = (kind, data)
+        cached = self._cached(list(pending))
+        missing = [key for key in pending if key not in cached]
+        if missing:
+            existing = self._batch_get(missing, projection='artifact_id')
+            to_write = [key for key in missing if key not in existing]
+            if to_write:
+                now = int(time.time())
+                with self.table_factory().batch_writer() as batch:
+                    for key in to_write:
+                        kind, data = pending[key]
+                        batch.put_item(Item={'artifact_id': key, 'kind': kind, 'data': data, 'created_at': now})
+            with self._lock:
+                self.stats['written'] += len(to_write)
+        self._remember({key: data for key, (kind, data) in pending.items()})
+        with self._lock:
+            self.stats['put_refs'] += len(refs)
+        return refs
+
+    def get_texts(self, refs):
+        """artifact_id -> 정규화 JSON 문자열 (없는 ID는 빠짐)."""
+        keys = list(dict.fromkeys(refs))
+        found = self._cached(keys)
+        missing = [key for key in keys if key not in found]
+        if missing:
+            fetched = {key: item['data'] for key, item in self._batch_get(missing).items()}
+            with self._lock:
+                self.stats['fetched'] += len(fetched)
+            self._remember(fetched)
+            found.update(fetched)
+        return found
+
+    def get_many(self, refs):
+        """artifact_id -> 객체 (숫자는 Decimal)."""
+        return {key: json.loads(data, parse_float=Decimal) for key, data in self.get_texts(refs).items()}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _create_store():
+    if BOOKING_ARTIFACT_TABLE == 'local':
+        from local_dynamodb import LocalTable
+        table = LocalTable('booking-artifacts', ['artifact_id'])
+        return BookingArtifactStore(lambda: table)
+    # Table/resource는 스레드별이므로 호출할 때마다 현재 스레드의 것을 사용 (BatchGetItem은 resource 메서드)
+    return BookingArtifactStore(lambda: get_table(BOOKING_ARTIFACT_TABLE),
+                                lambda **kwargs: get_resource('dynamodb').batch_get_item(**kwargs))
+
+
+def get_booking_artifact_store():
+    """컨테이너 단위로 공유되는 항공편/숙박 원본 저장소. BOOKING_ARTIFACT_TABLE이 없으면 None."""
+    global _store
+    if not BOOKING_ARTIFACT_TABLE:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _create_store()
+    return _store
+
+
+def booking_attributes(flights, accommodations):
+    """save_item에 넣을 항공편/숙박 속성. 저장소가 꺼져 있거나 둘 다 없으면 None (예전 형식으로 저장)."""
+    store = get_booking_artifact_store()
+    if store is None or not (flights or accommodations):
+        return None
+    refs = store.put_many([(KIND_FLIGHT, flight) for flight in flights or []] +
+                          [(KIND_ACCOMMODATION, accommodation) for accommodation in accommodations or []])
+    return {'booking_refs': refs}
+
+
+def resolve_booking_refs(item):
+    """booking_refs를 예전 속성(flight_info_N, accmo_info_N, total_*)으로 풀어 item에 채움."""
+    refs = item.get('booking_refs') if item else None
+    if not refs:
+        return item
+    store = get_booking_artifact_store()
+    if store is None:
+        print("[BookingArtifacts] BOOKING_ARTIFACT_TABLE이 없어 booking_refs를 해석할 수 없습니다.")
+        return item
+    texts = store.get_texts(refs)
+    for prefix, (attribute_prefix, total_name) in _LEGACY_ATTRIBUTES.items():
+        kind_refs = [ref for ref in refs if ref.startswith(prefix + ':')]
+        if not kind_refs or any(name.startswith(attribute_prefix) for name in item):
+            continue
+        for index, ref in enumerate(kind_refs):
+            if ref in texts:
+                item[f'{attribute_prefix}{index + 1}'] = texts[ref]
+            else:
+                print(f"[BookingArtifacts] 참조한 항목이 없습니다: {ref}")
+        item[total_name] = len(kind_refs)
+    del item['booking_refs']
+    return item
+
+
+def _stored_objects(item, single_name, numbered_prefix):
+    """flight_info / flight_info_N (JSON 문자열) -> 객체 목록 (번호 순서, 파싱할 수 없는 값은 건너뜀)."""
+    names = [single_name] if single_name in item else sorted(
+        (name for name in item if re.fullmatch(rf'{numbered_prefix}\d+', name)),
+        key=lambda name: int(name[len(numbered_prefix):]))
+    objects = []
+    for name in names:
+        value = item[name]
+        try:
+            objects.append(json.loads(value, parse_float=Decimal) if isinstance(value, str) else value)
+        except ValueError:
+            print(f"[BookingArtifacts] {name} 파싱 실패, 건너뜀")
+    return objects
+
+
+def stored_bookings(item):
+    """저장된 항목의 (항공편 목록, 숙박 목록). booking_refs는 먼저 resolve_booking_refs로 풀어 둔다.
+    createPlanAsync의 flight_info_N/accmo_info_N과 create_mobile의 단일 flight_info/accmo_info 모두 읽는다."""
+    return (_stored_objects(item, 'flight_info', 'flight_info_'),
+            _stored_objects(item, 'accmo_info', 'accmo_info_'))
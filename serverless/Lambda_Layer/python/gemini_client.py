@@ -0,0 +1,311 @@
+import gzip
+import http.client
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+# Gemini API 공용 클라이언트 (Python Lambda Layer)
+# - 컨테이너가 살아있는 동안 HTTPS 연결을 풀에 보관하여 재사용 (keep-alive)
+#   => warm 호출에서는 DNS + TCP + TLS 핸드셰이크 비용이 사라짐
+# - 호출마다 타임아웃 지정 가능
+# - 연결/첫 바이트(TTFB)/전체 소요 시간을 응답과 함께 반환
+
+GEMINI_API_BASE = os.environ.get('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com')
+GEMINI_API_VERSION = os.environ.get('GEMINI_API_VERSION', 'v1beta')
+DEFAULT_MODEL = os.environ.get('GEMINI_MODEL', 'gemini-2.0-flash')
+DEFAULT_POOL_SIZE = int(os.environ.get('GEMINI_POOL_SIZE', '8'))  # 일차별 병렬 생성 동시 호출 수와 맞춤
+DEFAULT_TIMEOUT = float(os.environ.get('GEMINI_TIMEOUT_SECONDS', '120'))
+
+# 재사용한 연결이 서버 쪽에서 이미 닫혀 있을 때 발생하는 예외들 (새 연결로 1회 재시도)
+_STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    http.client.CannotSendRequest,
+    http.client.BadStatusLine,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+
+
+class GeminiAPIError(Exception):
+    """Gemini API 호출 실패. status가 None이면 네트워크/타임아웃 오류."""
+
+    def __init__(self, message, status=None, body=None, timings=None):
+        super().__init__(message)
+        self.status = status
+        self.body = body
+        self.timings = timings or {}
+
+    @property
+    def retryable(self):
+        # 타임아웃/연결 오류, 429, 5xx 는 일시적 오류로 간주
+        return self.status is None or self.status == 429 or self.status >= 500
+
+
+class GeminiResponse:
+    def __init__(self, status, text, timings, reused):
+        self.status = status
+        self.text = text
+        self.timings = timings
+        self.reused = reused
+
+    def json(self, parse_float=None):
+        return json.loads(self.text, parse_float=parse_float)
+
+
+class GeminiStream:
+    """SSE 응답 순회기. 끝까지 읽으면 연결을 풀에 반납하고 timings['total']을 채운다."""
+
+    def __init__(self, pool, conn, response, timings, reused, start_time):
+        self.status = response.status
+        self.timings = timings
+        self.reused = reused
+        self.first_chunk_time = None  # 첫 번째 청크 도착까지의 시간 (초)
+        self._pool = pool
+        self._conn = conn
+        self._response = response
+        self._start_time = start_time
+
+    def __iter__(self):
+        data_lines = []
+        try:
+            for raw_line in self._response:
+                line = raw_line.decode('utf-8').rstrip('\r\n')
+                if line.startswith('data:'):
+                    data_lines.append(line[5:].lstrip())
+                    continue
+                if line or not data_lines:
+                    continue
+                # 빈 줄 = 이벤트 경계
+                chunk = json.loads('\n'.join(data_lines))
+                data_lines = []
+                if self.first_chunk_time is None:
+                    self.first_chunk_time = time.time() - self._start_time
+                yield chunk
+            if data_lines:
+                yield json.loads('\n'.join(data_lines))
+        except GeneratorExit:
+            # 소비자가 중간에 멈춘 경우: 응답을 다 읽지 않은 연결은 재사용할 수 없음
+            self._conn.close()
+            raise
+        except Exception as e:
+            self._conn.close()
+            self.timings['total'] = time.time() - self._start_time
+            raise GeminiAPIError(f"Gemini 스트림 수신 오류: {type(e).__name__} - {e}", timings=self.timings) from e
+        # 남은 바이트를 비워 응답을 닫아야 같은 연결로 다음 요청을 보낼 수 있음
+        self._response.read()
+        self.timings['total'] = time.time() - self._start_time
+        self._pool.release(self._conn)
+
+
+class _ConnectionPool:
+    """호스트 하나에 대한 유휴 HTTPS 연결 보관소 (스레드 안전)."""
+
+    def __init__(self, scheme, host, port, max_idle):
+        self._scheme = scheme
+        self._host = host
+        self._port = port
+        self._max_idle = max_idle
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout, fresh=False):
+        conn = None
+        if not fresh:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+        if conn is not None:
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            return conn, True
+
+        conn_class = http.client.HTTPSConnection if self._scheme == 'https' else http.client.HTTPConnection
+        return conn_class(self._host, self._port, timeout=timeout), False
+
+    def release(self, conn):
+        with self._lock:
+            if len(self._idle) < self._max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class GeminiClient:
+    def __init__(self, api_key=None, base_url=GEMINI_API_BASE, model=DEFAULT_MODEL,
+                 pool_size=DEFAULT_POOL_SIZE, default_timeout=DEFAULT_TIMEOUT):
+        parsed = urlsplit(base_url)
+        self._api_key = api_key
+        self._base_path = parsed.path.rstrip('/')
+        self.model = model
+        self.default_timeout = default_timeout
+        self._pool = _ConnectionPool(parsed.scheme, parsed.hostname, parsed.port, pool_size)
+
+    @property
+    def api_key(self):
+        # 키는 호출 시점에 읽음 (핸들러의 환경변수 검사와 동일한 값을 사용)
+        return self._api_key or os.environ.get('GEMINI_API_KEY')
+
+    def model_path(self, model, method):
+        return f"{self._base_path}/{GEMINI_API_VERSION}/models/{model or self.model}:{method}"
+
+    def api_path(self, resource):
+        return f"{self._base_path}/{GEMINI_API_VERSION}/{resource}"
+
+    def create_cached_content(self, body, timeout=None):
+        """cachedContents 리소스 생성. 응답의 name(cachedContents/...)을 generateContent의 cachedContent로 사용."""
+        return self.request('POST', self.api_path('cachedContents'), json.dumps(body).encode('utf-8'), timeout)
+
+    def update_cached_content_ttl(self, name, ttl_seconds, timeout=None):
+        body = json.dumps({'ttl': f'{int(ttl_seconds)}s'}).encode('utf-8')
+        return self.request('PATCH', self.api_path(name) + '?updateMask=ttl', body, timeout)
+
+    def generate_content(self, payload, model=None, timeout=None):
+        body = json.dumps(payload).encode('utf-8')
+        return self.request('POST', self.model_path(model, 'generateContent'), body, timeout)
+
+    def stream_generate_content(self, payload, model=None, timeout=None):
+        """streamGenerateContent(SSE) 호출. 반환된 GeminiStream을 순회하면 응답 청크(dict)가 도착하는 대로 나온다."""
+        body = json.dumps(payload).encode('utf-8')
+        path = self.model_path(model, 'streamGenerateContent') + '?alt=sse'
+        timeout = timeout or self.default_timeout
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream",
+            "x-goog-api-key": self.api_key or '',
+        }
+
+        start_time = time.time()
+        conn, reused = self._pool.acquire(timeout)
+        try:
+            connect_time = 0.0
+            if conn.sock is None:
+                connect_start = time.time()
+                conn.connect()
+                connect_time = time.time() - connect_start
+            try:
+                conn.request('POST', path, body=body, headers=headers)
+                response = conn.getresponse()
+            except _STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                conn.close()
+                conn, reused = self._pool.acquire(timeout, fresh=True)
+                connect_start = time.time()
+                conn.connect()
+                connect_time = time.time() - connect_start
+                conn.request('POST', path, body=body, headers=headers)
+                response = conn.getresponse()
+        except Exception as e:
+            conn.close()
+            timings = {'connect': 0.0, 'ttfb': 0.0, 'total': time.time() - start_time}
+            raise GeminiAPIError(f"Gemini API 연결 오류: {type(e).__name__} - {e}", timings=timings) from e
+
+        timings = {'connect': connect_time, 'ttfb': time.time() - start_time, 'total': None}
+        if response.status >= 400:
+            text = response.read().decode('utf-8', errors='replace')
+            self._pool.release(conn)
+            timings['total'] = time.time() - start_time
+            raise GeminiAPIError(f"Gemini API HTTP 오류: {response.status}", status=response.status, body=text, timings=timings)
+        return GeminiStream(self._pool, conn, response, timings, reused, start_time)
+
+    def request(self, method, path, body=None, timeout=None):
+        timeout = timeout or self.default_timeout
+        headers = {
+            "Content-Type": "application/json",
+            "Accept-Encoding": "gzip",
+            "x-goog-api-key": self.api_key or '',
+        }
+
+        start_time = time.time()
+        conn, reused = self._pool.acquire(timeout)
+        try:
+            try:
+                status, raw, response_headers, connect_time, ttfb = self._send(conn, method, path, body, headers, start_time)
+            except _STALE_CONNECTION_ERRORS:
+                if not reused:
+                    raise
+                # 유휴 중 서버가 끊은 연결 -> 새 연결로 한 번만 재시도
+                conn.close()
+                conn, reused = self._pool.acquire(timeout, fresh=True)
+                status, raw, response_headers, connect_time, ttfb = self._send(conn, method, path, body, headers, start_time)
+        except Exception as e:
+            conn.close()
+            timings = {'connect': 0.0, 'ttfb': 0.0, 'total': time.time() - start_time}
+            raise GeminiAPIError(f"Gemini API 연결 오류: {type(e).__name__} - {e}", timings=timings) from e
+
+        if (response_headers.get('Connection') or '').lower() == 'close':
+            conn.close()
+        else:
+            self._pool.release(conn)
+
+        if (response_headers.get('Content-Encoding') or '').lower() == 'gzip':
+            raw = gzip.decompress(raw)
+        text = raw.decode('utf-8')
+        timings = {'connect': connect_time, 'ttfb': ttfb, 'total': time.time() - start_time}
+
+        if status >= 400:
+            raise GeminiAPIError(f"Gemini API HTTP 오류: {status}", status=status, body=text, timings=timings)
+        return GeminiResponse(status, text, timings, reused)
+
+    def _send(self, conn, method, path, body, headers, start_time):
+        connect_time = 0.0
+        if conn.sock is None:
+            connect_start = time.time()
+            conn.connect()
+            connect_time = time.time() - connect_start
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        ttfb = time.time() - start_time
+        raw = response.read()
+        return response.status, raw, response.headers, connect_time, ttfb
+
+    def close(self):
+        self._pool.close()
+
+
+def chunk_text(chunk):
+    """스트림 청크(또는 전체 응답)에서 첫 번째 candidate의 텍스트를 이어붙여 반환."""
+    candidates = chunk.get('candidates') or []
+    if not candidates:
+        return ''
+    parts = (candidates[0].get('content') or {}).get('parts') or []
+    return ''.join(part.get('text', '') for part in parts if isinstance(part, dict))
+
+
+def build_envelope(text, last_chunk=None):
+    """스트림으로 받은 텍스트를 generateContent 응답과 같은 구조로 다시 감싼다 (저장 형식 유지용)."""
+    last_chunk = last_chunk or {}
+    candidate = ((last_chunk.get('candidates') or [{}])[0]) or {}
+    envelope = {
+        'candidates': [{
+            'content': {'parts': [{'text': text}], 'role': 'model'},
+            'finishReason': candidate.get('finishReason', 'STOP'),
+        }],
+    }
+    if 'usageMetadata' in last_chunk:
+        envelope['usageMetadata'] = last_chunk['usageMetadata']
+    if 'modelVersion' in last_chunk:
+        envelope['modelVersion'] = last_chunk['modelVersion']
+    return envelope
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_gemini_client():
+    """컨테이너 단위로 공유되는 GeminiClient (warm 호출 간 연결 재사용)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = GeminiClient()
+    return _client
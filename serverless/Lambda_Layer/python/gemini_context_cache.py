@@ -0,0 +1,150 @@
+import hashlib
+import os
+import threading
+import time
+
+from gemini_client import GeminiAPIError
+
+# Gemini 컨텍스트 캐시 (Python Lambda Layer)
+# 요청마다 동일한 고정 지시문(plan_prompts.plan_instruction_text)을 cachedContents 리소스로 한 번 만들어 두고,
+# 각 요청은 cachedContent 이름 + 요청별 프롬프트만 보낸다. => 입력 토큰 처리 시간/비용 감소
+# - 지시문 해시 + 모델 단위로 컨테이너에 보관, 만료 GEMINI_CONTEXT_CACHE_REFRESH_SECONDS 전에 TTL 연장
+# - 생성 실패(최소 토큰 수 미달, 권한 등) 시 systemInstruction으로 보내고 일정 시간 동안 재시도하지 않음
+
+GEMINI_CONTEXT_CACHE_ENABLED = os.environ.get('GEMINI_CONTEXT_CACHE_ENABLED', 'true').lower() == 'true'
+GEMINI_CONTEXT_CACHE_TTL_SECONDS = int(os.environ.get('GEMINI_CONTEXT_CACHE_TTL_SECONDS', '3600'))
+GEMINI_CONTEXT_CACHE_REFRESH_SECONDS = int(os.environ.get('GEMINI_CONTEXT_CACHE_REFRESH_SECONDS', '300'))
+GEMINI_CONTEXT_CACHE_RETRY_SECONDS = int(os.environ.get('GEMINI_CONTEXT_CACHE_RETRY_SECONDS', '600'))
+
+# 캐시된 컨텐츠가 만료/삭제되었을 때 generateContent가 돌려주는 상태 코드 (400은 오류 본문이 cachedContent를 언급할 때만)
+_CACHE_MISSING_STATUSES = (403, 404)
+
+
+def _is_cache_missing(error):
+    """캐시된 컨텐츠 때문에 실패했는지. 스키마 오류 같은 일반 400은 다시 보내도 실패하므로 제외."""
+    if error.status in _CACHE_MISSING_STATUSES:
+        return True
+    return error.status == 400 and 'cachedcontent' in str(error.body or '').lower()
+
+
+class ContextCache:
+    def __init__(self, gemini_client, enabled=GEMINI_CONTEXT_CACHE_ENABLED, ttl_seconds=GEMINI_CONTEXT_CACHE_TTL_SECONDS,
+                 refresh_seconds=GEMINI_CONTEXT_CACHE_REFRESH_SECONDS, retry_seconds=GEMINI_CONTEXT_CACHE_RETRY_SECONDS):
+        self.client = gemini_client
+        self.enabled = enabled
+        self.ttl_seconds = ttl_seconds
+        self.refresh_seconds = refresh_seconds
+        self.retry_seconds = retry_seconds
+        self._entries = {}  # (모델, 지시문 해시) -> {'name', 'expires_at'}
+        self._failed_until = {}  # (모델, 지시문 해시) -> 다시 생성해 볼 시각
+        self._lock = threading.Lock()  # 위 두 dict 보호용 (네트워크 호출 중에는 잡지 않음)
+        self._key_locks = {}  # (모델, 지시문 해시) -> 생성/TTL 연장을 한 번만 하기 위한 키별 잠금
+        self.stats = {'created': 0, 'refreshed': 0, 'hits': 0, 'fallbacks': 0}
+
+    def cached_content_name(self, instruction_text, model=None):
+        """지시문에 대한 cachedContents 이름. 사용할 수 없으면 None (호출자는 systemInstruction으로 대체)."""
+        if not self.enabled:
+            return None
+        model = model or self.client.model
+        key = (model, hashlib.sha256(instruction_text.encode('utf-8')).hexdigest())
+        with self._lock:
+            state, name = self._lookup(key, time.time())
+            if state != 'refresh':
+                return name
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # 생성/TTL 연장은 키별 잠금으로 한 번만 하고, 컨테이너 전체 잠금은 잡지 않음 (다른 키의 적중은 기다리지 않음)
+        if not key_lock.acquire(blocking=False):
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and entry['expires_at'] > time.time():
+                    return entry['name']  # 다른 스레드가 연장 중이지만 아직 유효하면 그대로 사용
+            key_lock.acquire()  # 처음 생성 중이면 끝날 때까지 기다림
+        try:
+            now = time.time()
+            with self._lock:
+                state, name = self._lookup(key, now)  # 기다리는 동안 다른 스레드가 생성/연장했을 수 있음
+                if state != 'refresh':
+                    return name
+                entry = self._entries.get(key)
+            try:
+                if entry and entry['expires_at'] > now:
+                    self.client.update_cached_content_ttl(entry['name'], self.ttl_seconds, timeout=10)
+                    entry = {'name': entry['name']}
+                    refreshed = True
+                    print(f"[ContextCache] TTL 연장: {entry['name']}")
+                else:
+                    response = self.client.create_cached_content({
+                        'model': f'models/{model}',
+                        'displayName': f'plan-instructions-{key[1][:12]}',
+                        'systemInstruction': {'parts': [{'text': instruction_text}]},
+                        'ttl': f'{self.ttl_seconds}s',
+                    }, timeout=10)
+                    entry = {'name': response.json()['name']}
+                    refreshed = False
+                    print(f"[ContextCache] 생성: {entry['name']} (소요 {response.timings['total']:.2f}초)")
+            except (GeminiAPIError, KeyError, ValueError) as e:
+                with self._lock:
+                    self._entries.pop(key, None)
+                    self._failed_until[key] = now + self.retry_seconds
+                print(f"[ContextCache] 캐시 사용 불가, systemInstruction으로 대체: {str(e)} {getattr(e, 'body', '') or ''}")
+                return None
+            # 서버 만료 시각 대신 로컬 기준으로 보수적으로 계산
+            entry['expires_at'] = now + self.ttl_seconds
+            with self._lock:
+                self._entries[key] = entry
+                self.stats['refreshed' if refreshed else 'created'] += 1
+            return entry['name']
+        finally:
+            key_lock.release()
+
+    def _lookup(self, key, now):
+        """self._lock 안에서 호출. ('failed', None) / ('hit', 이름) / ('refresh', None: 생성 또는 TTL 연장 필요)."""
+        if self._failed_until.get(key, 0) > now:
+            return 'failed', None
+        entry = self._entries.get(key)
+        if entry and entry['expires_at'] - now > self.refresh_seconds:
+            self.stats['hits'] += 1
+            return 'hit', entry['name']
+        return 'refresh', None
+
+    def apply(self, payload, instruction_text, model=None):
+        """payload에 고정 지시문을 붙인 사본. 캐시가 있으면 cachedContent, 없으면 systemInstruction."""
+        name = self.cached_content_name(instruction_text, model)
+        if name:
+            return dict(payload, cachedContent=name)
+        self.stats['fallbacks'] += 1
+        return dict(payload, systemInstruction={'parts': [{'text': instruction_text}]})
+
+    def call(self, send, payload, instruction_text, model=None):
+        """send(payload)로 호출. 캐시가 서버에서 먼저 만료/삭제된 경우 캐시를 버리고 systemInstruction으로 1회 재시도."""
+        prepared = self.apply(payload, instruction_text, model)
+        try:
+            return send(prepared)
+        except GeminiAPIError as e:
+            if 'cachedContent' not in prepared or not _is_cache_missing(e):
+                raise
+            print(f"[ContextCache] 캐시된 컨텐츠 사용 실패({e.status}), 캐시를 버리고 재시도합니다.")
+            self.invalidate(prepared['cachedContent'])
+            self.stats['fallbacks'] += 1
+            return send(dict(payload, systemInstruction={'parts': [{'text': instruction_text}]}))
+
+    def invalidate(self, name):
+        with self._lock:
+            for key, entry in list(self._entries.items()):
+                if entry['name'] == name:
+                    del self._entries[key]
+
+
+_context_cache = None
+_context_cache_lock = threading.Lock()
+
+
+def get_context_cache(gemini_client):
+    """컨테이너 단위로 공유되는 ContextCache."""
+    global _context_cache
+    if _context_cache is None:
+        with _context_cache_lock:
+            if _context_cache is None:
+                _context_cache = ContextCache(gemini_client)
+    return _context_cache
@@ -0,0 +1,118 @@
+import hashlib
+import json
+import os
+import threading
+
+# 구조화 로그 (Python Lambda Layer)
+# 이벤트/요청/저장 항목을 통째로 json.dumps 해서 print하면 이미지 base64, Amadeus 항공편 원본, Gemini 응답 전체가
+# 로그용으로 한 번 더 직렬화되어 CPU와 CloudWatch 수집 비용이 든다.
+# - 한 줄에 JSON 하나 (level, logger, message, 요청 문맥 필드 + 호출 필드)
+# - LOG_LEVEL 미만의 로그는 필드를 요약/직렬화하지 않고 바로 버림. 필드 값이 callable이면 기록할 때만 호출 (지연 계산)
+# - 큰 필드는 요약: 이미지/항공편·숙박 원본/계획 본문 등은 크기만, 긴 문자열과 목록은 앞부분만 남김
+# - 요청 단위 샘플링: LOG_DEBUG_SAMPLE_RATE 비율의 요청만 DEBUG까지 기록 (요청 ID 해시 기준이라 람다가 달라도 같은 요청은 같은 결과)
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', '0'))
+LOG_MAX_STRING_CHARS = int(os.environ.get('LOG_MAX_STRING_CHARS', '200'))
+LOG_MAX_LIST_ITEMS = int(os.environ.get('LOG_MAX_LIST_ITEMS', '5'))
+
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+_MIN_LEVEL = LEVELS.get(LOG_LEVEL, LEVELS['INFO'])
+_MAX_DEPTH = 4
+
+# 값 대신 크기만 남기는 필드 (이미지 base64, 항공편/숙박 원본, 계획 본문, Gemini 응답, 토큰)
+REDACTED_KEYS = frozenset({
+    'images', 'inline_data', 'authToken', 'Authorization', 'authorization',
+    'flightOfferDetails', 'hotelDetails', 'flightInfos', 'accommodationInfos',
+    'plan_data', 'travelPlans', 'candidates',
+})
+
+_context = threading.local()
+
+
+def _omitted(value):
+    if isinstance(value, (list, tuple)):
+        return f'<{len(value)}개 생략>'
+    if isinstance(value, dict):
+        return f'<키 {len(value)}개 생략>'
+    if isinstance(value, (str, bytes)):
+        return f'<{len(value)}자 생략>'
+    return '<생략>'
+
+
+def summarize(value, _depth=0):
+    """로그에 남길 크기로 줄인 사본 (원본은 바꾸지 않음)."""
+    if isinstance(value, dict):
+        if _depth >= _MAX_DEPTH:
+            return _omitted(value)
+        return {key: _omitted(item) if key in REDACTED_KEYS else summarize(item, _depth + 1)
+                for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        if _depth >= _MAX_DEPTH:
+            return _omitted(value)
+        items = [summarize(item, _depth + 1) for item in value[:LOG_MAX_LIST_ITEMS]]
+        if len(value) > LOG_MAX_LIST_ITEMS:
+            items.append(f'... 총 {len(value)}개')
+        return items
+    if isinstance(value, str) and len(value) > LOG_MAX_STRING_CHARS:
+        return f'{value[:LOG_MAX_STRING_CHARS]}...({len(value)}자)'
+    if isinstance(value, (bytes, bytearray)):
+        return f'<{len(value)}바이트>'
+    return value
+
+
+def _sampled(request_id):
+    if LOG_DEBUG_SAMPLE_RATE <= 0 or not request_id:
+        return False
+    if LOG_DEBUG_SAMPLE_RATE >= 1:
+        return True
+    bucket = int(hashlib.sha1(str(request_id).encode('utf-8')).hexdigest()[:8], 16) / 0xFFFFFFFF
+    return bucket < LOG_DEBUG_SAMPLE_RATE
+
+
+def start_request(request_id, **fields):
+    """요청(SQS 레코드) 단위 로그 문맥 시작. 이후 이 스레드의 로그에 requestId와 fields가 붙는다."""
+    _context.fields = dict(fields, requestId=request_id)
+    _context.debug = _sampled(request_id)
+
+
+def bind(**fields):
+    """현재 요청 문맥에 필드 추가 (예: 사용자 ID를 알게 된 뒤)."""
+    if getattr(_context, 'fields', None) is None:
+        _context.fields = {}
+    _context.fields.update(fields)
+
+
+class Logger:
+    def __init__(self, name):
+        self.name = name
+
+    def is_enabled(self, level):
+        if LEVELS[level] >= _MIN_LEVEL:
+            return True
+        return level == 'DEBUG' and getattr(_context, 'debug', False)
+
+    def _log(self, level, message, fields):
+        if not self.is_enabled(level):
+            return
+        resolved = {key: value() if callable(value) else value for key, value in fields.items()}
+        record = {'level': level, 'logger': self.name, 'message': message}
+        record.update(getattr(_context, 'fields', None) or {})
+        record.update(summarize(resolved))
+        print(json.dumps(record, ensure_ascii=False, default=str))
+
+    def debug(self, message, **fields):
+        self._log('DEBUG', message, fields)
+
+    def info(self, message, **fields):
+        self._log('INFO', message, fields)
+
+    def warning(self, message, **fields):
+        self._log('WARNING', message, fields)
+
+    def error(self, message, **fields):
+        self._log('ERROR', message, fields)
+
+
+def get_logger(name):
+    return Logger(name)
@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from lambda_tracing import record_span
+
+# 단계별 지연 시간 메트릭 (CloudWatch Embedded Metric Format, Python Lambda Layer)
+# 요청(SQS 레코드) 하나마다 MetricsRecorder에 단계 시간/카운터를 모았다가 끝날 때 EMF JSON 한 줄로 출력한다.
+# CloudWatch Logs가 이 줄을 메트릭으로 추출하므로 PutMetricData 호출이 필요 없고, 같은 단계 값을 배열로 남기면
+# CloudWatch에서 p50/p99 같은 백분위수를 바로 볼 수 있다.
+#
+# 단계 이름: queue_wait(SQS 전송 -> 처리 시작), prompt_build, gemini_ttfb, gemini_total, parse,
+#           dynamodb_write, websocket_push(전송마다 1개), record_total
+# 차원: handler, model, has_images (+ handler만으로 묶은 합계)
+# record_since/start-stop/timer로 잰 단계는 현재 추적(lambda_tracing)에도 같은 이름의 span으로 남는다.
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'TravelPlanner')
+
+UNIT_MILLISECONDS = 'Milliseconds'
+UNIT_COUNT = 'Count'
+
+# EMF 한 메트릭에 담을 수 있는 값은 최대 100개
+_MAX_VALUES_PER_METRIC = 100
+
+_current = threading.local()
+
+
+class MetricsRecorder:
+    def __init__(self, handler, model=None, has_images=False):
+        self.dimensions = {'handler': handler, 'model': model or 'none', 'has_images': 'true' if has_images else 'false'}
+        self.properties = {}
+        self.start_time = time.time()
+        self._metrics = {}  # 이름 -> (단위, 값 목록)
+        self._stages = {}  # 진행 중인 단계 이름 -> 시작 시각
+        self._lock = threading.Lock()
+
+    def set_dimension(self, name, value):
+        if name == 'has_images':
+            value = 'true' if value else 'false'
+        self.dimensions[name] = str(value)
+
+    def set_property(self, name, value):
+        """메트릭이 아닌 검색용 필드 (planId, requestId 등)."""
+        self.properties[name] = value
+
+    def put(self, name, value, unit=UNIT_MILLISECONDS):
+        """값 하나 추가. 같은 이름으로 여러 번 기록하면 분포(히스토그램)로 남음."""
+        with self._lock:
+            _, values = self._metrics.setdefault(name, (unit, []))
+            if len(values) < _MAX_VALUES_PER_METRIC:
+                values.append(value)
+
+    def count(self, name, value=1):
+        """카운터. 요청 안에서는 합산하여 값 하나로 남김."""
+        with self._lock:
+            _, values = self._metrics.setdefault(name, (UNIT_COUNT, [0]))
+            values[0] += value
+
+    def record_since(self, name, start_time):
+        """start_time(time.time())부터 지금까지를 밀리초로 기록하고 초 단위 경과 시간을 반환."""
+        end_time = time.time()
+        elapsed = end_time - start_time
+        self.put(name, elapsed * 1000)
+        record_span(name, start_time, end_time)
+        return elapsed
+
+    def start(self, name):
+        self._stages[name] = time.time()
+
+    def stop(self, name):
+        start_time = self._stages.pop(name, None)
+        if start_time is not None:
+            self.record_since(name, start_time)
+
+    @contextmanager
+    def timer(self, name):
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.record_since(name, start_time)
+
+    def to_emf(self):
+        dimension_names = list(self.dimensions)
+        return {
+            '_aws': {
+                'Timestamp': int(self.start_time * 1000),
+                'CloudWatchMetrics': [{
+                    'Namespace': METRICS_NAMESPACE,
+                    'Dimensions': [dimension_names, ['handler']],
+                    'Metrics': [{'Name': name, 'Unit': unit} for name, (unit, _) in self._metrics.items()],
+                }],
+            },
+            **self.dimensions,
+            **self.properties,
+            **{name: values[0] if len(values) == 1 else values for name, (_, values) in self._metrics.items()},
+        }
+
+    def flush(self):
+        """EMF 한 줄 출력 후 비움. 기록한 메트릭이 없으면 출력하지 않음."""
+        if METRICS_ENABLED and self._metrics:
+            # 요청 전체는 추적의 루트 span이 따로 있으므로 메트릭으로만 기록
+            self.put('record_total', (time.time() - self.start_time) * 1000)
+            print(json.dumps(self.to_emf(), ensure_ascii=False, default=str))
+        self._metrics = {}
+        if getattr(_current, 'recorder', None) is self:
+            _current.recorder = None
+
+
+class _NullRecorder(MetricsRecorder):
+    """start_metrics 전에 호출된 경우 (요청 밖에서 보낸 WebSocket 메시지 등): 기록하지 않음."""
+
+    def put(self, name, value, unit=UNIT_MILLISECONDS):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+
+_null_recorder = _NullRecorder('none')
+
+
+def start_metrics(handler, model=None, has_images=False):
+    """현재 스레드의 요청 메트릭 시작. 반환된 recorder는 요청이 끝날 때 flush()."""
+    recorder = MetricsRecorder(handler, model, has_images)
+    _current.recorder = recorder
+    return recorder
+
+
+def current_metrics():
+    """현재 스레드의 요청 recorder (없으면 아무것도 기록하지 않는 recorder)."""
+    return getattr(_current, 'recorder', None) or _null_recorder
+
+
+def queue_wait_seconds(record):
+    """SQS가 메시지를 받은 시각(SentTimestamp)부터 지금까지. 속성이 없으면 None."""
+    sent_timestamp = (record.get('attributes') or {}).get('SentTimestamp')
+    if not sent_timestamp:
+        return None
+    return max(0.0, time.time() - int(sent_timestamp) / 1000)
@@ -0,0 +1,71 @@
+import os
+import threading
+
+# Python Lambda 공용 런타임 (Python Lambda Layer)
+# 콜드 스타트 단축: boto3 같은 무거운 모듈은 실제로 쓰는 경로에서 처음 필요할 때 import하고,
+# 한 번 만든 client/resource는 모듈 전역에 보관하여 warm 호출 간 재사용한다.
+# - client: 스레드 간 공유해도 안전하므로 컨테이너에서 (서비스, 인자)마다 하나
+# - resource/Table: 스레드 간 공유가 안전하지 않으므로 스레드별로 하나 (SQS 배치 동시 처리 대비)
+# 로컬 실행/벤치마크에서는 use_client/use_table로 가짜 client나 local_dynamodb.LocalTable을 끼워 넣는다.
+
+_clients = {}
+_clients_lock = threading.Lock()
+_thread_local = threading.local()
+_table_overrides = {}
+
+
+def get_client(service_name, **kwargs):
+    """boto3 client (처음 호출 시 생성)."""
+    key = (service_name, tuple(sorted(kwargs.items())))
+    client = _clients.get(key)
+    if client is None:
+        # 기본 세션에서 client를 만드는 과정은 스레드 안전하지 않으므로 잠금 안에서 생성
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                import boto3
+                client = _clients[key] = boto3.client(service_name, **kwargs)
+    return client
+
+
+def use_client(service_name, client, **kwargs):
+    """get_client(service_name, **kwargs)가 boto3 client 대신 client를 반환하도록 등록."""
+    key = (service_name, tuple(sorted(kwargs.items())))
+    with _clients_lock:
+        _clients[key] = client
+
+
+def use_table(table_name, table):
+    """get_table(table_name)이 모든 스레드에서 table을 반환하도록 등록."""
+    _table_overrides[table_name] = table
+
+
+def get_resource(service_name):
+    """스레드별 boto3 resource (처음 호출 시 스레드 전용 세션으로 생성)."""
+    resources = getattr(_thread_local, 'resources', None)
+    if resources is None:
+        resources = _thread_local.resources = {}
+    if service_name not in resources:
+        import boto3
+        resources[service_name] = boto3.session.Session().resource(service_name)
+    return resources[service_name]
+
+
+def get_table(table_name):
+    """스레드별 DynamoDB Table 리소스."""
+    if table_name in _table_overrides:
+        return _table_overrides[table_name]
+    tables = getattr(_thread_local, 'tables', None)
+    if tables is None:
+        tables = _thread_local.tables = {}
+    if table_name not in tables:
+        tables[table_name] = get_resource('dynamodb').Table(table_name)
+    return tables[table_name]
+
+
+def get_websocket_client():
+    """WEBSOCKET_API_ENDPOINT의 API Gateway Management API client. 환경변수가 없으면 None."""
+    endpoint = os.environ.get('WEBSOCKET_API_ENDPOINT')
+    if not endpoint:
+        return None
+    return get_client('apigatewaymanagementapi', endpoint_url=endpoint)
@@ -0,0 +1,276 @@
+import json
+import os
+import secrets
+import socket
+import threading
+import time
+import urllib.request
+
+# 요청 추적 (Python Lambda Layer)
+# 계획 요청 하나는 requestPlanHandler -> SQS -> createPlanAsync -> Gemini -> DynamoDB -> WebSocket을 거친다.
+# 접수 람다가 traceId를 발급해 SQS 메시지 속성(traceId, parentSpanId)으로 넘기고, 각 람다는 같은 traceId 아래
+# 단계별 span(sqs_queue, prompt_build, gemini_total, parse, dynamodb_write, websocket_push 등)을 모아
+# 요청이 끝날 때 한 번에 내보낸다. 느린 요청의 시간이 대기열/모델/저장 중 어디에 쓰였는지 traceId 하나로 볼 수 있다.
+#
+# 내보내기(TRACE_EXPORTER): stdout(기본, JSON 한 줄) / xray(X-Ray 데몬 UDP) / otlp(OTLP/HTTP JSON) / none
+# register_exporter()로 다른 내보내기를 추가할 수 있다.
+# traceId는 X-Ray 형식(1-{시각 8자리 hex}-{24자리 hex})이며 OTLP로 보낼 때는 32자리 hex로 바꾼다.
+
+TRACE_EXPORTER = os.environ.get('TRACE_EXPORTER', 'stdout').lower()
+TRACE_OTLP_ENDPOINT = os.environ.get('TRACE_OTLP_ENDPOINT', 'http://localhost:4318')
+TRACE_EXPORT_TIMEOUT_SECONDS = float(os.environ.get('TRACE_EXPORT_TIMEOUT_SECONDS', '1'))
+
+# SQS 메시지 속성 이름
+TRACE_ID_ATTRIBUTE = 'traceId'
+PARENT_SPAN_ID_ATTRIBUTE = 'parentSpanId'
+
+_current = threading.local()
+
+
+def new_trace_id():
+    return f'1-{int(time.time()):08x}-{secrets.token_hex(12)}'
+
+
+def new_span_id():
+    return secrets.token_hex(8)
+
+
+class Trace:
+    """요청 하나의 span 모음. 루트 span은 이 람다의 처리 전체."""
+
+    def __init__(self, service, trace_id=None, parent_span_id=None, attributes=None):
+        self.service = service
+        self.trace_id = trace_id or new_trace_id()
+        self.parent_span_id = parent_span_id
+        self.root_span_id = new_span_id()
+        self.start_time = time.time()
+        self.attributes = dict(attributes or {})
+        self.error = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start_time, end_time, attributes=None, error=None):
+        span = {
+            'name': name,
+            'spanId': new_span_id(),
+            'parentSpanId': self.root_span_id,
+            'start': start_time,
+            'end': end_time,
+            'durationMs': round((end_time - start_time) * 1000, 3),
+        }
+        if attributes:
+            span['attributes'] = attributes
+        if error:
+            span['error'] = str(error)
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def root_span(self, end_time):
+        span = {
+            'name': self.service,
+            'spanId': self.root_span_id,
+            'parentSpanId': self.parent_span_id,
+            'start': self.start_time,
+            'end': end_time,
+            'durationMs': round((end_time - self.start_time) * 1000, 3),
+            'attributes': self.attributes,
+        }
+        if self.error:
+            span['error'] = self.error
+        return span
+
+    def message_attributes(self):
+        """다음 단계(SQS)로 넘길 메시지 속성. 받는 쪽 span들은 이 람다의 루트 span 아래에 붙는다."""
+        return {
+            TRACE_ID_ATTRIBUTE: {'DataType': 'String', 'StringValue': self.trace_id},
+            PARENT_SPAN_ID_ATTRIBUTE: {'DataType': 'String', 'StringValue': self.root_span_id},
+        }
+
+
+class _TraceSpan:
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = dict(attributes)
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self.start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        record_span(self.name, self.start_time, time.time(), self.attributes, error=exc)
+        return False
+
+
+def start_trace(service, trace_id=None, parent_span_id=None, **attributes):
+    """현재 스레드의 추적 시작. 요청이 끝나면 finish_trace()."""
+    trace = Trace(service, trace_id, parent_span_id, attributes)
+    _current.trace = trace
+    return trace
+
+
+def start_trace_from_record(service, record, **attributes):
+    """SQS 레코드의 메시지 속성에서 traceId를 이어받아 추적 시작. SQS 대기 시간은 sqs_queue span으로 기록."""
+    message_attributes = record.get('messageAttributes') or {}
+    trace_id = (message_attributes.get(TRACE_ID_ATTRIBUTE) or {}).get('stringValue')
+    parent_span_id = (message_attributes.get(PARENT_SPAN_ID_ATTRIBUTE) or {}).get('stringValue')
+    trace = start_trace(service, trace_id, parent_span_id, messageId=record.get('messageId'), **attributes)
+    sent_timestamp = (record.get('attributes') or {}).get('SentTimestamp')
+    if sent_timestamp:
+        trace.add_span('sqs_queue', int(sent_timestamp) / 1000, trace.start_time)
+    return trace
+
+
+def current_trace():
+    return getattr(_current, 'trace', None)
+
+
+def record_span(name, start_time, end_time, attributes=None, error=None):
+    """현재 추적에 끝난 구간 추가 (추적 중이 아니면 무시). lambda_metrics의 단계 타이머도 이 함수로 기록."""
+    trace = current_trace()
+    if trace is not None:
+        trace.add_span(name, start_time, end_time, attributes, error)
+
+
+def span(name, **attributes):
+    """with span('gemini', model=...): 구간을 span으로 기록."""
+    return _TraceSpan(name, attributes)
+
+
+def finish_trace(error=None):
+    """루트 span을 닫고 모은 span을 내보냄."""
+    trace = current_trace()
+    if trace is None:
+        return
+    _current.trace = None
+    if error is not None:
+        trace.error = f'{type(error).__name__}: {error}' if isinstance(error, Exception) else str(error)
+    spans = [trace.root_span(time.time())] + trace.spans
+    try:
+        get_exporter().export(trace, spans)
+    except Exception as e:
+        # 추적 실패가 요청 처리를 막지 않도록 로그만 남김
+        print(f"[Tracing] span 내보내기 실패 ({TRACE_EXPORTER}): {type(e).__name__} - {e}")
+
+
+class StdoutExporter:
+    """traceId별 JSON 한 줄 (CloudWatch Logs Insights에서 traceId로 검색)."""
+
+    def export(self, trace, spans):
+        print(json.dumps({'traceId': trace.trace_id, 'service': trace.service, 'spans': spans},
+                         ensure_ascii=False, default=str))
+
+
+class NoopExporter:
+    def export(self, trace, spans):
+        pass
+
+
+class XRayExporter:
+    """X-Ray 데몬(AWS_XRAY_DAEMON_ADDRESS, Lambda에서는 활성 추적을 켜면 제공)으로 세그먼트를 UDP 전송."""
+
+    _HEADER = b'{"format": "json", "version": 1}\n'
+
+    def __init__(self):
+        address = os.environ.get('AWS_XRAY_DAEMON_ADDRESS', '127.0.0.1:2000').split(' ')[0]
+        host, port = address.rsplit(':', 1)
+        self.address = (host, int(port))
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def export(self, trace, spans):
+        root, children = spans[0], spans[1:]
+        segment = self._document(root, trace.trace_id, trace.service)
+        segment['subsegments'] = [self._document(child, None, child['name']) for child in children]
+        self.socket.sendto(self._HEADER + json.dumps(segment, default=str).encode('utf-8'), self.address)
+
+    @staticmethod
+    def _document(span_data, trace_id, name):
+        document = {'name': name, 'id': span_data['spanId'], 'start_time': span_data['start'], 'end_time': span_data['end']}
+        if trace_id:
+            document['trace_id'] = trace_id
+            if span_data.get('parentSpanId'):
+                document['parent_id'] = span_data['parentSpanId']
+        if span_data.get('attributes'):
+            document['annotations'] = {key: value for key, value in span_data['attributes'].items()
+                                       if isinstance(value, (str, int, float, bool))}
+        if span_data.get('error'):
+            document['fault'] = True
+            document['cause'] = {'exceptions': [{'message': span_data['error']}]}
+        return document
+
+
+class OtlpExporter:
+    """OTLP/HTTP JSON (TRACE_OTLP_ENDPOINT/v1/traces). ADOT 수집기 등으로 보냄."""
+
+    def __init__(self, endpoint=TRACE_OTLP_ENDPOINT):
+        self.url = endpoint.rstrip('/') + '/v1/traces'
+
+    def export(self, trace, spans):
+        body = {'resourceSpans': [{
+            'resource': {'attributes': [_otlp_attribute('service.name', trace.service)]},
+            'scopeSpans': [{'scope': {'name': 'travel-planner'}, 'spans': [self._span(trace, span_data) for span_data in spans]}],
+        }]}
+        request = urllib.request.Request(self.url, data=json.dumps(body, default=str).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'}, method='POST')
+        with urllib.request.urlopen(request, timeout=TRACE_EXPORT_TIMEOUT_SECONDS) as response:
+            response.read()
+
+    @staticmethod
+    def _span(trace, span_data):
+        otlp_span = {
+            'traceId': trace.trace_id.replace('1-', '', 1).replace('-', ''),
+            'spanId': span_data['spanId'],
+            'name': span_data['name'],
+            'kind': 1,
+            'startTimeUnixNano': str(int(span_data['start'] * 1e9)),
+            'endTimeUnixNano': str(int(span_data['end'] * 1e9)),
+            'attributes': [_otlp_attribute(key, value) for key, value in (span_data.get('attributes') or {}).items()],
+        }
+        if span_data.get('parentSpanId'):
+            otlp_span['parentSpanId'] = span_data['parentSpanId']
+        if span_data.get('error'):
+            otlp_span['status'] = {'code': 2, 'message': span_data['error']}
+        return otlp_span
+
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+EXPORTERS = {
+    'stdout': StdoutExporter,
+    'none': NoopExporter,
+    'xray': XRayExporter,
+    'otlp': OtlpExporter,
+}
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def register_exporter(name, factory):
+    """TRACE_EXPORTER 이름으로 선택할 수 있는 내보내기 추가. factory()는 export(trace, spans)를 가진 객체를 반환."""
+    EXPORTERS[name] = factory
+
+
+def get_exporter():
+    """컨테이너 단위로 공유되는 내보내기 (처음 쓸 때 생성)."""
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                factory = EXPORTERS.get(TRACE_EXPORTER)
+                if factory is None:
+                    print(f"[Tracing] 알 수 없는 TRACE_EXPORTER '{TRACE_EXPORTER}', stdout으로 내보냄")
+                    factory = StdoutExporter
+                _exporter = factory()
+    return _exporter
@@ -0,0 +1,161 @@
+import copy
+import re
+import threading
+
+# DynamoDB Table 리소스의 로컬 대체 구현 (테스트/벤치마크용, 메모리 저장)
+# boto3 Table과 같은 메서드 이름/인자를 사용하므로 공용 모듈에서 그대로 바꿔 끼울 수 있다.
+# 지원하는 ConditionExpression: attribute_exists / attribute_not_exists / begins_with / =, <>, <, <=, >, >= 와 AND, OR 조합
+# query는 문자열 KeyConditionExpression(예: 'pk = :pk AND begins_with(sk, :prefix)')만 지원
+# batch_writer()는 항목마다 바로 put/delete (boto3처럼 25개씩 모아 보내지 않음)
+# update_item은 'SET a = :a, b = if_not_exists(b, :b)' 와 'REMOVE c, d' 절만 지원
+
+
+class ConditionalCheckFailedException(Exception):
+    def __init__(self, message='The conditional request failed'):
+        super().__init__(message)
+        # botocore ClientError와 같은 형태로 오류 코드를 노출
+        self.response = {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': message}}
+
+
+def is_conditional_check_failed(error):
+    """boto3 ClientError와 LocalTable 예외 모두에서 조건부 쓰기 실패 여부를 판별."""
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+_COMPARATORS = {
+    '=': lambda a, b: a == b,
+    '<>': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+_FUNCTION_PATTERN = re.compile(r'^(attribute_exists|attribute_not_exists)\(\s*([#\w.]+)\s*\)$')
+_BEGINS_WITH_PATTERN = re.compile(r'^begins_with\(\s*([#\w.]+)\s*,\s*(:\w+)\s*\)$')
+_COMPARISON_PATTERN = re.compile(r'^([#\w.]+)\s*(<>|<=|>=|=|<|>)\s*([:#\w.]+)$')
+_UPDATE_CLAUSE_PATTERN = re.compile(r'\b(SET|REMOVE)\s+(.*?)(?=\s+(?:SET|REMOVE)\s+|$)')
+_SET_ACTION_PATTERN = re.compile(r'([#\w.]+)\s*=\s*(?:if_not_exists\(\s*([#\w.]+)\s*,\s*(:\w+)\s*\)|(:\w+))')
+
+
+class LocalTable:
+    def __init__(self, name, key_names):
+        self.name = name
+        self.table_name = name
+        self.key_names = list(key_names)
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def _key_of(self, item):
+        return tuple(item[name] for name in self.key_names)
+
+    def get_item(self, Key, ConsistentRead=False, **kwargs):
+        with self._lock:
+            item = self._items.get(self._key_of(Key))
+            return {'Item': copy.deepcopy(item)} if item is not None else {}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None,
+                 ExpressionAttributeValues=None, **kwargs):
+        key = self._key_of(Item)
+        with self._lock:
+            self._check(self._items.get(key), ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+            self._items[key] = copy.deepcopy(Item)
+        return {}
+
+    def delete_item(self, Key, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, **kwargs):
+        key = self._key_of(Key)
+        with self._lock:
+            self._check(self._items.get(key), ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues)
+            self._items.pop(key, None)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE', **kwargs):
+        key = self._key_of(Key)
+        names, values = ExpressionAttributeNames or {}, ExpressionAttributeValues or {}
+        with self._lock:
+            current = self._items.get(key)
+            self._check(current, ConditionExpression, names, values)
+            item = copy.deepcopy(current) if current is not None else dict(Key)
+            for action, body in _UPDATE_CLAUSE_PATTERN.findall(UpdateExpression.strip()):
+                if action == 'REMOVE':
+                    for name in body.split(','):
+                        item.pop(_resolve_name(name.strip(), names), None)
+                    continue
+                for name, default_name, default_value, value in _SET_ACTION_PATTERN.findall(body):
+                    name = _resolve_name(name, names)
+                    if default_value:
+                        existing = item.get(_resolve_name(default_name, names))
+                        item[name] = copy.deepcopy(existing if existing is not None else values[default_value])
+                    else:
+                        item[name] = copy.deepcopy(values[value])
+            self._items[key] = item
+            return {'Attributes': copy.deepcopy(item)} if ReturnValues == 'ALL_NEW' else {}
+
+    def query(self, KeyConditionExpression, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+              ConsistentRead=False, ScanIndexForward=True, **kwargs):
+        with self._lock:
+            items = [copy.deepcopy(item) for item in self._items.values()
+                     if _evaluate(KeyConditionExpression, item, ExpressionAttributeNames or {}, ExpressionAttributeValues or {})]
+        items.sort(key=self._key_of, reverse=not ScanIndexForward)
+        return {'Items': items, 'Count': len(items)}
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return _LocalBatchWriter(self)
+
+    def _check(self, current, expression, names, values):
+        if expression and not _evaluate(expression, current or {}, names or {}, values or {}):
+            raise ConditionalCheckFailedException()
+
+
+class _LocalBatchWriter:
+    """Table.batch_writer() 대체 (바로 put/delete)."""
+
+    def __init__(self, table):
+        self._table = table
+
+    def put_item(self, Item):
+        self._table.put_item(Item=Item)
+
+    def delete_item(self, Key):
+        self._table.delete_item(Key=Key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def _resolve_name(token, names):
+    return names.get(token, token) if token.startswith('#') else token
+
+
+def _evaluate(expression, item, names, values):
+    return any(
+        all(_evaluate_term(term.strip(), item, names, values) for term in re.split(r'\s+AND\s+', clause))
+        for clause in re.split(r'\s+OR\s+', expression)
+    )
+
+
+def _evaluate_term(term, item, names, values):
+    match = _FUNCTION_PATTERN.match(term)
+    if match:
+        exists = _resolve_name(match.group(2), names) in item
+        return exists if match.group(1) == 'attribute_exists' else not exists
+
+    match = _BEGINS_WITH_PATTERN.match(term)
+    if match:
+        value = item.get(_resolve_name(match.group(1), names))
+        return isinstance(value, str) and value.startswith(values[match.group(2)])
+
+    match = _COMPARISON_PATTERN.match(term)
+    if not match:
+        raise ValueError(f"LocalTable이 지원하지 않는 조건식입니다: {term}")
+    name = _resolve_name(match.group(1), names)
+    if name not in item:
+        return False
+    operand = match.group(3)
+    expected = values[operand] if operand.startswith(':') else item.get(_resolve_name(operand, names))
+    return _COMPARATORS[match.group(2)](item[name], expected)
@@ -0,0 +1,53 @@
+import io
+import os
+import threading
+
+# S3 client의 로컬 대체 구현 (테스트/벤치마크용, 파일 시스템 저장)
+# boto3 S3 client와 같은 메서드 이름/인자를 사용하므로 lambda_runtime.use_client('s3', ...)로 바꿔 끼우거나
+# PLAN_OVERFLOW_BUCKET=local 로 그대로 쓸 수 있다. 객체는 root/버킷/키 경로의 파일로 저장한다.
+# Node 로더(load_web, load_mobile)도 PLAN_OVERFLOW_LOCAL_DIR이 있으면 같은 경로에서 읽는다.
+
+
+class NoSuchKey(Exception):
+    def __init__(self, key):
+        super().__init__(f'The specified key does not exist: {key}')
+        # botocore ClientError와 같은 형태로 오류 코드를 노출
+        self.response = {'Error': {'Code': 'NoSuchKey', 'Message': str(self)}}
+
+
+class LocalS3Client:
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, bucket, key):
+        path = os.path.normpath(os.path.join(self.root, bucket, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(f'잘못된 객체 키입니다: {key}')
+        return path
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        path = self._path(Bucket, Key)
+        data = Body.encode('utf-8') if isinstance(Body, str) else bytes(Body)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 스레드별 임시 파일에 쓴 뒤 이름 변경 (동시에 읽는 쪽이 반쯤 쓰인 파일을 보지 않도록)
+        temp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+        return {'ETag': f'"{len(data)}"'}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        path = self._path(Bucket, Key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            raise NoSuchKey(Key) from None
+        return {'Body': io.BytesIO(data), 'ContentLength': len(data)}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        try:
+            os.remove(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+        return {}
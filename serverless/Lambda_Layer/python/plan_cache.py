@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from lambda_runtime import get_table
+
+# Gemini 응답 캐시 (Python Lambda Layer)
+# 같은 프롬프트 + 이미지 + generationConfig 요청(더블 클릭, 재시도 등)은 Gemini를 다시 호출하지 않고 이전 응답을 재사용한다.
+# 1단계: 컨테이너 내 LRU (가장 빠름, 컨테이너별)
+# 2단계: DynamoDB 공유 테이블 (모든 컨테이너 공유, expires_at TTL 속성으로 자동 만료)
+#
+# 테이블 스키마: 파티션 키 cache_key (S), TTL 속성 expires_at (N)
+# PLAN_CACHE_TABLE 환경변수가 없으면 LRU만 사용, 'local'이면 메모리 내 LocalTable 사용 (테스트용)
+# 기본은 비활성(PLAN_CACHE_ENABLED=false): 같은 여행을 다시 요청해 다른 계획을 받으려는 사용자에게 같은 일정을 주지 않도록.
+# 재시도/중복 전달은 plan_ledger와 plan_single_flight가 처리한다.
+# 켜져 있어도 요청에 regenerate(또는 noCache)가 true이면 캐시를 읽지 않고 새로 생성한 결과로 캐시를 갱신한다.
+
+PLAN_CACHE_TABLE = os.environ.get('PLAN_CACHE_TABLE')
+PLAN_CACHE_TTL_SECONDS = int(os.environ.get('PLAN_CACHE_TTL_SECONDS', '3600'))
+PLAN_CACHE_LRU_SIZE = int(os.environ.get('PLAN_CACHE_LRU_SIZE', '32'))
+PLAN_CACHE_ENABLED = os.environ.get('PLAN_CACHE_ENABLED', 'false').lower() == 'true'
+
+
+def wants_fresh_plan(request):
+    """클라이언트가 캐시된 응답 대신 새 계획을 요청했는지 (regenerate / noCache)."""
+    return bool(request.get('regenerate') or request.get('noCache'))
+
+
+def _image_digest(image_data):
+    # "data:image/jpeg;base64,..." 접두사 유무와 관계없이 같은 이미지는 같은 다이제스트가 되도록 정규화
+    if image_data.startswith('data:image/'):
+        mime_type = image_data.split(';')[0].split(':')[1]
+        image_data = image_data.split(',', 1)[1]
+    else:
+        mime_type = 'image/jpeg'
+    return mime_type + ':' + hashlib.sha256(image_data.encode('utf-8')).hexdigest()
+
+
+def make_cache_key(prompt_text, images, generation_config, model):
+    """완성된 프롬프트, 이미지 다이제스트, generationConfig, 모델로 만든 정규화 해시."""
+    canonical = json.dumps({
+        'model': model,
+        'prompt': prompt_text,
+        'images': [_image_digest(image) for image in images or []],
+        'generationConfig': generation_config or {},
+    }, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class PlanResponseCache:
+    def __init__(self, table_factory=None, max_entries=PLAN_CACHE_LRU_SIZE, ttl_seconds=PLAN_CACHE_TTL_SECONDS):
+        self.table_factory = table_factory  # 현재 스레드의 Table 리소스를 반환
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # cache_key -> (expires_at, response_text)
+        self._lock = threading.Lock()
+        self.stats = {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'puts': 0, 'errors': 0}
+
+    def get(self, cache_key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry and entry[0] > now:
+                self._entries.move_to_end(cache_key)
+                self.stats['local_hits'] += 1
+                return entry[1]
+            if entry:
+                del self._entries[cache_key]
+
+        if self.table_factory is not None:
+            try:
+                item = self.table_factory().get_item(Key={'cache_key': cache_key}).get('Item')
+            except Exception as e:
+                print(f"[PlanCache] 공유 캐시 조회 실패: {str(e)}")
+                self._count('errors')
+                item = None
+            # DynamoDB TTL 삭제는 지연되므로 만료 시각을 직접 확인
+            if item and int(item.get('expires_at', 0)) > now:
+                self._remember(cache_key, int(item['expires_at']), item['response'])
+                self._count('shared_hits')
+                return item['response']
+
+        self._count('misses')
+        return None
+
+    def put(self, cache_key, response_text):
+        expires_at = int(time.time()) + self.ttl_seconds
+        self._remember(cache_key, expires_at, response_text)
+        self._count('puts')
+        if self.table_factory is None:
+            return
+        try:
+            self.table_factory().put_item(Item={
+                'cache_key': cache_key,
+                'response': response_text,
+                'expires_at': expires_at,
+            })
+        except Exception as e:
+            print(f"[PlanCache] 공유 캐시 저장 실패: {str(e)}")
+            self._count('errors')
+
+    def _remember(self, cache_key, expires_at, response_text):
+        with self._lock:
+            self._entries[cache_key] = (expires_at, response_text)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _create_table_factory():
+    if not PLAN_CACHE_TABLE:
+        return None
+    if PLAN_CACHE_TABLE == 'local':
+        from local_dynamodb import LocalTable
+        table = LocalTable('plan-response-cache', ['cache_key'])
+        return lambda: table
+    # Table 리소스는 스레드별이므로 호출할 때마다 현재 스레드의 것을 사용 (lambda_runtime.use_table 대체도 적용됨)
+    return lambda: get_table(PLAN_CACHE_TABLE)
+
+
+def get_plan_cache():
+    """컨테이너 단위로 공유되는 응답 캐시. PLAN_CACHE_ENABLED=false 이면 None."""
+    global _cache
+    if not PLAN_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PlanResponseCache(table_factory=_create_table_factory())
+    return _cache
@@ -0,0 +1,122 @@
+import copy
+import json
+import os
+
+from gemini_client import build_envelope, chunk_text
+from plan_json import extract_json, truncate_at_last_element
+
+# maxOutputTokens에서 끊긴 응답 이어서 생성하기 (Python Lambda Layer)
+# finishReason == MAX_TOKENS 이면 마지막으로 완성된 일정까지 잘라낸 부분 응답을 model 턴으로 넣고
+# "남은 일정부터 같은 구조로" 짧게 이어서 생성한 뒤, 일차 단위로 병합한다. (전체 재생성 대신 짧은 호출 1회)
+
+PLAN_CONTINUATION_MAX_ROUNDS = int(os.environ.get('PLAN_CONTINUATION_MAX_ROUNDS', '2'))
+
+# 응답 JSON의 키 이름 (구조화 출력의 짧은 키를 쓰는 경우 plan_schema.COMPACT_KEYS를 넘김)
+PLAN_KEYS = {'days': 'days', 'schedules': 'schedules', 'day': 'day', 'id': 'id', 'name': 'name'}
+
+
+def is_truncated(result):
+    candidates = (result or {}).get('candidates') or []
+    return bool(candidates) and candidates[0].get('finishReason') == 'MAX_TOKENS'
+
+
+def _day_entries(days, keys=PLAN_KEYS):
+    """days가 배열(생성 응답)이면 (day 번호, day), 객체(수정 응답)이면 (키, day) 목록."""
+    if isinstance(days, dict):
+        return [(str(key), day) for key, day in days.items() if isinstance(day, dict)]
+    if isinstance(days, list):
+        return [(str(day.get(keys['day'], index + 1)), day) for index, day in enumerate(days) if isinstance(day, dict)]
+    return []
+
+
+def merge_plan_fragments(base, extra, keys=PLAN_KEYS):
+    """이어서 생성한 조각을 기존 계획에 병합. 같은 일차면 schedules를 이어 붙이고(중복 id 제외) 새 일차는 추가."""
+    merged = copy.deepcopy(base)
+    for key, value in (extra or {}).items():
+        if key != keys['days'] and key not in merged:
+            merged[key] = value
+
+    base_days = merged.get(keys['days'])
+    extra_days = (extra or {}).get(keys['days'])
+    if base_days is None:
+        merged[keys['days']] = extra_days
+        return merged
+
+    existing = dict(_day_entries(base_days, keys))
+    for key, day in _day_entries(extra_days, keys):
+        if key not in existing:
+            if isinstance(base_days, dict):
+                base_days[key] = day
+            else:
+                base_days.append(day)
+            existing[key] = day
+            continue
+        schedules = existing[key].setdefault(keys['schedules'], [])
+        seen_ids = {schedule.get(keys['id']) for schedule in schedules if isinstance(schedule, dict)}
+        for schedule in day.get(keys['schedules']) or []:
+            if isinstance(schedule, dict) and schedule.get(keys['id']) in seen_ids:
+                continue
+            schedules.append(schedule)
+
+    if isinstance(base_days, list):
+        base_days.sort(key=lambda day: int(day.get(keys['day'], 0)) if str(day.get(keys['day'], 0)).isdigit() else 0)
+    return merged
+
+
+def _continuation_prompt(partial, keys):
+    entries = _day_entries(partial.get(keys['days']), keys)
+    last_key, last_day = entries[-1]
+    schedules = last_day.get(keys['schedules']) or []
+    last_schedule = schedules[-1] if schedules else {}
+    return f"""앞 응답이 출력 길이 제한으로 중간에 끊겼습니다. 위 응답은 마지막으로 완성된 일정까지 정리한 것입니다.
+{last_key}일차의 마지막 일정("{last_schedule.get(keys['name'], '')}", id: {last_schedule.get(keys['id'], '')}) 다음 일정부터 이어서 생성하세요.
+- 앞 응답과 같은 JSON 구조로 반환하고, "{keys['days']}"에는 남은 일정이 있는 일차만 넣으세요.
+- {last_key}일차는 남은 일정만, 그 이후 일차는 전체 일정을 넣으세요.
+- 이미 생성된 일정은 반복하지 마세요. 설명 없이 JSON만 반환하세요."""
+
+
+def continue_if_truncated(gemini_client, payload, result, timeout=120, max_rounds=PLAN_CONTINUATION_MAX_ROUNDS, keys=PLAN_KEYS):
+    """MAX_TOKENS로 끊긴 응답이면 이어서 생성해 병합한 envelope를, 아니면 원래 result를 반환. (result, 추가 호출 수)"""
+    rounds = 0
+    usage = dict(result.get('usageMetadata') or {})
+    last_chunk = result
+    plan = None
+    while is_truncated(last_chunk) and rounds < max_rounds:
+        if plan is None:
+            partial_text = truncate_at_last_element(chunk_text(result), keys['schedules'])
+            if not partial_text:
+                print("[PlanContinuation] 완성된 일정이 없어 이어서 생성할 수 없습니다.")
+                break
+            plan = json.loads(partial_text)
+        if not _day_entries(plan.get(keys['days']), keys):
+            break
+
+        rounds += 1
+        original_content = copy.deepcopy(payload['contents'][0])
+        original_content['role'] = 'user'
+        continuation_payload = dict(payload, contents=[
+            original_content,
+            {'role': 'model', 'parts': [{'text': json.dumps(plan, ensure_ascii=False)}]},
+            {'role': 'user', 'parts': [{'text': _continuation_prompt(plan, keys)}]},
+        ])
+        response = gemini_client.generate_content(continuation_payload, timeout=timeout)
+        last_chunk = response.json()
+        for key, value in (last_chunk.get('usageMetadata') or {}).items():
+            if isinstance(value, (int, float)):
+                usage[key] = usage.get(key, 0) + value
+
+        fragment_text = chunk_text(last_chunk)
+        if is_truncated(last_chunk):
+            fragment_text = truncate_at_last_element(fragment_text, keys['schedules'])
+        try:
+            fragment, _ = extract_json(fragment_text or '', keys['days'])
+        except ValueError:
+            print(f"[PlanContinuation] {rounds}회차 이어서 생성한 응답을 파싱하지 못했습니다.")
+            break
+        plan = merge_plan_fragments(plan, fragment, keys)
+        print(f"[PlanContinuation] {rounds}회차 병합 완료: 일차 {len(_day_entries(plan.get(keys['days']), keys))}개, 소요 {response.timings['total']:.2f}초")
+
+    if plan is None:
+        return result, rounds
+    envelope = build_envelope(json.dumps(plan, ensure_ascii=False), dict(last_chunk, usageMetadata=usage))
+    return envelope, rounds
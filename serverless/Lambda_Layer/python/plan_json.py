@@ -0,0 +1,287 @@
+import json
+
+# Gemini가 생성하는 여행 계획 JSON 처리 도구 (Python Lambda Layer)
+
+
+class DaysStreamReader:
+    """스트리밍으로 들어오는 JSON 텍스트에서 `days` 배열의 완성된 원소를 즉시 꺼내는 증분 파서.
+
+    feed()에 텍스트 조각을 넣을 때마다 새로 닫힌 day 객체(dict) 목록을 돌려준다.
+    문자열/이스케이프 상태를 추적하므로 장소 설명 안의 괄호나 따옴표에 영향을 받지 않는다.
+    """
+
+    def __init__(self, array_key='days'):
+        self.array_key = array_key
+        self.text = ''
+        self._pos = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._pending_key = None
+        # 스택 원소: [컨테이너 문자('{' 또는 '['), 이 컨테이너가 값으로 쓰인 키]
+        self._stack = []
+        self._element_start = None
+        self.emitted = 0
+
+    def feed(self, chunk):
+        self.text += chunk
+        completed = []
+        text = self.text
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start + 1:i]
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch == ':':
+                self._pending_key = self._last_string
+            elif ch == ',':
+                self._pending_key = None
+            elif ch in '{[':
+                parent_is_object = bool(self._stack) and self._stack[-1][0] == '{'
+                key = self._pending_key if parent_is_object else None
+                if ch == '{' and self._in_days_array():
+                    self._element_start = i
+                self._stack.append([ch, key])
+                self._pending_key = None
+            elif ch in '}]':
+                if self._stack:
+                    self._stack.pop()
+                if ch == '}' and self._element_start is not None and self._in_days_array():
+                    element_text = text[self._element_start:i + 1]
+                    self._element_start = None
+                    try:
+                        completed.append(json.loads(element_text))
+                        self.emitted += 1
+                    except ValueError:
+                        pass
+        self._pos = len(text)
+        return completed
+
+    def _in_days_array(self):
+        return bool(self._stack) and self._stack[-1][0] == '[' and self._stack[-1][1] == self.array_key
+
+
+def strip_code_fence(text):
+    """```json ... ``` 마크다운 코드 블록을 벗겨낸 텍스트."""
+    text = text.strip()
+    if text.startswith('```json'):
+        text = text[7:]
+    elif text.startswith('```'):
+        text = text[3:]
+    if text.endswith('```'):
+        text = text[:-3]
+    return text.strip()
+
+
+def truncate_at_last_element(text, array_key='schedules'):
+    """출력 길이 제한으로 끊긴 JSON을 `array_key` 배열의 마지막 완성 원소까지 자르고 열린 괄호를 닫는다.
+
+    days가 배열(생성)이든 객체(수정)이든 schedules 배열의 위치만 보고 자르므로 두 구조 모두 처리된다.
+    완성된 원소가 하나도 없으면 None.
+    """
+    text = strip_code_fence(text)
+    in_string = False
+    escape = False
+    string_start = None
+    last_string = None
+    pending_key = None
+    stack = []
+    cut = None  # (자를 위치, 닫는 괄호들)
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+                last_string = text[string_start + 1:i]
+            continue
+
+        if ch == '"':
+            in_string = True
+            string_start = i
+        elif ch == ':':
+            pending_key = last_string
+        elif ch == ',':
+            pending_key = None
+        elif ch in '{[':
+            parent_is_object = bool(stack) and stack[-1][0] == '{'
+            stack.append((ch, pending_key if parent_is_object else None))
+            pending_key = None
+        elif ch in '}]':
+            if stack:
+                stack.pop()
+            if ch == '}' and stack and stack[-1] == ('[', array_key):
+                cut = (i + 1, ''.join(']' if opener == '[' else '}' for opener, _ in reversed(stack)))
+    return text[:cut[0]] + cut[1] if cut else None
+
+
+_SMART_QUOTES = '“”„‟'
+_CONTROL_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+
+def repair_json(text, array_key='days'):
+    """모델 출력에서 가장 바깥 JSON 값을 찾아 흔한 결함을 고친 JSON 텍스트를 만든다 (한 번의 순회).
+
+    - 앞뒤 설명문과 ``` 코드 블록은 무시
+    - 따옴표 역할을 하는 스마트 따옴표(“ ”)를 일반 따옴표로
+    - 문자열 안의 줄바꿈/탭을 이스케이프
+    - 닫는 괄호 앞의 trailing comma 제거
+    - 중간에 끊긴 경우 마지막 완성 지점까지 자르고 열린 괄호를 닫음
+      (`array_key` 컨테이너 안에서는 완성된 일차 단위로만 잘라 가장 긴 유효한 days[] 앞부분을 남김)
+
+    반환: (고친 JSON 텍스트 또는 None, 적용한 수정 목록)
+    """
+    start = -1
+    for i, ch in enumerate(text):
+        if ch in '{[':
+            start = i
+            break
+    if start < 0:
+        return None, []
+
+    out = []
+    repairs = set()
+    stack = []  # (여는 괄호, 이 컨테이너의 키)
+    array_depth = None  # array_key 컨테이너(생성: 배열, 수정: 일차 번호 객체)가 열린 스택 깊이
+    in_string = False
+    string_quote = '"'
+    escape = False
+    string_start = None
+    last_string = None
+    pending_key = None
+    safe = None  # (out 길이, 그 시점의 닫는 괄호들)
+    complete = False
+
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escape:
+                escape = False
+                out.append(ch)
+            elif ch == '\\':
+                escape = True
+                out.append(ch)
+            elif ch == '"' or (string_quote != '"' and ch in _SMART_QUOTES):
+                in_string = False
+                out.append('"')
+                last_string = ''.join(out[string_start + 1:-1])
+            elif ch in _CONTROL_ESCAPES:
+                repairs.add('control_chars')
+                out.append(_CONTROL_ESCAPES[ch])
+            else:
+                out.append(ch)
+            continue
+
+        if ch == '"' or ch in _SMART_QUOTES:
+            if ch != '"':
+                repairs.add('smart_quotes')
+            in_string = True
+            string_quote = ch
+            string_start = len(out)
+            out.append('"')
+        elif ch == ':':
+            pending_key = last_string
+            out.append(ch)
+        elif ch == ',':
+            if array_depth is None or len(stack) <= array_depth:
+                safe = (len(out), _closers(stack))
+            pending_key = None
+            out.append(ch)
+        elif ch in '{[':
+            parent_is_object = bool(stack) and stack[-1][0] == '{'
+            key = pending_key if parent_is_object else None
+            stack.append((ch, key))
+            if key == array_key and array_depth is None:
+                array_depth = len(stack)
+            pending_key = None
+            out.append(ch)
+        elif ch in '}]':
+            if _drop_trailing_comma(out):
+                repairs.add('trailing_comma')
+            if stack:
+                stack.pop()
+            out.append(ch)
+            if array_depth is not None and len(stack) < array_depth:
+                array_depth = None
+            if not stack:
+                complete = True
+                break
+            if array_depth is None or len(stack) <= array_depth:
+                safe = (len(out), _closers(stack))
+        elif ch in ' \t\r\n' or (ch.isascii() and ch.isalnum()) or ch in '-+.':
+            out.append(ch)
+        # 그 밖의 문자(코드 블록 백틱 등)는 JSON 문법에 없으므로 버림
+
+    if complete:
+        return ''.join(out), sorted(repairs)
+
+    # 출력이 중간에 끊김: 마지막 완성 지점까지 자르고 닫기
+    repairs.add('truncated')
+    if safe is None:
+        return None, sorted(repairs)
+    out = out[:safe[0]]
+    _drop_trailing_comma(out)
+    return ''.join(out) + safe[1], sorted(repairs)
+
+
+def _closers(stack):
+    return ''.join(']' if opener == '[' else '}' for opener, _ in reversed(stack))
+
+
+def _drop_trailing_comma(out):
+    index = len(out) - 1
+    while index >= 0 and out[index] in ' \t\r\n':
+        index -= 1
+    if index >= 0 and out[index] == ',':
+        del out[index:]
+        return True
+    return False
+
+
+def extract_json(text, array_key='days', parse_float=None):
+    """모델 출력 텍스트에서 JSON 값을 꺼낸다. 그대로 파싱되면 바로 반환하고, 아니면 repair_json으로 고쳐서 파싱.
+
+    반환: (값, 적용한 수정 목록). 복구할 수 없으면 ValueError.
+    """
+    stripped = strip_code_fence(text or '')
+    try:
+        return json.loads(stripped, parse_float=parse_float), []
+    except ValueError:
+        pass
+    repaired, repairs = repair_json(stripped, array_key)
+    if repaired is None:
+        raise ValueError('JSON 값을 찾을 수 없습니다')
+    return json.loads(repaired, parse_float=parse_float), repairs
+
+
+def normalize_envelope_text(result, array_key='days'):
+    """Gemini 응답(envelope)의 계획 텍스트를 파싱하고, 고쳐서 파싱한 경우 텍스트를 정리된 JSON으로 교체.
+
+    저장된 plan_data를 읽는 프론트엔드/로더가 수정 없이 그대로 파싱할 수 있게 된다.
+    반환: (파싱된 값 또는 None, 적용한 수정 목록)
+    """
+    try:
+        part = result['candidates'][0]['content']['parts'][0]
+    except (KeyError, IndexError, TypeError):
+        return None, []
+    try:
+        value, repairs = extract_json(part.get('text', ''), array_key)
+    except ValueError as e:
+        print(f"[PlanJSON] 응답 JSON 복구 실패: {str(e)}")
+        return None, []
+    if repairs or part.get('text', '').lstrip().startswith('`'):
+        part['text'] = json.dumps(value, ensure_ascii=False)
+    return value, repairs
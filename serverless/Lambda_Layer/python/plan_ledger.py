@@ -0,0 +1,96 @@
+import os
+import secrets
+import threading
+import time
+
+from lambda_runtime import get_table
+from local_dynamodb import is_conditional_check_failed
+
+# 여행 계획 ID 생성 + 생성 요청 멱등성 원장 (Python Lambda Layer)
+# - planId: plan-{밀리초 타임스탬프 13자리}-{무작위 10자리 hex}. 문자열 정렬 = 생성 시각 순서, 같은 밀리초에도 충돌하지 않음
+#   (기존 plan-{초} 형식과 같은 접두사라 프론트엔드 라우팅/로더는 그대로 동작)
+# - 원장: 클라이언트 요청 ID(clientRequestId)마다 planId를 한 번만 예약하고 생성이 끝나면 completed로 기록
+#   재시도/SQS 중복 전달은 완료된 planId를 그대로 돌려받아 Gemini를 다시 호출하지 않고,
+#   완료 전 재시도는 같은 planId에 저장하므로 계획이 두 벌 생기지 않는다.
+#
+# 테이블 스키마: 파티션 키 request_key (S), TTL 속성 expires_at (N)
+# PLAN_LEDGER_TABLE 환경변수가 없으면 원장 비활성, 'local'이면 메모리 내 LocalTable 사용 (테스트용)
+
+PLAN_LEDGER_TABLE = os.environ.get('PLAN_LEDGER_TABLE')
+PLAN_LEDGER_TTL_SECONDS = int(os.environ.get('PLAN_LEDGER_TTL_SECONDS', '86400'))
+
+LEDGER_PENDING = 'pending'
+LEDGER_COMPLETED = 'completed'
+
+
+def new_plan_id(now=None):
+    """시간순 정렬되는 고유 planId."""
+    millis = int((time.time() if now is None else now) * 1000)
+    return f'plan-{millis:013d}-{secrets.token_hex(5)}'
+
+
+def request_key(user_id, client_request_id):
+    # 다른 사용자가 같은 요청 ID를 보내도 섞이지 않도록 사용자 ID와 묶음
+    return f'{user_id}#{client_request_id}'
+
+
+class PlanLedger:
+    def __init__(self, table_factory, ttl_seconds=PLAN_LEDGER_TTL_SECONDS):
+        self.table_factory = table_factory  # 현재 스레드의 Table 리소스를 반환
+        self.ttl_seconds = ttl_seconds
+
+    def reserve(self, user_id, client_request_id):
+        """요청 ID에 대한 원장 항목. 처음이면 새 planId를 예약하고, 이미 있으면 기존 항목(planId, status)을 반환."""
+        key = request_key(user_id, client_request_id)
+        now = int(time.time())
+        entry = {
+            'request_key': key,
+            'plan_id': new_plan_id(),
+            'user_id': user_id,
+            'status': LEDGER_PENDING,
+            'created_at': now,
+            'expires_at': now + self.ttl_seconds,
+        }
+        try:
+            self.table_factory().put_item(Item=entry, ConditionExpression='attribute_not_exists(request_key)')
+            return entry
+        except Exception as e:
+            if not is_conditional_check_failed(e):
+                raise
+        existing = self.table_factory().get_item(Key={'request_key': key}, ConsistentRead=True).get('Item')
+        if not existing:
+            # 조건 검사 직후 TTL로 삭제된 경우
+            return self.reserve(user_id, client_request_id)
+        print(f"[PlanLedger] 이미 접수된 요청: {key} -> {existing['plan_id']} ({existing['status']})")
+        return existing
+
+    def complete(self, entry):
+        """계획 저장이 끝난 요청을 completed로 기록."""
+        now = int(time.time())
+        self.table_factory().put_item(Item=dict(entry, status=LEDGER_COMPLETED, completed_at=now,
+                                      expires_at=now + self.ttl_seconds))
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def _create_table_factory():
+    if PLAN_LEDGER_TABLE == 'local':
+        from local_dynamodb import LocalTable
+        table = LocalTable('plan-request-ledger', ['request_key'])
+        return lambda: table
+    # Table 리소스는 스레드별이므로 호출할 때마다 현재 스레드의 것을 사용 (lambda_runtime.use_table 대체도 적용됨)
+    return lambda: get_table(PLAN_LEDGER_TABLE)
+
+
+def get_plan_ledger():
+    """컨테이너 단위로 공유되는 멱등성 원장. PLAN_LEDGER_TABLE이 없으면 None."""
+    global _ledger
+    if not PLAN_LEDGER_TABLE:
+        return None
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = PlanLedger(_create_table_factory())
+    return _ledger
@@ -0,0 +1,237 @@
+import json
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from lambda_runtime import get_client
+from plan_summary_index import SUMMARY_ATTRIBUTES, SUMMARY_SORT_ATTRIBUTE
+
+# 큰 계획 항목의 S3 오프로드 (claim-check, Python Lambda Layer)
+# 다구간 여행은 flight_info_N/accmo_info_N(Amadeus offer, 호텔 객체 JSON)과 계획 본문이 쌓여 DynamoDB 항목 한도(400KB)에
+# 가까워지고, 초과하면 Gemini 생성 비용을 이미 치른 뒤 put_item이 실패한다.
+# 저장 직전 항목 크기가 PLAN_OVERFLOW_THRESHOLD_BYTES를 넘으면 큰 속성부터 S3 객체로 옮기고 항목에는 포인터만 남긴다.
+#
+# 포인터: overflow = {'bucket': ..., 'attributes': {속성 이름: {'key': S3 키, 'type': 'S'|'B'|'J', 'size': 바이트 수}}}
+#   S: 문자열(UTF-8), B: 바이너리(plan_blob 등), J: map/list (JSON)
+# 읽기: restore_overflow(item[, names]) 가 필요한 속성만 병렬로 가져와 항목에 되돌린다.
+#   항목에 같은 이름의 속성이 이미 있으면(오프로드 뒤 부분 업데이트로 다시 쓴 값) 그 값을 우선한다.
+# Node 로더(load_web, load_mobile)의 restoreOverflow도 같은 포인터 형식을 읽는다.
+#
+# PLAN_OVERFLOW_BUCKET이 없으면 비활성 (항목을 그대로 저장), 'local'이면 PLAN_OVERFLOW_LOCAL_DIR 파일 시스템 사용 (테스트용)
+# S3 객체는 planId 경로 아래에 저장되므로 같은 계획의 재시도는 같은 객체를 덮어쓴다.
+
+PLAN_OVERFLOW_BUCKET = os.environ.get('PLAN_OVERFLOW_BUCKET')
+PLAN_OVERFLOW_LOCAL_DIR = os.environ.get('PLAN_OVERFLOW_LOCAL_DIR', os.path.join(tempfile.gettempdir(), 'plan-overflow'))
+PLAN_OVERFLOW_PREFIX = os.environ.get('PLAN_OVERFLOW_PREFIX', 'plan-overflow/')
+PLAN_OVERFLOW_THRESHOLD_BYTES = int(os.environ.get('PLAN_OVERFLOW_THRESHOLD_BYTES', '300000'))
+PLAN_OVERFLOW_MIN_ATTRIBUTE_BYTES = int(os.environ.get('PLAN_OVERFLOW_MIN_ATTRIBUTE_BYTES', '1024'))
+PLAN_OVERFLOW_MAX_WORKERS = int(os.environ.get('PLAN_OVERFLOW_MAX_WORKERS', '8'))
+
+LOCAL_BUCKET = 'local'
+# 키/인덱스/목록 화면에서 쓰는 속성은 항상 항목에 남김
+PINNED_ATTRIBUTES = {'planId', 'id', 'user_id', 'overflow', SUMMARY_SORT_ATTRIBUTE, *SUMMARY_ATTRIBUTES}
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f'{type(value).__name__}은(는) JSON으로 변환할 수 없습니다')
+
+
+def _value_size(value):
+    """DynamoDB 속성 값 크기 근사 (문서의 크기 계산 규칙 기준)."""
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if hasattr(value, 'value') and isinstance(value.value, (bytes, bytearray)):  # boto3 Binary
+        return len(value.value)
+    if isinstance(value, bool) or value is None:
+        return 1
+    if isinstance(value, (int, float, Decimal)):
+        return len(str(value).lstrip('-').replace('.', '')) // 2 + 2
+    if isinstance(value, dict):
+        return 3 + sum(len(str(key).encode('utf-8')) + _value_size(item) + 1 for key, item in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return 3 + sum(_value_size(item) + 1 for item in value)
+    return len(str(value).encode('utf-8'))
+
+
+def item_size(item):
+    """항목 전체 크기 근사 (속성 이름 + 값)."""
+    return sum(len(name.encode('utf-8')) + _value_size(value) for name, value in item.items())
+
+
+def _encode(value):
+    """(S3 본문, 형식)."""
+    if isinstance(value, str):
+        return value.encode('utf-8'), 'S'
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value), 'B'
+    if hasattr(value, 'value') and isinstance(value.value, (bytes, bytearray)):
+        return bytes(value.value), 'B'
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=_json_default).encode('utf-8'), 'J'
+    return None, None
+
+
+def _decode(data, value_type):
+    if value_type == 'S':
+        return data.decode('utf-8')
+    if value_type == 'B':
+        return data
+    return json.loads(data.decode('utf-8'), parse_float=Decimal)
+
+
+class OverflowStore:
+    def __init__(self, client, bucket, prefix=PLAN_OVERFLOW_PREFIX, threshold_bytes=PLAN_OVERFLOW_THRESHOLD_BYTES,
+                 min_attribute_bytes=PLAN_OVERFLOW_MIN_ATTRIBUTE_BYTES, max_workers=PLAN_OVERFLOW_MAX_WORKERS):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.threshold_bytes = threshold_bytes
+        self.min_attribute_bytes = min_attribute_bytes
+        self.max_workers = max_workers
+        self.stats = {'offloaded_items': 0, 'offloaded_attributes': 0, 'restored_attributes': 0}
+        self._lock = threading.Lock()
+
+    def _object_key(self, item, name, version=None):
+        # 버전 저장(plan_versions)은 버전별 키에 올려 조건부 쓰기가 실패해도 현재 버전의 객체를 덮어쓰지 않음
+        version_path = f'v{version}/' if version is not None else ''
+        return f"{self.prefix}{item.get('planId') or item.get('id')}/{version_path}{name}"
+
+    def _map(self, func, values):
+        if len(values) <= 1:
+            return [func(value) for value in values]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(values))) as executor:
+            return list(executor.map(func, values))
+
+    def select(self, item):
+        """기준을 넘는 항목에서 S3로 옮길 속성 이름 (큰 것부터, 기준 이하가 될 때까지). 넘지 않으면 빈 목록."""
+        size = item_size(item)
+        if size <= self.threshold_bytes:
+            return []
+        candidates = sorted(
+            ((len(name.encode('utf-8')) + _value_size(value), name) for name, value in item.items()
+             if name not in PINNED_ATTRIBUTES),
+            reverse=True)
+        names = []
+        for attribute_size, name in candidates:
+            if size <= self.threshold_bytes or attribute_size < self.min_attribute_bytes:
+                break
+            if _encode(item[name])[0] is None:
+                continue
+            names.append(name)
+            size -= attribute_size
+        return names
+
+    def offload(self, item):
+        """한도를 넘는 항목이면 큰 속성부터 S3에 올리고 포인터를 남긴 새 항목을 반환 (넘지 않으면 그대로)."""
+        names = self.select(item)
+        if not names:
+            return item
+
+        refs = self.upload(item, names)  # 항목 저장 전에 모두 올림 (포인터가 없는 객체를 가리키지 않도록)
+        offloaded = {key: value for key, value in item.items() if key not in refs}
+        offloaded['overflow'] = {'bucket': self.bucket, 'attributes': refs}
+        with self._lock:
+            self.stats['offloaded_items'] += 1
+        print(f"[PlanOverflow] 항목 크기 {item_size(item):,} bytes -> {item_size(offloaded):,} bytes, "
+              f"S3로 옮긴 속성: {names}")
+        return offloaded
+
+    def upload(self, item, names, version=None):
+        """item의 names 속성을 S3에 병렬로 올리고 포인터의 attributes 항목 {이름: {key, type, size}}을 반환."""
+        uploads = []
+        for name in names:
+            body, value_type = _encode(item[name])
+            if body is not None:
+                uploads.append((name, self._object_key(item, name, version), body, value_type))
+
+        def put(entry):
+            name, key, body, value_type = entry
+            self.client.put_object(Bucket=self.bucket, Key=key, Body=body,
+                                   ContentType='application/octet-stream' if value_type == 'B' else 'application/json')
+
+        self._map(put, uploads)
+        with self._lock:
+            self.stats['offloaded_attributes'] += len(uploads)
+        return {name: {'key': key, 'type': value_type, 'size': len(body)} for name, key, body, value_type in uploads}
+
+    def delete(self, refs, bucket=None):
+        """더 이상 가리키지 않는 객체 삭제 (실패해도 항목에는 영향 없으므로 로그만 남김)."""
+        def remove(ref):
+            try:
+                self.client.delete_object(Bucket=bucket or self.bucket, Key=ref['key'])
+            except Exception as e:
+                print(f"[PlanOverflow] S3 객체 삭제 실패: {ref['key']} ({e})")
+
+        self._map(remove, list(refs))
+
+    def restore(self, item, names=None):
+        """포인터가 가리키는 속성을 병렬로 가져와 item에 되돌림 (names가 있으면 그 속성만)."""
+        pointer = item.get('overflow')
+        if not pointer:
+            return item
+        attributes = pointer.get('attributes') or {}
+        wanted = [(name, ref) for name, ref in attributes.items()
+                  if name not in item and (names is None or name in names)]
+
+        def fetch(entry):
+            name, ref = entry
+            response = self.client.get_object(Bucket=pointer.get('bucket', self.bucket), Key=ref['key'])
+            return name, _decode(response['Body'].read(), ref.get('type', 'S'))
+
+        for name, value in self._map(fetch, wanted):
+            item[name] = value
+        with self._lock:
+            self.stats['restored_attributes'] += len(wanted)
+        if all(name in item for name in attributes):
+            del item['overflow']
+        return item
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _client_for(bucket):
+    if bucket == LOCAL_BUCKET:
+        from local_s3 import LocalS3Client
+        return LocalS3Client(PLAN_OVERFLOW_LOCAL_DIR)
+    return get_client('s3')
+
+
+def get_overflow_store():
+    """컨테이너 단위로 공유되는 오프로드 저장소. PLAN_OVERFLOW_BUCKET이 없으면 None."""
+    global _store
+    if not PLAN_OVERFLOW_BUCKET:
+        return None
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = OverflowStore(_client_for(PLAN_OVERFLOW_BUCKET), PLAN_OVERFLOW_BUCKET)
+    return _store
+
+
+def overflow_store_for(bucket):
+    """포인터의 버킷을 다루는 저장소 (오프로드가 꺼져 있거나 버킷이 달라도 읽기/삭제용으로 생성)."""
+    store = get_overflow_store()
+    if store is not None and store.bucket == bucket:
+        return store
+    return OverflowStore(_client_for(bucket), bucket)
+
+
+def offload_large_attributes(item):
+    """저장 직전 호출. 오프로드가 꺼져 있으면 항목을 그대로 반환."""
+    store = get_overflow_store()
+    return store.offload(item) if store else item
+
+
+def restore_overflow(item, names=None):
+    """읽은 직후 호출. 포인터가 있는데 오프로드가 꺼져 있으면 포인터의 버킷으로 S3에서 직접 읽는다."""
+    if not item or not item.get('overflow'):
+        return item
+    return overflow_store_for(item['overflow'].get('bucket')).restore(item, names)
@@ -0,0 +1,34 @@
+from plan_schema import PLAN_STRUCTURED_OUTPUT, PLAN_SCHEMA_PROMPT
+
+# 여행 계획 생성 프롬프트의 고정 블록 (Python Lambda Layer)
+# createPlanAsync / create_mobile 요청마다 동일한 부분. 요청별 항공편/숙박/요구사항/날짜 부분과 분리해
+# Gemini 컨텍스트 캐시(cachedContents) 또는 systemInstruction으로 보낸다. (gemini_context_cache 참고)
+# 내용을 바꾸면 해시가 달라져 새 캐시가 만들어진다.
+
+PLAN_RULES_PROMPT = """<규칙>
+모든 장소는 실제로 있는 장소여야 해. 호텔, 장소, 식당을 너가 검색해서 잡아줘.
+"무조건 이름이 지도에 있는 이름이어야 해."
+현실적인 일정을 잡아야 하니, 하루 총 일정에 너무 많은 이동거리가 있으면 안 돼.
+그리고, 다음날의 첫 일정에는 전날의 호텔과 가까이 있는 걸로 해줘.
+이어지는 흐름으로 갈 수 있도록.
+그런데 장소와 장소 사이가 너무 가까워도 안됨.
+항공편 정보가 제공된 경우, 첫날 첫 번째 일정은 반드시 제공된 '가는 편' 항공편의 도착 공항에, 명시된 '도착 시간'에 도착하는 것으로 생성해야 하며, 해당 공항의 이름, 위도, 경도를 `schedules`에 포함해야 한다.
+마찬가지로, 복귀 항공편 정보가 제공된 경우, 마지막 날 마지막 일정은 제공된 '오는 편' 항공편의 출발 공항에서, 명시된 '출발 시간' 이전에 출발 준비를 마치는 것으로 생성하고, 해당 공항 이름, 위도, 경도를 `schedules`에 포함해야 한다.
+"""
+
+PLAN_FORMAT_PROMPT = """<답변형식>
+하루치 일정은 \\"(관광지)-(식당)-(관광지)-(관광지)-(관광지)-(관광지)-(마지막 관광지)\\" 이렇게 잡아줘.
+관광지 : 지도 상에 존재하는 명소나, 구경거리 (제외 : 호텔, 지하철역, 항공 등등..) 만 넣어야해.
+추가로, 하루 일정의 마지막 장소의 위도(latitude)와 경도(longitude) 정보를 포함해야 해.
+항공편 도착/출발 공항도 '장소'로 취급하여 일정에 포함해야 한다.
+"""
+
+PLAN_JSON_EXAMPLE_PROMPT = """JSON 예시
+{{\\"title\\":\\"ㅁㅁ ㅁ박 ㅁ일 여행\\",\\"days\\":[{{\\"day\\":1,\\"date\\":\\"2025-05-12\\",\\"title\\":\\"1일차: 공항 도착 및 ㅁㅁ 방문\\",\\"schedules\\":[{{\\"id\\":\\"1-0\\",\\"name\\":\\"도착 공항 이름 (예: 인천 국제공항)\\",\\"time\\":\\"14:00\\",\\"lat\\":37.45584,\\"lng\\":126.4453,\\"category\\":\\"장소\\",\\"duration\\":\\"0.5시간\\",\\"notes\\":\\"공항 도착 및 입국 수속\\",\\"cost\\":\\"0\\",\\"address\\":\\"공항 주소\\"}},{{\\"id\\":\\"1-1\\",\\"name\\":\\"장소이름\\",\\"time\\":\\"15:30\\",\\"lat\\":123.1234,\\"lng\\":123.1234,\\"category\\":\\"장소\\",\\"duration\\":\\"1시간\\",\\"notes\\":\\"ㅁㅁ\\",\\"cost\\":\\"50000\\",\\"address\\":\\"ㅁㅁ 주소\\"}},{{\\"id\\":\\"1-2\\",\\"name\\":\\"ㅁㅁ\\",\\"time\\":\\"17:00\\",\\"lat\\":35.6936,\\"lng\\":139.7071,\\"category\\":\\"식당\\",\\"duration\\":\\"1시간\\",\\"notes\\":\\"현지 이자카야에서 다양한 음식 즐기기\\",\\"cost\\":\\"3000\\",\\"address\\":\\"ㅁㅁ 주소\\"}},{{\\"id\\":\\"custom-1234567890\\",\\"name\\":\\"ㅁㅁ 호텔\\",\\"time\\":\\"22:00\\",\\"lat\\":35.6762,\\"lng\\":139.6503,\\"category\\":\\"숙소\\",\\"duration\\":\\"8시간\\",\\"notes\\":\\"시내 중심가에 위치한 4성급 호텔. 무료 Wi-Fi, 조식 제공, 지하철역 도보 5분 거리. 체크인 14:00, 체크아웃 11:00, 연락처: 02-1234-5678\\",\\"cost\\":\\"120000\\",\\"address\\":\\"ㅁㅁ시 ㅁㅁ구 ㅁㅁ동 123-45\\"}}]}},{{\\"day\\":2,\\"date\\":\\"2025-05-13\\",\\"title\\":\\"2일차: ㅁㅁ 여행\\",\\"schedules\\":[{{\\"id\\":\\"2-1\\",\\"name\\":\\"ㅁㅁ 타워\\",\\"time\\":\\"10:00\\",\\"lat\\":35.6585805,\\"lng\\":139.7454329,\\"category\\":\\"장소\\",\\"duration\\":\\"1시간\\",\\"notes\\":\\"ㅁㅁ 시내 전경을 감상할 수 있는 명소\\",\\"cost\\":\\"1200\\",\\"address\\":\\"ㅁㅁ 주소\\"}},{{\\"id\\":\\"2-2\\",\\"name\\":\\"ㅁㅁ 멘치\\",\\"time\\":\\"13:00\\",\\"lat\\":35.714765,\\"lng\\":139.79669,\\"category\\":\\"식당\\",\\"duration\\":\\"1시간\\",\\"notes\\":\\"유명한 ㅁㅁ 멘치카츠 맛보기\\",\\"cost\\":\\"800\\",\\"address\\":\\"ㅁㅁ 주소\\"}},{{\\"id\\":\\"custom-0987654321\\",\\"name\\":\\"ㅁㅁ 게스트하우스\\",\\"time\\":\\"22:00\\",\\"lat\\":35.6895,\\"lng\\":139.6917,\\"category\\":\\"숙소\\",\\"duration\\":\\"8시간\\",\\"notes\\":\\"현지 분위기를 느낄 수 있는 전통 게스트하우스. 온천 시설, 한식 조식 제공. 체크인 15:00, 체크아웃 10:00, 연락처: 02-9876-5432\\",\\"cost\\":\\"80000\\",\\"address\\":\\"ㅁㅁ시 ㅁㅁ구 ㅁㅁ동 456-78\\"}}]}},{{\\"day\\":3,\\"date\\":\\"2025-05-14\\",\\"title\\":\\"3일차: ㅁㅁ 온천 여행 및 출국\\",\\"schedules\\":[{{\\"id\\":\\"3-1\\",\\"name\\":\\"ㅁㅁ 역\\",\\"time\\":\\"09:00\\",\\"lat\\":35.6896342,\\"lng\\":139.700627,\\"category\\":\\"장소\\",\\"duration\\":\\"2시간\\",\\"notes\\":\\"ㅁㅁ에서 ㅁㅁ 온천 지역으로 이동\\",\\"cost\\":\\"2500\\",\\"address\\":\\"ㅁㅁ 주소\\"}},{{\\"id\\":\\"3-2\\",\\"name\\":\\"ㅁㅁ 유모토\\",\\"time\\":\\"11:00\\",\\"lat\\":35.232916,\\"lng\\":139.105582,\\"category\\":\\"장소\\",\\"duration\\":\\"1시간\\",\\"notes\\":\\"온천 마을 ㅁㅁ 유모토 도착 후 휴식\\",\\"cost\\":\\"0\\",\\"address\\":\\"ㅁㅁ 주소\\"}},{{\\"id\\":\\"3-3\\",\\"name\\":\\"ㅁㅁ 소바집\\",\\"time\\":\\"12:00\\",\\"lat\\":35.235083,\\"lng\\":139.108167,\\"category\\":\\"식당\\",\\"duration\\":\\"1시간\\",\\"notes\\":\\"ㅁㅁ 지역의 유명한 소바 맛집\\",\\"cost\\":\\"1500\\",\\"address\\":\\"ㅁㅁ 주소\\"}},{{\\"id\\":\\"3-4\\",\\"name\\":\\"출발 공항 이름 (예: 나리타 국제공항)\\",\\"time\\":\\"16:00\\",\\"lat\\":35.771987,\\"lng\\":140.392903,\\"category\\":\\"장소\\",\\"duration\\":\\"2시간\\",\\"notes\\":\\"출국 수속\\",\\"cost\\":\\"0\\",\\"address\\":\\"공항 주소\\"}}]}}]\n}}
+저 구조로만 반환하세요.
+"""
+
+
+def plan_instruction_text():
+    """생성 요청의 고정 지시문 전체 (규칙 + 답변형식 + 응답 필드 설명 또는 JSON 예시)."""
+    return PLAN_RULES_PROMPT + "\n" + PLAN_FORMAT_PROMPT + "\n\n" + (PLAN_SCHEMA_PROMPT if PLAN_STRUCTURED_OUTPUT else PLAN_JSON_EXAMPLE_PROMPT)
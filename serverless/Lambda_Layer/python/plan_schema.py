@@ -0,0 +1,136 @@
+import json
+import os
+
+from plan_json import extract_json
+
+# 여행 계획 구조화 출력 스키마 (Python Lambda Layer)
+# Gemini에 responseMimeType=application/json + responseSchema로 짧은 필드 이름의 JSON을 받고,
+# 람다에서 프론트엔드가 쓰는 days[].schedules[] 구조(긴 필드 이름)로 펼친다.
+# => 프롬프트의 JSON 예시 블록과 출력 토큰이 줄고, 코드 블록/깨진 JSON 응답이 사라진다.
+
+PLAN_STRUCTURED_OUTPUT = os.environ.get('PLAN_STRUCTURED_OUTPUT', 'true').lower() == 'true'
+
+# 짧은 이름 -> 프론트엔드 필드 이름
+SCHEDULE_FIELDS = {
+    'i': 'id', 'n': 'name', 't': 'time', 'la': 'lat', 'lo': 'lng', 'c': 'category',
+    'du': 'duration', 'no': 'notes', 'co': 'cost', 'a': 'address',
+}
+DAY_FIELDS = {'d': 'day', 'dt': 'date', 'ti': 'title', 's': 'schedules'}
+PLAN_FIELDS = {'ti': 'title', 'ds': 'days'}
+
+# plan_continuation / DaysStreamReader 에 넘기는 짧은 키 이름
+COMPACT_KEYS = {'days': 'ds', 'schedules': 's', 'day': 'd', 'id': 'i', 'name': 'n'}
+
+_NUMBER_FIELDS = ('la', 'lo')
+
+SCHEDULE_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        key: {'type': 'NUMBER' if key in _NUMBER_FIELDS else 'STRING'} for key in SCHEDULE_FIELDS
+    },
+    'required': list(SCHEDULE_FIELDS),
+    'propertyOrdering': list(SCHEDULE_FIELDS),
+}
+
+DAY_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'd': {'type': 'INTEGER'},
+        'dt': {'type': 'STRING'},
+        'ti': {'type': 'STRING'},
+        's': {'type': 'ARRAY', 'items': SCHEDULE_SCHEMA},
+    },
+    'required': ['d', 'dt', 'ti', 's'],
+    'propertyOrdering': ['d', 'dt', 'ti', 's'],
+}
+
+PLAN_RESPONSE_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {
+        'ti': {'type': 'STRING'},
+        'ds': {'type': 'ARRAY', 'items': DAY_SCHEMA},
+    },
+    'required': ['ti', 'ds'],
+    'propertyOrdering': ['ti', 'ds'],
+}
+
+# 수정 응답은 일반 관광일정만 일차별로 받는다 (펼칠 때 {"days": {"1": {"schedules": [...]}}} 형태로 변환)
+MODIFY_DAY_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {'d': {'type': 'INTEGER'}, 's': {'type': 'ARRAY', 'items': SCHEDULE_SCHEMA}},
+    'required': ['d', 's'],
+    'propertyOrdering': ['d', 's'],
+}
+
+MODIFY_RESPONSE_SCHEMA = {
+    'type': 'OBJECT',
+    'properties': {'ds': {'type': 'ARRAY', 'items': MODIFY_DAY_SCHEMA}},
+    'required': ['ds'],
+}
+
+PLAN_SCHEMA_PROMPT = """<응답 필드>
+지정된 JSON 스키마로만 답하세요. 필드 의미:
+ti=여행 제목(예: "ㅁㅁ ㅁ박 ㅁ일 여행"), ds=일차 목록
+d=일차 번호, dt=날짜(YYYY-MM-DD), ti=일차 제목(예: "1일차: 공항 도착 및 ㅁㅁ 방문"), s=일정 목록
+i=일정 id("일차-순번", 숙소는 "custom-숫자"), n=장소 이름, t=시작 시간(HH:MM), la=위도, lo=경도,
+c=카테고리(장소/식당/숙소), du=소요 시간(예: "1시간"), no=간단한 설명, co=비용(숫자 문자열), a=주소
+"""
+
+MODIFY_SCHEMA_PROMPT = """**응답 필드:** 지정된 JSON 스키마로만 답하세요.
+ds=일차 목록, d=일차 번호, s=일정 목록
+i=고유 ID, n=장소이름, t=시간, la=위도, lo=경도, c=카테고리, du=소요시간, no=간단한설명, co=비용, a=주소"""
+
+
+def structured_generation_config(generation_config, response_schema):
+    """generationConfig에 JSON 응답 형식과 스키마를 추가한 사본."""
+    return dict(generation_config, responseMimeType='application/json', responseSchema=response_schema)
+
+
+def _rename(item, fields):
+    if not isinstance(item, dict):
+        return item
+    return {fields.get(key, key): value for key, value in item.items()}
+
+
+def expand_schedule(schedule):
+    return _rename(schedule, SCHEDULE_FIELDS)
+
+
+def expand_day(day):
+    expanded = _rename(day, DAY_FIELDS)
+    if isinstance(expanded, dict) and isinstance(expanded.get('schedules'), list):
+        expanded['schedules'] = [expand_schedule(schedule) for schedule in expanded['schedules']]
+    return expanded
+
+
+def expand_plan(plan):
+    """{"ti", "ds": [...]} -> {"title", "days": [{"day", "date", "title", "schedules": [...]}]}"""
+    expanded = _rename(plan, PLAN_FIELDS)
+    if isinstance(expanded, dict) and isinstance(expanded.get('days'), list):
+        expanded['days'] = [expand_day(day) for day in expanded['days']]
+    return expanded
+
+
+def expand_modify_plan(plan):
+    """{"ds": [{"d": 1, "s": [...]}]} -> {"days": {"1": {"schedules": [...]}}} (modifyPlanAsync 병합 로직이 쓰는 구조)"""
+    days = {}
+    for day in (plan or {}).get('ds') or []:
+        if isinstance(day, dict):
+            days[str(day.get('d'))] = {'schedules': [expand_schedule(schedule) for schedule in day.get('s') or []]}
+    return {'days': days}
+
+
+def expand_envelope_text(result, expand):
+    """짧은 필드 이름으로 받은 응답(envelope)의 텍스트를 펼친 JSON으로 교체. 반환: (펼친 값 또는 None, 적용한 수정 목록)"""
+    try:
+        part = result['candidates'][0]['content']['parts'][0]
+    except (KeyError, IndexError, TypeError):
+        return None, []
+    try:
+        value, repairs = extract_json(part.get('text', ''), COMPACT_KEYS['days'])
+    except ValueError as e:
+        print(f"[PlanSchema] 구조화 응답 파싱 실패: {str(e)}")
+        return None, []
+    expanded = expand(value)
+    part['text'] = json.dumps(expanded, ensure_ascii=False)
+    return expanded, repairs
@@ -0,0 +1,243 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+from gemini_client import build_envelope, chunk_text
+from plan_json import extract_json
+from plan_prompts import plan_instruction_text
+from plan_schema import PLAN_STRUCTURED_OUTPUT, DAY_SCHEMA, expand_day, structured_generation_config
+
+# 긴 여행(7~10일)을 일차별로 나눠 병렬 생성하는 모듈 (Python Lambda Layer)
+# 1) 뼈대(skeleton) 호출: 일차별 제목/지역만 짧게 생성
+#    숙소와 항공편 고정 일정(anchor)은 요청 데이터에서 날짜 기준으로 직접 배정 (모델 호출 불필요)
+# 2) 일차별 호출을 스레드 풀로 동시에 실행 -> 전체 소요 시간은 가장 느린 하루에 맞춰짐
+# 3) 결과를 기존 {"title", "days": [...]} 구조로 이어 붙임
+# 일차 하나가 실패하거나 호출자가 중단하면(on_day_ready 예외, should_cancel) 남은 일차는 시작하지 않고
+# 이미 시작한 호출도 기다리지 않고 바로 예외를 전달함
+
+PLAN_SHARD_MAX_WORKERS = int(os.environ.get('PLAN_SHARD_MAX_WORKERS', '8'))
+PLAN_SHARD_DAY_MAX_TOKENS = int(os.environ.get('PLAN_SHARD_DAY_MAX_TOKENS', '2048'))
+PLAN_SKELETON_MAX_TOKENS = int(os.environ.get('PLAN_SKELETON_MAX_TOKENS', '1024'))
+
+DAY_JSON_EXAMPLE_PROMPT = """JSON 예시 (하루치)
+{"day":2,"date":"2025-05-13","title":"2일차: ㅁㅁ 여행","schedules":[{"id":"2-1","name":"ㅁㅁ 타워","time":"10:00","lat":35.6585805,"lng":139.7454329,"category":"장소","duration":"1시간","notes":"ㅁㅁ 시내 전경을 감상할 수 있는 명소","cost":"1200","address":"ㅁㅁ 주소"},{"id":"2-2","name":"ㅁㅁ 멘치","time":"13:00","lat":35.714765,"lng":139.79669,"category":"식당","duration":"1시간","notes":"유명한 ㅁㅁ 멘치카츠 맛보기","cost":"800","address":"ㅁㅁ 주소"}]}
+저 구조의 하루치 객체 하나만 반환하세요.
+"""
+
+
+def trip_dates(start_date, end_date):
+    """'YYYY-MM-DD' 시작/종료일로 날짜 목록 생성. 형식이 다르면 빈 목록."""
+    try:
+        start = datetime.strptime(str(start_date)[:10], '%Y-%m-%d')
+        end = datetime.strptime(str(end_date)[:10], '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return []
+    if end < start:
+        return []
+    return [(start + timedelta(days=i)).strftime('%Y-%m-%d') for i in range((end - start).days + 1)]
+
+
+def _hhmm(value):
+    return value.split('T')[1][:5] if 'T' in value else value
+
+
+def _airport_name(endpoint):
+    return (endpoint.get('airportInfo') or {}).get('koreanName') or endpoint.get('iataCode', '')
+
+
+def _hotel_name(accommodation):
+    hotel = accommodation.get('hotel', {})
+    return hotel.get('hotel_name_trans') or hotel.get('hotel_name') or hotel.get('name') or 'Unknown Hotel'
+
+
+def build_day_anchors(dates, flights, accommodations):
+    """날짜별 숙소와 반드시 포함해야 할 항공편/체크인·체크아웃 일정을 배정."""
+    anchors = {date: {'hotel': None, 'anchors': []} for date in dates}
+
+    for flight in flights or []:
+        for itinerary in flight.get('itineraries', []):
+            segments = itinerary.get('segments') or []
+            if not segments:
+                continue
+            departure = segments[0].get('departure', {})
+            arrival = segments[-1].get('arrival', {})
+            dep_at, arr_at = departure.get('at', ''), arrival.get('at', '')
+            if arr_at[:10] in anchors:
+                geo = arrival.get('geoCode', {})
+                anchors[arr_at[:10]]['anchors'].append(
+                    f"{_hhmm(arr_at)} {_airport_name(arrival)}({arrival.get('iataCode', '')}) 공항 도착 "
+                    f"(위도/경도: {geo.get('latitude', 'Unknown')}/{geo.get('longitude', 'Unknown')})")
+            if dep_at[:10] in anchors:
+                geo = departure.get('geoCode', {})
+                anchors[dep_at[:10]]['anchors'].append(
+                    f"{_hhmm(dep_at)} {_airport_name(departure)}({departure.get('iataCode', '')}) 공항 출발 - "
+                    f"최소 2시간 전에 공항에서 출발 준비 완료 "
+                    f"(위도/경도: {geo.get('latitude', 'Unknown')}/{geo.get('longitude', 'Unknown')})")
+
+    for accommodation in accommodations or []:
+        check_in = str(accommodation.get('checkIn') or dates[0])[:10]
+        check_out = str(accommodation.get('checkOut') or dates[-1])[:10]
+        hotel_name = _hotel_name(accommodation)
+        address = accommodation.get('hotel', {}).get('address', '정보 없음')
+        for date in dates:
+            if check_in <= date < check_out:
+                anchors[date]['hotel'] = f"{hotel_name} ({address})"
+        if check_in in anchors:
+            anchors[check_in]['anchors'].append(f"{hotel_name} 체크인")
+        if check_out in anchors:
+            anchors[check_out]['anchors'].append(f"{hotel_name} 체크아웃")
+
+    return anchors
+
+
+class GenerationCancelled(Exception):
+    """should_cancel이 True를 돌려줘 일차 생성을 시작하지 않음."""
+
+
+def _add_usage(total, result):
+    for key, value in (result.get('usageMetadata') or {}).items():
+        if isinstance(value, (int, float)):
+            total[key] = total.get(key, 0) + value
+
+
+class ShardedPlanGenerator:
+    def __init__(self, gemini_client, max_workers=PLAN_SHARD_MAX_WORKERS, timeout=120, context_cache=None):
+        self.client = gemini_client
+        self.max_workers = max_workers
+        self.timeout = timeout
+        # 일차 호출의 고정 지시문(규칙/답변형식/응답 필드)은 컨텍스트 캐시가 있으면 캐시로, 없으면 systemInstruction으로
+        self.context_cache = context_cache
+        self.instruction = plan_instruction_text()
+
+    def generate(self, context_prompt, dates, flights, accommodations,
+                 image_parts=None, temperature=0.3, on_day_ready=None, should_cancel=None):
+        """일차별 병렬 생성 후 generateContent 응답과 같은 구조(envelope)와 구간별 시간을 반환.
+        should_cancel: 일차 호출 직전에 확인하는 함수. True면 GenerationCancelled."""
+        usage = {}
+        timings = {}
+
+        skeleton_start = time.time()
+        skeleton = self._generate_skeleton(context_prompt, dates, image_parts, temperature, usage)
+        timings['skeleton'] = time.time() - skeleton_start
+
+        anchors = build_day_anchors(dates, flights, accommodations)
+        outline = '\n'.join(
+            f"{day['day']}일차 ({day['date']}): {day.get('title', '')} - {day.get('area', '')}"
+            for day in skeleton['days'])
+
+        days_start = time.time()
+        days = {}
+        day_timings = {}
+        executor = ThreadPoolExecutor(max_workers=min(self.max_workers, len(dates)))
+        try:
+            futures = {
+                executor.submit(self._generate_day, context_prompt, outline,
+                                day_info, anchors[day_info['date']], temperature, should_cancel): day_info
+                for day_info in skeleton['days']
+            }
+            for future in as_completed(futures):
+                day_info = futures[future]
+                day, result, elapsed = future.result()
+                _add_usage(usage, result)
+                days[day_info['day']] = day
+                day_timings[day_info['day']] = elapsed
+                if on_day_ready:
+                    on_day_ready(day_info['day'] - 1, day)
+        except BaseException:
+            # with 블록처럼 모든 일차를 기다리지 않음: 대기 중인 일차는 취소하고 진행 중인 호출은 타임아웃에 맡김
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
+        timings['days_wall'] = time.time() - days_start
+        timings['days_slowest'] = max(day_timings.values()) if day_timings else 0.0
+        timings['days_sum'] = sum(day_timings.values())
+
+        plan = {'title': skeleton.get('title', ''), 'days': [days[number] for number in sorted(days)]}
+        return build_envelope(json.dumps(plan, ensure_ascii=False), {'usageMetadata': usage}), timings
+
+    def _generate_skeleton(self, context_prompt, dates, image_parts, temperature, usage):
+        prompt = context_prompt + f"""
+
+<작업>
+전체 {len(dates)}일 여행({dates[0]} ~ {dates[-1]})의 뼈대만 만드세요. 상세 장소 일정은 넣지 마세요.
+각 일차의 제목과 주로 머무를 지역을 정하고, 일차끼리 지역이 자연스럽게 이어지도록 하세요.
+다음 JSON 구조로만 반환하세요.
+{{"title":"ㅁㅁ ㅁ박 ㅁ일 여행","days":[{{"day":1,"date":"{dates[0]}","title":"1일차: 공항 도착 및 ㅁㅁ 방문","area":"ㅁㅁ"}}]}}
+"""
+        payload = {
+            "contents": [{"parts": [{"text": prompt}] + list(image_parts or [])}],
+            "generationConfig": {
+                "temperature": temperature,
+                "maxOutputTokens": PLAN_SKELETON_MAX_TOKENS,
+                "responseMimeType": "application/json",
+            },
+        }
+        result = self.client.generate_content(payload, timeout=self.timeout).json()
+        _add_usage(usage, result)
+        skeleton, _ = extract_json(chunk_text(result))
+
+        # 모델이 일차를 빠뜨리거나 날짜를 틀려도 요청 날짜 기준으로 보정
+        by_day = {int(day.get('day', 0)): day for day in skeleton.get('days', []) if isinstance(day, dict)}
+        skeleton['days'] = [
+            {**by_day.get(number, {}), 'day': number, 'date': date}
+            for number, date in enumerate(dates, start=1)
+        ]
+        return skeleton
+
+    def _generate_day(self, context_prompt, outline, day_info, day_anchor, temperature, should_cancel=None):
+        if should_cancel and should_cancel():
+            raise GenerationCancelled(f"{day_info['day']}일차 생성 중단")
+        anchor_lines = '\n'.join(f"- {anchor}" for anchor in day_anchor['anchors']) or '- 없음'
+        # 구조화 출력이면 구조는 DAY_SCHEMA가 강제하므로 하루치 예시 불필요
+        day_example = '' if PLAN_STRUCTURED_OUTPUT else '\n' + DAY_JSON_EXAMPLE_PROMPT
+        prompt = context_prompt + f"""
+
+<전체 여행 개요>
+{outline}
+
+<이번 작업>
+{day_info['day']}일차({day_info['date']}) 하루치 일정만 생성하세요. 제목: {day_info.get('title', '')}
+다른 일차의 개요와 장소가 겹치지 않도록 하세요.
+이 날 묵는 숙소: {day_anchor['hotel'] or '지정 없음'}
+반드시 포함할 고정 일정:
+{anchor_lines}
+일정 id는 "{day_info['day']}-순번" 형식을 사용하세요.
+{day_example}"""
+        generation_config = {
+            "temperature": temperature,
+            "maxOutputTokens": PLAN_SHARD_DAY_MAX_TOKENS,
+            "responseMimeType": "application/json",
+        }
+        if PLAN_STRUCTURED_OUTPUT:
+            # 하루치 객체 하나만 받도록 일차 스키마 사용 (짧은 키 -> expand_day로 펼침)
+            generation_config = structured_generation_config(generation_config, DAY_SCHEMA)
+        payload = {"contents": [{"parts": [{"text": prompt}]}], "generationConfig": generation_config}
+
+        start = time.time()
+        last_error = None
+        for _ in range(2):  # 하루치 실패는 한 번만 다시 시도
+            try:
+                result = self._send_with_instruction(payload).json()
+                day, _ = extract_json(chunk_text(result))
+                if isinstance(day, list):
+                    day = day[0]
+                if PLAN_STRUCTURED_OUTPUT:
+                    day = expand_day(day)
+                day['day'] = day_info['day']
+                day['date'] = day_info['date']
+                day.setdefault('title', day_info.get('title', f"{day_info['day']}일차"))
+                return day, result, time.time() - start
+            except Exception as e:
+                last_error = e
+                print(f"[PlanSharding] {day_info['day']}일차 생성 실패: {type(e).__name__} - {e}")
+        raise last_error
+
+    def _send_with_instruction(self, payload):
+        def send(prepared):
+            return self.client.generate_content(prepared, timeout=self.timeout)
+
+        if self.context_cache:
+            return self.context_cache.call(send, payload, self.instruction)
+        return send(dict(payload, systemInstruction={'parts': [{'text': self.instruction}]}))
@@ -0,0 +1,148 @@
+import os
+import threading
+import time
+
+from lambda_runtime import get_table
+from local_dynamodb import is_conditional_check_failed
+
+# 동일 생성 요청 single-flight (Python Lambda Layer)
+# 같은 사용자가 같은 요청을 연달아 보내면(더블 클릭, 재연결 후 재전송) 두 워커가 같은 Gemini 호출을 동시에 한다.
+# 요청 지문(사용자 + 프롬프트/이미지/설정 해시)마다 짧은 리스(LEASE)를 잡은 워커만 생성하고,
+# 나중에 온 요청은 자신의 connectionId를 구독(SUB#)으로 남긴 뒤 바로 끝낸다.
+# 생성이 끝나면 리더가 결과(RESULT)를 기록하고 구독자 모두에게 같은 plan_created 프레임을 보낸다.
+# 구독자의 멱등성 원장 항목(plan_ledger)도 SUB# 항목에 함께 남겨 리더가 같은 planId로 완료 처리한다
+# (구독자는 바로 끝나므로 기록하지 않으면 원장 항목이 TTL까지 pending으로 남음).
+# WS_DISCONNECT_POLICY='cancel'에서 리더의 연결이 끊겨도 구독자가 있으면 생성을 중단하지 않고 구독자에게 전달한다.
+#
+# 테이블 스키마: 파티션 키 flight_key (S), 정렬 키 flight_item (S: LEASE / SUB#{connectionId} / RESULT), TTL 속성 expires_at (N)
+# PLAN_SINGLE_FLIGHT_TABLE 환경변수가 없으면 비활성, 'local'이면 메모리 내 LocalTable 사용 (테스트용)
+
+PLAN_SINGLE_FLIGHT_TABLE = os.environ.get('PLAN_SINGLE_FLIGHT_TABLE')
+PLAN_SINGLE_FLIGHT_LEASE_SECONDS = int(os.environ.get('PLAN_SINGLE_FLIGHT_LEASE_SECONDS', '180'))
+PLAN_SINGLE_FLIGHT_RESULT_SECONDS = int(os.environ.get('PLAN_SINGLE_FLIGHT_RESULT_SECONDS', '300'))
+
+FLIGHT_LEADER = 'leader'  # 이 워커가 생성
+FLIGHT_FOLLOWER = 'follower'  # 다른 워커가 생성 중, 결과를 구독
+FLIGHT_DONE = 'done'  # 방금 같은 요청이 끝나 결과가 있음
+
+_LEASE = 'LEASE'
+_RESULT = 'RESULT'
+_SUBSCRIBER_PREFIX = 'SUB#'
+
+
+def flight_key(user_id, request_fingerprint):
+    return f'{user_id}#{request_fingerprint}'
+
+
+class SingleFlight:
+    def __init__(self, table_factory, lease_seconds=PLAN_SINGLE_FLIGHT_LEASE_SECONDS, result_seconds=PLAN_SINGLE_FLIGHT_RESULT_SECONDS):
+        self.table_factory = table_factory  # 현재 스레드의 Table 리소스를 반환
+        self.lease_seconds = lease_seconds
+        self.result_seconds = result_seconds
+
+    def acquire(self, key, owner):
+        """리스 획득 시도. 반환: (FLIGHT_LEADER | FLIGHT_FOLLOWER | FLIGHT_DONE, 완료된 planId 또는 None)"""
+        plan_id = self.result(key)
+        if plan_id:
+            return FLIGHT_DONE, plan_id
+        now = int(time.time())
+        try:
+            # 리스가 없거나 만료된 경우(리더 람다가 중간에 종료됨), 또는 같은 메시지의 재전달이면 획득
+            self.table_factory().put_item(
+                Item={'flight_key': key, 'flight_item': _LEASE, 'owner': owner,
+                      'lease_expires_at': now + self.lease_seconds, 'expires_at': now + self.lease_seconds},
+                ConditionExpression='attribute_not_exists(flight_key) OR lease_expires_at < :now OR #owner = :owner',
+                ExpressionAttributeNames={'#owner': 'owner'},
+                ExpressionAttributeValues={':now': now, ':owner': owner})
+            return FLIGHT_LEADER, None
+        except Exception as e:
+            if not is_conditional_check_failed(e):
+                raise
+        return FLIGHT_FOLLOWER, None
+
+    def subscribe(self, key, connection_id, ledger_entry=None):
+        """리더가 생성 중인 결과를 받을 connectionId(와 구독자의 원장 항목) 등록. 그 사이 결과가 이미 나왔으면 planId 반환."""
+        now = int(time.time())
+        item = {'flight_key': key, 'flight_item': _SUBSCRIBER_PREFIX + connection_id,
+                'connection_id': connection_id, 'expires_at': now + self.lease_seconds}
+        if ledger_entry:
+            item['ledger_entry'] = ledger_entry
+        self.table_factory().put_item(Item=item)
+        # 구독 기록 후 결과를 다시 확인 (리더가 구독자 목록을 읽은 직후에 등록한 경우 대비)
+        return self.result(key)
+
+    def has_subscribers(self, key):
+        """결과를 기다리는 구독자가 있는지 (리더의 연결이 끊겨도 생성을 계속할지 판단)."""
+        items = self.table_factory().query(
+            KeyConditionExpression='flight_key = :key AND begins_with(flight_item, :prefix)',
+            ExpressionAttributeValues={':key': key, ':prefix': _SUBSCRIBER_PREFIX},
+            ConsistentRead=True, Limit=1).get('Items', [])
+        return bool(items)
+
+    def result(self, key):
+        item = self.table_factory().get_item(Key={'flight_key': key, 'flight_item': _RESULT}, ConsistentRead=True).get('Item')
+        if item and int(item.get('expires_at', 0)) > time.time():
+            return item['plan_id']
+        return None
+
+    def complete(self, key, owner, plan_id):
+        """생성 완료 기록 후 리스를 놓고 구독자 (connectionId, 원장 항목 또는 None) 목록 반환."""
+        now = int(time.time())
+        self.table_factory().put_item(Item={'flight_key': key, 'flight_item': _RESULT, 'plan_id': plan_id,
+                                  'expires_at': now + self.result_seconds})
+        subscribers = self._pop_subscribers(key)
+        self.release(key, owner)
+        return [(item['connection_id'], item.get('ledger_entry')) for item in subscribers]
+
+    def fail(self, key, owner):
+        """재시도하지 않는 실패. 리스를 놓고 구독자 connectionId 목록 반환 (오류 알림용).
+        구독자의 원장 항목은 pending으로 남아 같은 clientRequestId로 다시 요청하면 새로 생성한다."""
+        subscribers = self._pop_subscribers(key)
+        self.release(key, owner)
+        return [item['connection_id'] for item in subscribers]
+
+    def release(self, key, owner):
+        """리스 해제 (재시도할 실패면 구독은 남겨 두어 다음 리더가 결과를 전달)."""
+        try:
+            self.table_factory().delete_item(Key={'flight_key': key, 'flight_item': _LEASE},
+                                   ConditionExpression='attribute_exists(flight_key) AND #owner = :owner',
+                                   ExpressionAttributeNames={'#owner': 'owner'},
+                                   ExpressionAttributeValues={':owner': owner})
+        except Exception as e:
+            if not is_conditional_check_failed(e):
+                raise
+            print(f"[SingleFlight] 리스가 이미 만료되어 다른 워커로 넘어감: {key}")
+
+    def _pop_subscribers(self, key):
+        items = self.table_factory().query(
+            KeyConditionExpression='flight_key = :key AND begins_with(flight_item, :prefix)',
+            ExpressionAttributeValues={':key': key, ':prefix': _SUBSCRIBER_PREFIX},
+            ConsistentRead=True).get('Items', [])
+        for item in items:
+            self.table_factory().delete_item(Key={'flight_key': key, 'flight_item': item['flight_item']})
+        return items
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def _create_table_factory():
+    if PLAN_SINGLE_FLIGHT_TABLE == 'local':
+        from local_dynamodb import LocalTable
+        table = LocalTable('plan-single-flight', ['flight_key', 'flight_item'])
+        return lambda: table
+    # Table 리소스는 스레드별이므로 호출할 때마다 현재 스레드의 것을 사용 (lambda_runtime.use_table 대체도 적용됨)
+    return lambda: get_table(PLAN_SINGLE_FLIGHT_TABLE)
+
+
+def get_single_flight():
+    """컨테이너 단위로 공유되는 SingleFlight. PLAN_SINGLE_FLIGHT_TABLE이 없으면 None."""
+    global _single_flight
+    if not PLAN_SINGLE_FLIGHT_TABLE:
+        return None
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight(_create_table_factory())
+    return _single_flight
@@ -0,0 +1,98 @@
+import json
+import os
+import zlib
+from decimal import Decimal
+
+from gemini_client import build_envelope, chunk_text
+from plan_json import extract_json
+
+# 계획 저장 형식 (Python Lambda Layer)
+# 예전 형식: plan_data = Gemini 응답 envelope 전체 (candidates/safetyRatings/usageMetadata)를 DynamoDB map으로 저장하고,
+#           실제 계획은 candidates[0].content.parts[0].text 안의 JSON 문자열 -> 읽을 때마다 다시 파싱
+# 압축 형식: plan_blob (B) = 헤더 4바이트 + 파싱/검증된 계획 JSON(공백 없음)을 zlib 압축
+#           헤더: b'TP' + 형식 버전(1) + 압축 방식(1 = zlib)
+#           목록 화면용 요약 속성: plan_title, plan_day_count, start_date, end_date
+# 계획 JSON을 파싱할 수 없으면(복구 실패) 내용을 잃지 않도록 예전 형식으로 저장한다.
+# 읽는 쪽: read_plan(item) / plan_envelope(item) (Node 로더는 load_web.mjs, load_mobile.mjs의 decodePlanBlob)
+# 기존 항목 변환: serverless/tools/migrate_plan_storage.py
+#
+# PLAN_STORAGE_FORMAT=envelope 이면 예전 형식으로 저장 (로더 배포 전 롤백용)
+
+PLAN_STORAGE_FORMAT = os.environ.get('PLAN_STORAGE_FORMAT', 'compact').lower()
+
+PLAN_BLOB_MAGIC = b'TP'
+PLAN_BLOB_VERSION = 1
+CODEC_ZLIB = 1
+_HEADER_SIZE = 4
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError(f'{type(value).__name__}은(는) JSON으로 변환할 수 없습니다')
+
+
+def encode_plan(plan):
+    """계획(dict) -> plan_blob 바이트."""
+    text = json.dumps(plan, ensure_ascii=False, separators=(',', ':'), default=_json_default)
+    header = PLAN_BLOB_MAGIC + bytes([PLAN_BLOB_VERSION, CODEC_ZLIB])
+    return header + zlib.compress(text.encode('utf-8'), 6)
+
+
+def decode_plan(blob, parse_float=Decimal):
+    """plan_blob(bytes 또는 boto3 Binary) -> 계획(dict). 숫자는 DynamoDB에 다시 쓸 수 있도록 기본 Decimal."""
+    data = bytes(getattr(blob, 'value', blob))
+    if len(data) < _HEADER_SIZE or data[:2] != PLAN_BLOB_MAGIC:
+        raise ValueError('plan_blob 헤더가 올바르지 않습니다')
+    version, codec = data[2], data[3]
+    if version != PLAN_BLOB_VERSION or codec != CODEC_ZLIB:
+        raise ValueError(f'지원하지 않는 plan_blob 형식입니다 (버전 {version}, 압축 {codec})')
+    return json.loads(zlib.decompress(data[_HEADER_SIZE:]).decode('utf-8'), parse_float=parse_float)
+
+
+def plan_summary(plan, start_date=None, end_date=None):
+    """목록/검색에 쓰는 요약 속성. 날짜는 요청 값이 있으면 그것을, 없으면 계획의 첫/마지막 날짜를 사용."""
+    days = plan.get('days') if isinstance(plan, dict) else None
+    days = days if isinstance(days, list) else []
+    dates = [day.get('date') for day in days if isinstance(day, dict) and day.get('date')]
+    summary = {
+        'plan_title': plan.get('title') if isinstance(plan, dict) else None,
+        'plan_day_count': len(days),
+        'start_date': start_date or (dates[0] if dates else None),
+        'end_date': end_date or (dates[-1] if dates else None),
+    }
+    return {key: value for key, value in summary.items() if value not in (None, '')}
+
+
+def plan_item_attributes(gemini_result, plan, start_date=None, end_date=None):
+    """save_item에 넣을 계획 속성. plan은 normalize_envelope_text가 파싱한 값 (실패했으면 None)."""
+    if PLAN_STORAGE_FORMAT != 'compact' or not isinstance(plan, dict):
+        return {'plan_data': gemini_result}
+    return dict(plan_summary(plan, start_date, end_date), plan_blob=encode_plan(plan))
+
+
+def plan_body_attributes(plan):
+    """Gemini 응답 없이 계획(dict)만 있을 때(수정 결과) 저장할 본문 속성."""
+    if PLAN_STORAGE_FORMAT != 'compact':
+        return {'plan_data': build_envelope(json.dumps(plan, ensure_ascii=False, default=_json_default))}
+    return {'plan_blob': encode_plan(plan)}
+
+
+def read_plan(item, parse_float=Decimal):
+    """저장된 항목에서 계획(dict)을 꺼냄 (두 형식 모두). 없거나 파싱할 수 없으면 None."""
+    if item.get('plan_blob') is not None:
+        return decode_plan(item['plan_blob'], parse_float)
+    if item.get('plan_data'):
+        try:
+            return extract_json(chunk_text(item['plan_data']), parse_float=parse_float)[0]
+        except ValueError:
+            return None
+    return None
+
+
+def plan_envelope(item):
+    """API 응답용 plan_data (예전 형식과 같은 envelope 구조). 클라이언트는 형식 변경을 알 필요가 없다."""
+    if item.get('plan_blob') is None:
+        return item.get('plan_data')
+    text = json.dumps(decode_plan(item['plan_blob'], parse_float=None), ensure_ascii=False)
+    return build_envelope(text)
@@ -0,0 +1,80 @@
+import os
+import time
+
+from plan_storage import plan_summary
+
+# 계획 목록 요약 인덱스 (Python Lambda Layer)
+# "내 계획" 목록은 계획 본문(plan_blob/plan_data)과 항공편/숙박 원본을 읽을 필요가 없다.
+# 생성/수정 람다가 항목에 요약 속성을 함께 쓰고, travel-plans 테이블의 희소(sparse) GSI가 그 속성만 투영한다.
+#   GSI: PLAN_SUMMARY_INDEX (기본 PlanSummaryIndex), 파티션 키 user_id, 정렬 키 summary_updated_at (S)
+#        프로젝션 INCLUDE = SUMMARY_ATTRIBUTES (+ 테이블 키 planId)
+#   summary_updated_at이 있는 항목만 인덱스에 들어가므로 예전 항목은 serverless/tools/backfill_plan_summary.py로 채운다.
+# 요약 속성이 본 항목에 있으므로 별도 요약 항목을 맞춰 쓸 필요가 없고, 같은 put_item/update_item으로 함께 바뀐다.
+# 목록 조회: load_web/load_mobile의 {"list": true, "limit": 20, "cursor": ...} (인덱스 Query 한 번, 계획당 수백 바이트)
+
+PLAN_SUMMARY_INDEX = os.environ.get('PLAN_SUMMARY_INDEX', 'PlanSummaryIndex')
+
+SUMMARY_SORT_ATTRIBUTE = 'summary_updated_at'
+# GSI에 투영하는 속성 (키 제외)
+SUMMARY_ATTRIBUTES = ('plan_title', 'plan_day_count', 'start_date', 'end_date', 'destination',
+                      'thumbnail_city_code', 'paid_plan')
+
+
+def summary_timestamp(now=None):
+    """인덱스 정렬 키 (UTC ISO 8601, 밀리초). 최근 생성/수정한 계획이 먼저 나온다."""
+    now = time.time() if now is None else now
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(now)) + f'.{int(now * 1000) % 1000:03d}Z'
+
+
+def _flight_destination(flight):
+    """항공편(Amadeus offer 또는 예전 변환 형식)의 (도착지 이름, 도시 코드)."""
+    if not isinstance(flight, dict):
+        return None, None
+    itineraries = flight.get('itineraries')
+    if itineraries:
+        segments = (itineraries[0] or {}).get('segments') or []
+        arrival = (segments[-1] or {}).get('arrival', {}) if segments else {}
+        airport_info = arrival.get('airportInfo') or {}
+        code = arrival.get('cityCode') or airport_info.get('cityCode') or arrival.get('iataCode')
+        return airport_info.get('koreanName') or code, code
+    code = flight.get('destinationCode')
+    return flight.get('destinationName') or code, code
+
+
+def _accommodation_destination(accommodation):
+    """숙박(Booking.com 호텔 객체)의 도시 이름."""
+    if not isinstance(accommodation, dict):
+        return None
+    hotel = accommodation.get('hotel') or {}
+    return hotel.get('city_trans') or hotel.get('city_name_en') or hotel.get('city') or None
+
+
+def trip_destination(flights=None, accommodations=None):
+    """(목적지 이름, 썸네일 도시 코드). 첫 출국편의 도착지, 없으면 첫 숙박의 도시."""
+    destination, city_code = None, None
+    for flight in flights or []:
+        destination, city_code = _flight_destination(flight)
+        if destination:
+            break
+    if not destination:
+        for accommodation in accommodations or []:
+            destination = _accommodation_destination(accommodation)
+            if destination:
+                break
+    return destination, city_code
+
+
+def summary_attributes(plan, flights=None, accommodations=None, start_date=None, end_date=None, paid_plan=0,
+                       now=None):
+    """save_item에 넣을 목록 요약 속성 + 인덱스 정렬 키. plan을 파싱하지 못했으면(None) 날짜/목적지만."""
+    attributes = plan_summary(plan if isinstance(plan, dict) else {}, start_date, end_date)
+    if not isinstance(plan, dict):
+        attributes.pop('plan_day_count', None)  # 일수를 알 수 없음 (0일로 표시하지 않도록)
+    destination, city_code = trip_destination(flights, accommodations)
+    if destination:
+        attributes['destination'] = destination
+    if city_code:
+        attributes['thumbnail_city_code'] = city_code
+    attributes['paid_plan'] = paid_plan
+    attributes[SUMMARY_SORT_ATTRIBUTE] = summary_timestamp(now)
+    return attributes
@@ -0,0 +1,191 @@
+from booking_artifacts import resolve_booking_refs, stored_bookings
+from lambda_runtime import get_table
+from local_dynamodb import is_conditional_check_failed
+from plan_overflow import PLAN_OVERFLOW_THRESHOLD_BYTES, get_overflow_store, item_size, overflow_store_for, restore_overflow
+from plan_storage import plan_body_attributes, read_plan
+from plan_summary_index import summary_attributes
+
+# 계획 버전 (서버에서 읽어 수정하고 조건부 쓰기로 저장, Python Lambda Layer)
+# 예전 수정 흐름: 클라이언트가 현재 계획 전체(travel_plans, flightOfferDetails/hotelDetails가 든 일정, 항공편/숙박 원본)를
+#                WebSocket -> SQS로 보내고 modifyPlanAsync는 결과를 저장하지 않음 (메시지 수백 KB)
+# 새 흐름: 클라이언트는 {planId, planVersion, need}만 보내고 modifyPlanAsync가 travel-plans에서 현재 버전을 읽어
+#         수정한 뒤 plan_version을 1 올려 같은 항목에 저장한다 (본문 + 목록 요약 속성).
+#         조건식 plan_version = :expected (낙관적 동시성): 그 사이 다른 수정이 먼저 저장되었으면 PlanVersionConflict
+# plan_version: 생성 시 1, 이 속성이 없는 예전 항목은 0으로 본다.
+# 다른 사용자의 계획은 없는 계획과 같이 처리한다 (planId 존재 여부를 알려주지 않음).
+# 새 버전을 더한 항목이 오프로드 기준(PLAN_OVERFLOW_THRESHOLD_BYTES)을 넘으면 큰 속성(보통 새 본문)을 버전별 S3 키에
+# 올리고 같은 update_item으로 항목에서 지우고 overflow 포인터를 바꾼다 (Gemini 호출 뒤 400KB 한도로 저장이 실패하지 않도록).
+# 버전별 키라 조건부 쓰기가 실패해도 현재 버전의 객체는 그대로이며, 다시 쓰거나 지운 속성의 예전 객체는 저장에 성공한 뒤 삭제한다.
+
+PLAN_TABLE = 'travel-plans'
+INITIAL_PLAN_VERSION = 1
+
+
+class PlanRequestError(Exception):
+    """재시도해도 결과가 같은 수정 요청 오류. 클라이언트에 알리고 재시도/DLQ 없이 끝낸다."""
+    code = 'plan_request_error'
+    client_message = '여행 계획을 수정할 수 없습니다.'
+
+    def payload(self):
+        return {'code': self.code, 'message': self.client_message}
+
+
+class PlanNotFoundError(PlanRequestError):
+    code = 'plan_not_found'
+    client_message = '수정할 여행 계획을 찾을 수 없습니다.'
+
+
+class PlanUnreadableError(PlanRequestError):
+    code = 'plan_unreadable'
+    client_message = '저장된 여행 계획을 읽을 수 없어 수정할 수 없습니다.'
+
+
+class PlanVersionConflict(PlanRequestError):
+    code = 'plan_version_conflict'
+    client_message = '다른 곳에서 여행 계획이 먼저 수정되었습니다. 계획을 다시 불러온 뒤 수정해 주세요.'
+
+    def __init__(self, plan_id, expected_version, current_version):
+        super().__init__(f'계획 {plan_id} 버전 충돌 (요청 {expected_version}, 현재 {current_version})')
+        self.expected_version = expected_version
+        self.current_version = current_version
+
+    def payload(self):
+        return dict(super().payload(), currentVersion=self.current_version)
+
+
+def stored_version(item):
+    return int(item.get('plan_version', 0))
+
+
+class StoredPlan:
+    """수정할 계획의 현재 버전 (travel-plans 항목에서 읽은 값)."""
+
+    def __init__(self, plan_id, user_id, version, plan, item, stored_item):
+        self.plan_id = plan_id
+        self.user_id = user_id
+        self.version = version
+        self.plan = plan
+        self.flights, self.accommodations = stored_bookings(item)
+        self.is_round_trip = bool(item.get('is_round_trip', False))
+        self.start_date = item.get('start_date')
+        self.end_date = item.get('end_date')
+        self.paid_plan = item.get('paid_plan', 0)
+        self.stored_item = stored_item  # 복원 전 항목 (저장 후 항목 크기 추정, 예전 overflow 포인터)
+
+    def modify_request(self):
+        """modifyPlanAsync가 클라이언트에게 받던 형식 (plans.travel_plans/day_order, flightInfos, accommodationInfos)."""
+        days = [day for day in self.plan.get('days') or [] if isinstance(day, dict)]
+        travel_plans, day_order = {}, []
+        for index, day in enumerate(days):
+            day_key = str(day.get('day') or index + 1)
+            travel_plans[day_key] = {'title': day.get('title') or f'{day_key}일차', 'schedules': day.get('schedules') or []}
+            day_order.append(day_key)
+        start_date = self.start_date or (days[0].get('date') if days else None)
+        plans = {'planId': self.plan_id, 'title': self.plan.get('title'), 'day_order': day_order,
+                 'travel_plans': travel_plans}
+        if start_date:
+            plans['start_date'] = start_date
+        return {'plans': plans, 'flightInfos': self.flights, 'accommodationInfos': self.accommodations,
+                'isRoundTrip': self.is_round_trip}
+
+
+def load_plan(plan_id, user_id, expected_version=None):
+    """travel-plans에서 수정할 계획을 읽음. expected_version이 있으면 저장된 버전과 같은지 먼저 확인."""
+    item = get_table(PLAN_TABLE).get_item(Key={'planId': plan_id}, ConsistentRead=True).get('Item')
+    if not item or item.get('user_id') != user_id:
+        raise PlanNotFoundError(f'계획 {plan_id}이(가) 없거나 {user_id}의 계획이 아닙니다')
+    version = stored_version(item)
+    if expected_version is not None and int(expected_version) != version:
+        raise PlanVersionConflict(plan_id, expected_version, version)
+    stored_item = dict(item)
+    item = resolve_booking_refs(restore_overflow(item))
+    plan = read_plan(item)
+    if not isinstance(plan, dict):
+        raise PlanUnreadableError(f'계획 {plan_id}의 본문을 파싱할 수 없습니다')
+    return StoredPlan(plan_id, user_id, version, plan, item, stored_item)
+
+
+def _offload_attributes(stored, attributes, removed, next_version):
+    """저장 후 항목이 오프로드 기준을 넘으면 큰 속성부터 S3에 올림.
+    반환: (새 overflow 포인터 또는 None, 이번에 올린 포인터 항목, 저장 후 가리키지 않을 예전 포인터 항목)"""
+    old_pointer = stored.stored_item.get('overflow') or {}
+    old_refs = old_pointer.get('attributes') or {}
+    # 다시 쓰거나 지우는 속성의 예전 객체는 새 포인터에서 빠짐 (항목의 값이 포인터보다 우선하지만 객체가 남지 않도록)
+    stale = {name: ref for name, ref in old_refs.items() if name in attributes or name in removed}
+    kept = {name: ref for name, ref in old_refs.items() if name not in stale}
+
+    merged = {name: value for name, value in stored.stored_item.items() if name not in removed}
+    merged.update(attributes)
+    store = get_overflow_store()
+    threshold = store.threshold_bytes if store else PLAN_OVERFLOW_THRESHOLD_BYTES
+    uploaded = {}
+    if item_size(merged) > threshold:
+        if store is None:
+            print(f"[PlanVersions] 계획 {stored.plan_id} 항목 크기 {item_size(merged):,} bytes가 기준을 넘지만 "
+                  f"PLAN_OVERFLOW_BUCKET이 없어 그대로 저장합니다")
+        else:
+            uploaded = store.upload(merged, store.select(merged), version=next_version)
+            print(f"[PlanVersions] 계획 {stored.plan_id} 항목 크기 {item_size(merged):,} bytes, "
+                  f"S3로 옮긴 속성: {list(uploaded)}")
+    if uploaded and kept and old_pointer.get('bucket') != store.bucket:
+        # 포인터는 버킷 하나만 가리키므로 남길 예전 객체가 다른 버킷에 있으면 속성을 항목에 그대로 둔다
+        print(f"[PlanVersions] 예전 오프로드 버킷이 달라 항목에 그대로 저장합니다: {old_pointer.get('bucket')}")
+        store.delete(uploaded.values())
+        uploaded = {}
+    refs = dict(kept, **uploaded)
+    pointer = None
+    if refs:
+        pointer = {'bucket': store.bucket if uploaded else old_pointer.get('bucket'), 'attributes': refs}
+    return pointer, uploaded, stale
+
+
+def save_plan_version(stored, plan):
+    """수정한 계획을 다음 버전으로 저장하고 새 버전 번호를 반환. 그 사이 다른 버전이 저장되었으면 PlanVersionConflict."""
+    next_version = stored.version + 1
+    attributes = plan_body_attributes(plan)
+    attributes.update(summary_attributes(plan, stored.flights, stored.accommodations, stored.start_date,
+                                         stored.end_date, paid_plan=stored.paid_plan))
+    attributes['plan_version'] = next_version
+    # 다른 본문 형식으로 남아 있던 값은 지움
+    removed = ['plan_data' if 'plan_blob' in attributes else 'plan_blob']
+
+    pointer, uploaded, stale = _offload_attributes(stored, attributes, removed, next_version)
+    for name in uploaded:
+        attributes.pop(name, None)
+        removed.append(name)  # 항목에 남은 값이 S3의 값보다 우선하지 않도록
+    if pointer:
+        attributes['overflow'] = pointer
+    elif 'overflow' in stored.stored_item:
+        removed.append('overflow')
+
+    names = {f'#a{index}': name for index, name in enumerate(attributes)}
+    values = {f':a{index}': value for index, value in enumerate(attributes.values())}
+    names.update({f'#r{index}': name for index, name in enumerate(removed)})
+    values[':user_id'] = stored.user_id
+    condition = 'user_id = :user_id AND '
+    if stored.version:
+        condition += 'plan_version = :expected'
+        values[':expected'] = stored.version
+    else:
+        condition += 'attribute_not_exists(plan_version)'
+
+    table = get_table(PLAN_TABLE)
+    try:
+        table.update_item(
+            Key={'planId': stored.plan_id},
+            UpdateExpression='SET ' + ', '.join(f'#a{index} = :a{index}' for index in range(len(attributes)))
+                             + ' REMOVE ' + ', '.join(f'#r{index}' for index in range(len(removed))),
+            ConditionExpression=condition,
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values,
+        )
+    except Exception as e:
+        if uploaded:
+            get_overflow_store().delete(uploaded.values())  # 저장되지 않은 버전의 객체
+        if not is_conditional_check_failed(e):
+            raise
+        current = table.get_item(Key={'planId': stored.plan_id}, ConsistentRead=True).get('Item') or {}
+        raise PlanVersionConflict(stored.plan_id, stored.version, stored_version(current)) from None
+    if stale:
+        overflow_store_for(stored.stored_item['overflow'].get('bucket')).delete(stale.values())
+    return next_version
@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from lambda_runtime import get_client
+
+# SQS 배치 동시 처리 (Python Lambda Layer)
+# SQS 트리거 람다가 event['Records']를 하나씩 처리하면 배치 안의 두 번째 사용자가 첫 번째 사용자의 Gemini 호출을 통째로 기다린다.
+# 레코드별 처리 함수를 제한된 스레드 풀에서 동시에 실행하고, 람다 남은 시간 안에서만 작업한다.
+# - 레코드마다 독립된 시간 측정/오류 처리 (한 레코드의 예외가 다른 레코드에 영향 없음)
+# - 마감(남은 시간 - SQS_BATCH_SAFETY_MARGIN_SECONDS) 이후에는 새 레코드를 시작하지 않음
+# - 마감 이후에는 아직 시작 전인 레코드만 취소하고, 진행 중인 레코드는 람다 종료 직전까지 기다림
+#   (처리 함수의 블로킹 호출은 time_left(deadline)으로 제한되므로 보통 여유 시간 안에 끝남)
+# - 그래도 끝나지 않은 레코드는 포기로 표시: 스레드가 다음 호출에서 다시 깨어나도 ensure_record_active()에서 멈춰
+#   다시 전달된 메시지와 겹쳐 저장/전송하지 않음 (처리 함수는 부수 효과가 있는 단계 직전에 호출)
+# - 일시적 오류로 실패했거나 마감까지 끝나지 않은 레코드만 batchItemFailures로 보고해 다시 받음
+#   (이벤트 소스 매핑에 ReportBatchItemFailures 설정 필요)
+# - 영구 오류(잘못된 메시지 등)와 SQS_MAX_ATTEMPTS번 시도한 레코드는 재시도하지 않고 바로 DLQ(SQS_DLQ_URL)로 보냄
+
+SQS_BATCH_MAX_WORKERS = int(os.environ.get('SQS_BATCH_MAX_WORKERS', '4'))
+SQS_BATCH_SAFETY_MARGIN_SECONDS = float(os.environ.get('SQS_BATCH_SAFETY_MARGIN_SECONDS', '10'))
+# 마감 이후 진행 중인 레코드를 기다릴 때 람다 종료 전에 남겨 둘 시간 (응답 반환용)
+SQS_BATCH_RETURN_MARGIN_SECONDS = 1.0
+SQS_MAX_ATTEMPTS = int(os.environ.get('SQS_MAX_ATTEMPTS', '3'))
+SQS_DLQ_URL = os.environ.get('SQS_DLQ_URL')
+
+# 잠시 후 다시 시도하면 성공할 수 있는 AWS 오류 코드
+_RETRYABLE_AWS_ERROR_CODES = (
+    'ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded',
+    'TooManyRequestsException', 'InternalServerError', 'ServiceUnavailable',
+    'LimitExceededException',  # API Gateway Management API (post_to_connection) 스로틀링
+)
+
+# 레코드 처리 결과 상태
+RECORD_SUCCEEDED = 'succeeded'
+RECORD_FAILED = 'failed'
+RECORD_NOT_STARTED = 'not_started'  # 마감 이후라 시작하지 않음
+RECORD_TIMED_OUT = 'timed_out'  # 마감까지 끝나지 않음
+
+
+class RetryableRecordError(Exception):
+    """다시 받아 처리해야 하는 레코드 실패. 처리 함수가 던지면 batchItemFailures로 보고된다."""
+
+
+class RecordAbandonedError(Exception):
+    """마감까지 끝나지 않아 배치가 포기한 레코드. 다시 전달된 메시지가 처리하므로 아무것도 쓰지 않고 끝낸다."""
+
+
+# 현재 스레드가 처리 중인 레코드의 포기 표시 (process_records 밖에서 호출하면 없음)
+_record_state = threading.local()
+
+
+def ensure_record_active():
+    """배치가 이 레코드를 포기했으면 RecordAbandonedError. 저장/전송 같은 부수 효과 직전에 호출."""
+    abandoned = getattr(_record_state, 'abandoned', None)
+    if abandoned is not None and abandoned.is_set():
+        raise RecordAbandonedError('마감 시간까지 끝나지 않아 배치가 포기한 레코드입니다')
+
+
+def record_abandoned():
+    """ensure_record_active와 같지만 예외 대신 bool (오류 알림 전송 등 실패 경로에서 사용)."""
+    abandoned = getattr(_record_state, 'abandoned', None)
+    return abandoned is not None and abandoned.is_set()
+
+
+class RecordResult:
+    def __init__(self, record):
+        self.record = record
+        self.message_id = record.get('messageId')
+        self.status = RECORD_NOT_STARTED
+        self.error = None
+        self.started_at = None
+        self.duration = None
+
+
+def batch_deadline(context, safety_margin=SQS_BATCH_SAFETY_MARGIN_SECONDS):
+    """레코드 처리를 끝내야 하는 시각(time.time() 기준). context가 없으면(로컬 실행) 15분."""
+    remaining_ms = context.get_remaining_time_in_millis() if context else 15 * 60 * 1000
+    return time.time() + remaining_ms / 1000 - safety_margin
+
+
+def time_left(deadline, cap=None):
+    """마감까지 남은 초. cap이 있으면 그 값을 넘지 않음 (Gemini 호출 타임아웃 등에 사용).
+    소켓 타임아웃 0은 non-blocking이 되므로 최소 1초."""
+    left = max(1.0, deadline - time.time())
+    return min(left, cap) if cap is not None else left
+
+
+def receive_count(record):
+    """이 메시지를 받은 횟수 (첫 시도면 1)."""
+    try:
+        return int((record.get('attributes') or {}).get('ApproximateReceiveCount', '1'))
+    except (TypeError, ValueError):
+        return 1
+
+
+def is_retryable_error(error):
+    """일시적 오류(타임아웃, 연결 오류, 429/5xx, AWS 스로틀링) 여부. 다른 예외로 감싼 원인까지 확인."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, (RetryableRecordError, TimeoutError, ConnectionError)):
+            return True
+        if getattr(error, 'retryable', False) is True:  # GeminiAPIError
+            return True
+        response = getattr(error, 'response', None)
+        if isinstance(response, dict) and response.get('Error', {}).get('Code') in _RETRYABLE_AWS_ERROR_CODES:
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def should_retry(record, error):
+    """실패한 레코드를 SQS에 다시 맡길지 여부. 일시적 오류이고 시도 횟수가 SQS_MAX_ATTEMPTS 미만일 때만."""
+    return is_retryable_error(error) and receive_count(record) < SQS_MAX_ATTEMPTS
+
+
+def send_to_dead_letter_queue(record, reason, label='SQS'):
+    """다시 처리해도 성공할 수 없는 메시지를 DLQ로 보냄 (원본 본문 + 실패 사유). SQS_DLQ_URL이 없으면 로그만 남김."""
+    reason_text = f"{type(reason).__name__}: {str(reason)}" if isinstance(reason, Exception) else str(reason)
+    if not SQS_DLQ_URL:
+        print(f"[{label}] SQS_DLQ_URL 미설정, 메시지를 버립니다 ({record.get('messageId')}): {reason_text}")
+        return False
+    get_client('sqs').send_message(
+        QueueUrl=SQS_DLQ_URL,
+        MessageBody=record.get('body') or '',
+        MessageAttributes={
+            'failureReason': {'DataType': 'String', 'StringValue': reason_text[:1000]},
+            'sourceMessageId': {'DataType': 'String', 'StringValue': str(record.get('messageId'))},
+            'receiveCount': {'DataType': 'Number', 'StringValue': str(receive_count(record))},
+        },
+    )
+    print(f"[{label}] DLQ로 보냄 ({record.get('messageId')}, 시도 {receive_count(record)}회): {reason_text}")
+    return True
+
+
+def process_records(records, handle_record, context, max_workers=SQS_BATCH_MAX_WORKERS, label='SQS'):
+    """handle_record(record, deadline)를 레코드별로 동시에 실행하고 레코드별 RecordResult 목록을 반환.
+
+    handle_record가 예외를 던지면 해당 레코드만 실패로 기록한다 (RetryableRecordError로 다시 받을 레코드를 알림).
+    레코드가 하나면 스레드 없이 바로 실행.
+    마감 이후에는 진행 중인 레코드를 람다 종료 직전까지 기다리고, 그래도 끝나지 않으면 포기로 표시한다.
+    """
+    deadline = batch_deadline(context)
+    hard_deadline = batch_deadline(context, safety_margin=SQS_BATCH_RETURN_MARGIN_SECONDS)
+    results = [RecordResult(record) for record in records]
+    if not results:
+        return results
+    batch_start_time = time.time()
+
+    def run(result, abandoned):
+        if time.time() >= deadline:
+            print(f"[{label}] 마감 시간이 지나 레코드를 시작하지 않음: {result.message_id}")
+            return
+        result.started_at = time.time()
+        _record_state.abandoned = abandoned
+        try:
+            handle_record(result.record, deadline)
+            result.status = RECORD_SUCCEEDED
+        except Exception as e:
+            result.status = RECORD_FAILED
+            result.error = e
+            print(f"[{label}] 레코드 처리 실패 ({result.message_id}): {type(e).__name__}: {str(e)}")
+        finally:
+            _record_state.abandoned = None
+            if not abandoned.is_set():
+                result.duration = time.time() - result.started_at
+
+    workers = max(1, min(max_workers, len(results)))
+    if workers == 1:
+        for result in results:
+            run(result, threading.Event())
+    else:
+        abandoned = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sqs-record')
+        futures = [executor.submit(run, result, abandoned) for result in results]
+        _, not_done = wait(futures, timeout=time_left(deadline))
+        if not_done:
+            # 아직 시작 전인 레코드는 취소하고, 진행 중인 레코드는 람다 종료 직전까지 기다림
+            executor.shutdown(wait=False, cancel_futures=True)
+            print(f"[{label}] 마감 시간이 지나 진행 중인 레코드를 기다립니다: {len(not_done)}개")
+            _, not_done = wait(futures, timeout=max(0.0, hard_deadline - time.time()))
+        if not_done:
+            # 그래도 끝나지 않은 스레드는 다음 호출에서 깨어나도 저장/전송 전에 멈춤 (ensure_record_active)
+            abandoned.set()
+            for result in results:
+                if result.started_at is not None and result.duration is None:
+                    result.status = RECORD_TIMED_OUT
+                    print(f"[{label}] 마감 시간까지 끝나지 않은 레코드: {result.message_id}")
+        executor.shutdown(wait=not not_done)
+
+    summary = {}
+    for result in results:
+        summary[result.status] = summary.get(result.status, 0) + 1
+    slowest = max((result.duration or 0 for result in results), default=0)
+    print(f"[{label}] 배치 처리 완료: 레코드 {len(results)}개, 동시 처리 {workers}, 결과 {summary}, "
+          f"전체 {time.time() - batch_start_time:.2f}초 (가장 느린 레코드 {slowest:.2f}초)")
+    return results
+
+
+def batch_item_failures(results):
+    """SQS 부분 배치 응답. 성공하지 못한 레코드(실패, 마감 초과, 시작 못 함)만 다시 받는다."""
+    return [{'itemIdentifier': result.message_id} for result in results
+            if result.status != RECORD_SUCCEEDED and result.message_id]
@@ -0,0 +1,182 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+import secrets
+import threading
+import time
+
+from lambda_runtime import get_websocket_client
+from sqs_batch import is_retryable_error
+
+# WebSocket 전송 계층: 연결 생존 확인 + 큰 메시지 분할 전송 (Python Lambda Layer)
+# 클라이언트가 창을 닫거나 연결이 끊긴 뒤에도 워커는 60~120초짜리 Gemini 호출을 끝내고 끊긴 연결에 계속 전송을 시도한다.
+# 마지막 전송 결과(GoneException)와 get_connection 조회로 연결 상태를 기억하여
+# - 끊긴 연결에는 더 이상 보내지 않고 (모든 정책 공통)
+# - WS_DISCONNECT_POLICY='persist'(기본): 생성/저장은 끝까지 진행 (다시 접속하면 ID로 조회 가능)
+# - WS_DISCONNECT_POLICY='cancel': 비싼 단계 전/스트리밍 중에 연결이 끊긴 것을 알면 Gemini 호출을 중단 (ConnectionGoneError)
+#
+# 큰 메시지 분할 전송: API Gateway WebSocket은 메시지 하나가 128KB를 넘으면 전달하지 못한다 (긴 여행의 plan_modified 등).
+# WS_MESSAGE_MAX_BYTES를 넘는 메시지는 gzip + base64로 인코딩한 뒤 조각내어
+# frame_manifest(조각 수, 원본 길이, sha256) 한 개와 frame_chunk(seq, data) 여러 개를 순서대로 보낸다.
+# 한도 이하의 메시지는 기존과 같이 그대로 보낸다. 클라이언트 재조립 규칙은 Lambda_Layer/README.md 참고
+
+WS_DISCONNECT_POLICY = os.environ.get('WS_DISCONNECT_POLICY', 'persist').lower()
+WS_LIVENESS_CHECK_SECONDS = float(os.environ.get('WS_LIVENESS_CHECK_SECONDS', '10'))
+WS_MESSAGE_MAX_BYTES = int(os.environ.get('WS_MESSAGE_MAX_BYTES', '120000'))
+WS_FRAME_COMPRESSION = os.environ.get('WS_FRAME_COMPRESSION', 'true').lower() == 'true'
+WS_POST_MAX_ATTEMPTS = int(os.environ.get('WS_POST_MAX_ATTEMPTS', '3'))
+WS_POST_RETRY_BASE_SECONDS = float(os.environ.get('WS_POST_RETRY_BASE_SECONDS', '0.2'))
+
+DISCONNECT_PERSIST = 'persist'
+DISCONNECT_CANCEL = 'cancel'
+
+FRAME_MANIFEST = 'frame_manifest'
+FRAME_CHUNK = 'frame_chunk'
+_CHUNK_OVERHEAD_BYTES = 256  # frame_chunk 프레임에서 data 외 필드(action, frameId, seq)가 차지하는 여유분
+
+# connectionId는 재사용되지 않으므로 오래된 기록은 정리 (warm 컨테이너에서 무한히 쌓이지 않도록)
+_TRACK_SECONDS = 3600
+_MAX_TRACKED = 1000
+
+_gone = {}  # connectionId -> 끊긴 것을 알게 된 시각
+_alive_at = {}  # connectionId -> 마지막으로 살아 있음을 확인한 시각 (전송 성공 또는 get_connection)
+_lock = threading.Lock()
+
+
+class ConnectionGoneError(Exception):
+    """cancel 정책에서 클라이언트 연결이 끊겨 생성을 중단한 경우."""
+
+    def __init__(self, connection_id):
+        super().__init__(f"클라이언트 연결이 끊어져 생성을 중단했습니다: {connection_id}")
+        self.connection_id = connection_id
+
+
+def is_gone_error(error):
+    """post_to_connection/get_connection의 GoneException(410) 여부."""
+    response = getattr(error, 'response', None) or {}
+    return response.get('Error', {}).get('Code') == 'GoneException'
+
+
+def _prune(records, now):
+    if len(records) > _MAX_TRACKED:
+        for connection_id, marked_at in list(records.items()):
+            if now - marked_at > _TRACK_SECONDS:
+                records.pop(connection_id, None)
+
+
+def mark_gone(connection_id):
+    now = time.time()
+    with _lock:
+        _gone[connection_id] = now
+        _alive_at.pop(connection_id, None)
+        _prune(_gone, now)
+
+
+def mark_alive(connection_id):
+    now = time.time()
+    with _lock:
+        _alive_at[connection_id] = now
+        _prune(_alive_at, now)
+
+
+def is_connection_gone(connection_id):
+    """이미 끊긴 것으로 알려진 연결인지 (API 호출 없음)."""
+    return connection_id in _gone
+
+
+def check_connection(connection_id):
+    """연결이 살아 있으면 True. WS_LIVENESS_CHECK_SECONDS 안에 확인한 결과는 다시 조회하지 않음."""
+    if is_connection_gone(connection_id):
+        return False
+    if time.time() - _alive_at.get(connection_id, 0) < WS_LIVENESS_CHECK_SECONDS:
+        return True
+    apigw_management_client = get_websocket_client()
+    if not apigw_management_client:
+        return True
+    try:
+        apigw_management_client.get_connection(ConnectionId=connection_id)
+    except Exception as e:
+        if is_gone_error(e):
+            print(f"[WebSocket] 클라이언트 연결이 끊어짐 ({connection_id}), 이후 전송 생략")
+            mark_gone(connection_id)
+            return False
+        # 확인할 수 없으면(권한, 스로틀링 등) 살아 있는 것으로 보고 진행
+        print(f"[WebSocket] 연결 상태 확인 실패 ({connection_id}): {type(e).__name__} - {e}")
+        return True
+    mark_alive(connection_id)
+    return True
+
+
+def should_cancel(connection_id):
+    """cancel 정책이고 연결이 끊겼으면 True (persist 정책이면 API를 호출하지 않고 False)."""
+    return WS_DISCONNECT_POLICY == DISCONNECT_CANCEL and not check_connection(connection_id)
+
+
+def ensure_connected(connection_id):
+    """비싼 단계 전에 호출. cancel 정책에서 연결이 끊겼으면 ConnectionGoneError."""
+    if should_cancel(connection_id):
+        raise ConnectionGoneError(connection_id)
+
+
+def build_frames(message_json, action=None, max_bytes=WS_MESSAGE_MAX_BYTES, compress=WS_FRAME_COMPRESSION):
+    """직렬화된 메시지를 전송할 프레임(문자열) 목록으로 변환. 한도 이하면 원본 한 개."""
+    raw = message_json.encode('utf-8')
+    if len(raw) <= max_bytes:
+        return [message_json]
+    body = gzip.compress(raw, mtime=0) if compress else raw
+    encoded = base64.b64encode(body).decode('ascii')
+    chunk_size = max_bytes - _CHUNK_OVERHEAD_BYTES
+    chunks = [encoded[start:start + chunk_size] for start in range(0, len(encoded), chunk_size)]
+    frame_id = secrets.token_hex(8)
+    manifest = {
+        'action': FRAME_MANIFEST,
+        'frameId': frame_id,
+        'originalAction': action,
+        'encoding': 'gzip+base64' if compress else 'base64',
+        'chunkCount': len(chunks),
+        'encodedLength': len(encoded),
+        'byteLength': len(raw),
+        'sha256': hashlib.sha256(raw).hexdigest(),  # 압축 해제 후 원본 JSON(UTF-8) 기준
+    }
+    return [json.dumps(manifest)] + [
+        json.dumps({'action': FRAME_CHUNK, 'frameId': frame_id, 'seq': seq, 'data': chunk})
+        for seq, chunk in enumerate(chunks)
+    ]
+
+
+def _post_with_retry(apigw_management_client, connection_id, frame):
+    for attempt in range(1, WS_POST_MAX_ATTEMPTS + 1):
+        try:
+            apigw_management_client.post_to_connection(ConnectionId=connection_id, Data=frame)
+            return
+        except Exception as e:
+            if is_gone_error(e):
+                mark_gone(connection_id)
+                raise
+            # 스로틀링(LimitExceededException)/5xx/연결 오류만 잠시 쉬었다가 같은 프레임을 다시 보냄
+            if attempt >= WS_POST_MAX_ATTEMPTS or not is_retryable_error(e):
+                raise
+            print(f"[WebSocket] 전송 재시도 ({connection_id}): {attempt}회 실패 - {type(e).__name__}")
+            time.sleep(WS_POST_RETRY_BASE_SECONDS * 2 ** (attempt - 1))
+
+
+def post_message(connection_id, message_json, action=None):
+    """직렬화된 메시지 전송 (큰 메시지는 분할). 보냈으면 True, 끊긴 연결이거나 client가 없으면 False.
+    전송 오류는 그대로 올려보내며, GoneException이면 연결을 끊긴 것으로 기록한 뒤 올려보낸다."""
+    if is_connection_gone(connection_id):
+        return False
+    apigw_management_client = get_websocket_client()
+    if not apigw_management_client:
+        print(f"WebSocket 클라이언트가 초기화되지 않아 메시지를 보낼 수 없습니다: Action - {action or 'N/A'}")
+        return False
+    frames = build_frames(message_json, action)
+    if len(frames) > 1:
+        print(f"[WebSocket] 큰 메시지 분할 전송 ({connection_id}): Action - {action or 'N/A'}, "
+              f"{len(message_json.encode('utf-8'))}바이트 -> 조각 {len(frames) - 1}개")
+    # 조각은 순서대로 보내고, 하나라도 실패하면 나머지는 보내지 않음 (클라이언트는 미완성 메시지를 버림)
+    for frame in frames:
+        _post_with_retry(apigw_management_client, connection_id, frame)
+    mark_alive(connection_id)
+    return True
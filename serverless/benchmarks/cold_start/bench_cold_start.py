@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Python Lambda 콜드 스타트 벤치마크
+# 핸들러마다 새 파이썬 프로세스에서 모듈 import(모듈 전역 초기화 포함) 시간과
+# 첫 호출에서 만드는 AWS client/Table 생성 시간을 측정한다. (네트워크 호출 없음, 가짜 자격 증명 사용)
+# --json 으로 결과를 저장해 두고 다음 측정 때 --baseline 으로 넘기면 변화량을 함께 출력한다.
+#
+# 사용법:
+#   python serverless/benchmarks/cold_start/bench_cold_start.py [--repeat 5] [--json 결과.json] [--baseline 이전결과.json]
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVERLESS_DIR = os.path.join(BENCH_DIR, '..', '..')
+LAYER_DIR = os.path.join(SERVERLESS_DIR, 'Lambda_Layer', 'python')
+
+HANDLERS = {
+    'createPlanAsync': 'API gateway_WebSocket/travel/createPlanAsync.py',
+    'modifyPlanAsync': 'API gateway_WebSocket/travel/modifyPlanAsync.py',
+    'create_mobile': 'API gateway_REST/mobile/create_mobile/create_mobile.py',
+    'requestPlanHandler': 'API gateway_WebSocket/handler/requestPlanHandler.py',
+    'requestPlanModificationHandler': 'API gateway_WebSocket/handler/requestPlanModificationHandler.py',
+}
+
+# 자식 프로세스에서 실행: 핸들러 import 후 첫 호출에서 쓰는 client를 만들어 보고 시간(초)을 JSON으로 출력
+CHILD_SCRIPT = r'''
+import importlib.util, json, sys, time
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location('handler', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+imported = time.perf_counter()
+try:
+    import lambda_runtime
+    lambda_runtime.get_websocket_client()
+    lambda_runtime.get_table('travel-plans')
+    clients = time.perf_counter() - imported
+except ImportError:
+    clients = None  # boto3가 설치되지 않은 환경
+print(json.dumps({'import': imported - start, 'clients': clients, 'modules': len(sys.modules)}))
+'''
+
+FAKE_ENV = {
+    'AWS_DEFAULT_REGION': 'ap-northeast-2',
+    'AWS_ACCESS_KEY_ID': 'bench',
+    'AWS_SECRET_ACCESS_KEY': 'bench',
+    'GEMINI_API_KEY': 'bench',
+    'WEBSOCKET_API_ENDPOINT': 'https://example.execute-api.ap-northeast-2.amazonaws.com/bench',
+    'SQS_QUEUE_URL': 'https://sqs.ap-northeast-2.amazonaws.com/000000000000/bench',
+    'MODIFY_PLAN_SQS_QUEUE_URL': 'https://sqs.ap-northeast-2.amazonaws.com/000000000000/bench',
+    'GEMINI_CONTEXT_CACHE_ENABLED': 'false',
+}
+
+
+def measure(handler_path):
+    env = dict(os.environ, **FAKE_ENV)
+    env['PYTHONPATH'] = os.pathsep.join([LAYER_DIR, os.path.dirname(handler_path), env.get('PYTHONPATH', '')])
+    env['PYTHONDONTWRITEBYTECODE'] = '1'
+    completed = subprocess.run([sys.executable, '-c', CHILD_SCRIPT, handler_path], env=env,
+                               capture_output=True, text=True, timeout=120)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else 'unknown error')
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', help='결과를 저장할 파일')
+    parser.add_argument('--baseline', help='비교할 이전 결과 파일')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    results = {}
+    print(f"{'핸들러':<32} {'import(ms)':>10} {'client(ms)':>10} {'합계(ms)':>10} {'모듈 수':>8} {'이전 대비':>10}")
+    for name, relative_path in HANDLERS.items():
+        path = os.path.normpath(os.path.join(SERVERLESS_DIR, relative_path))
+        try:
+            runs = [measure(path) for _ in range(args.repeat)]
+        except Exception as e:
+            print(f"{name:<32} 측정 실패: {str(e)}")
+            continue
+        # 중앙값으로 디스크 캐시 등 잡음을 줄임
+        client_runs = [run['clients'] for run in runs if run['clients'] is not None]
+        result = {
+            'import_ms': statistics.median(run['import'] for run in runs) * 1000,
+            'clients_ms': statistics.median(client_runs) * 1000 if client_runs else None,
+            'modules': runs[-1]['modules'],
+        }
+        result['total_ms'] = result['import_ms'] + (result['clients_ms'] or 0)
+        results[name] = result
+        delta = ''
+        if name in baseline:
+            delta = f"{result['total_ms'] - baseline[name]['total_ms']:+.1f}"
+        clients_text = '-' if result['clients_ms'] is None else f"{result['clients_ms']:.1f}"
+        print(f"{name:<32} {result['import_ms']:>10.1f} {clients_text:>10} {result['total_ms']:>10.1f} "
+              f"{result['modules']:>8} {delta:>10}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n결과 저장: {args.json}")
+
+
+if __name__ == '__main__':
+    main()
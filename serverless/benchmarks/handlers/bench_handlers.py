@@ -0,0 +1,341 @@
+import argparse
+import base64
+import contextlib
+import importlib.util
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+# 핸들러 벤치마크 (로컬 대체 구현 사용, AWS/Gemini 호출 없음)
+# requestPlanHandler -> SQS -> createPlanAsync, requestPlanModificationHandler -> SQS -> modifyPlanAsync,
+# create_mobile(REST)을 같은 프로세스에서 실행하고 시나리오별 처리량, 지연 시간 백분위수, 요청당 메모리 할당을 출력한다.
+# - Gemini: 기록된 응답(responses.jsonl)을 지연 시간을 흉내 내어 돌려주는 로컬 HTTP 서버 (fakes.FakeGeminiServer)
+# - SQS: 접수 람다가 보낸 메시지를 같은 스레드에서 꺼내 워커에 SQS 이벤트로 전달 (fakes.InMemorySQS)
+# - DynamoDB: local_dynamodb.LocalTable / WebSocket: 전송 기록만 남기는 client (fakes.RecordingWebSocket)
+# 지연 시간은 --concurrency 스레드로 --iterations 회 실행해 측정하고, 메모리 할당은 따로 순차 실행하며 tracemalloc으로 잰다.
+# --json 으로 결과를 저장해 두고 다음 측정 때 --baseline 으로 넘기면 p50 변화량을 함께 출력한다.
+#
+# 사용법:
+#   python serverless/benchmarks/handlers/bench_handlers.py [--iterations 20] [--concurrency 4]
+#       [--scenarios text_only,modify] [--gemini-ttfb-ms 200] [--gemini-total-ms 600] [--json 결과.json] [--baseline 이전결과.json]
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVERLESS_DIR = os.path.normpath(os.path.join(BENCH_DIR, '..', '..'))
+LAYER_DIR = os.path.join(SERVERLESS_DIR, 'Lambda_Layer', 'python')
+sys.path.insert(0, LAYER_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fakes import FakeContext, FakeGeminiServer, InMemorySQS, RecordingWebSocket  # noqa: E402
+
+HANDLERS = {
+    'requestPlanHandler': 'API gateway_WebSocket/handler/requestPlanHandler.py',
+    'createPlanAsync': 'API gateway_WebSocket/travel/createPlanAsync.py',
+    'requestPlanModificationHandler': 'API gateway_WebSocket/handler/requestPlanModificationHandler.py',
+    'modifyPlanAsync': 'API gateway_WebSocket/travel/modifyPlanAsync.py',
+    'create_mobile': 'API gateway_REST/mobile/create_mobile/create_mobile.py',
+}
+
+WEBSOCKET_ENDPOINT = 'https://bench.execute-api.local/bench'
+
+# 핸들러 import 전에 설정 (모듈 전역에서 읽는 값). 앞의 것은 벤치마크가 대체 구현을 쓰기 위해 항상 덮어쓰고,
+# 뒤의 것은 기본값만 정함 (예: PLAN_CACHE_ENABLED=true 로 실행하면 캐시 적중 경로를 측정).
+# 반복 요청은 내용이 같으므로 응답 캐시와 single-flight(완료 결과 재사용)는 기본으로 끔
+FORCED_ENV = {
+    'GEMINI_API_KEY': 'bench',
+    'WEBSOCKET_API_ENDPOINT': WEBSOCKET_ENDPOINT,
+    'SQS_QUEUE_URL': 'https://sqs.local/000000000000/createPlanQueue',
+    'MODIFY_PLAN_SQS_QUEUE_URL': 'https://sqs.local/000000000000/modifyPlanQueue',
+    'SQS_DLQ_URL': '',
+    'GEMINI_CONTEXT_CACHE_ENABLED': 'false',
+    'PLAN_SHARDING_ENABLED': 'false',  # 기록된 응답이 전체 계획 하나뿐이라 일차별 병렬 생성은 측정하지 않음
+}
+DEFAULT_ENV = {
+    'PLAN_CACHE_ENABLED': 'false',
+    'PLAN_LEDGER_TABLE': 'local',
+    'PLAN_SINGLE_FLIGHT_TABLE': '',
+    'TRACE_EXPORTER': 'none',
+}
+
+START_DATE = '2025-10-01'
+END_DATE = '2025-10-03'
+
+
+def segment(origin, destination, departure_at, arrival_at, carrier, number, destination_geo):
+    return {
+        'departure': {'iataCode': origin, 'at': departure_at, 'airportInfo': {'koreanName': f'{origin} 공항'}},
+        'arrival': {'iataCode': destination, 'at': arrival_at, 'airportInfo': {'koreanName': f'{destination} 공항'},
+                    'geoCode': {'latitude': destination_geo[0], 'longitude': destination_geo[1]}},
+        'carrierCode': carrier,
+        'number': number,
+    }
+
+
+def flight_offer(origin, destination, departure_at, arrival_at, number, destination_geo):
+    # Amadeus flight offer에서 핸들러가 읽는 필드 + 저장/전송되는 부가 필드
+    return {
+        'type': 'flight-offer',
+        'id': number,
+        'itineraries': [{'duration': 'PT2H30M', 'segments': [
+            segment(origin, destination, departure_at, arrival_at, 'KE', number, destination_geo)]}],
+        'price': {'currency': 'KRW', 'total': '350000', 'grandTotal': '350000'},
+        'travelerPricings': [{'travelerId': '1', 'fareOption': 'STANDARD', 'fareDetailsBySegment': [
+            {'segmentId': '1', 'cabin': 'ECONOMY', 'fareBasis': 'YLOWKR', 'class': 'Y',
+             'includedCheckedBags': {'quantity': 1}}]}],
+    }
+
+
+def hotel_booking(name, check_in, check_out, lat, lng):
+    return {
+        'hotel': {'hotel_name_trans': name, 'address': f'일본 도쿄도 {name}', 'latitude': lat, 'longitude': lng,
+                  'review_score': 8.4, 'photos': [f'https://example.com/{name}/{i}.jpg' for i in range(5)]},
+        'room': {'name': '스탠다드 더블룸', 'bed': '더블 침대 1개', 'facilities': ['무료 Wi-Fi', '에어컨', '전용 욕실']},
+        'checkIn': check_in,
+        'checkOut': check_out,
+        'price': 180000,
+    }
+
+
+def image_data_url(size_bytes, seed):
+    data = random.Random(seed).randbytes(size_bytes)
+    return 'data:image/jpeg;base64,' + base64.b64encode(data).decode('ascii')
+
+
+def create_request(**extra):
+    request = {
+        'query': '도쿄 2박 3일 여행, 맛집과 쇼핑 위주로 추천해줘',
+        'startDate': START_DATE,
+        'endDate': END_DATE,
+        'adults': 2,
+        'children': 0,
+        'authToken': 'Bearer test-token',
+    }
+    request.update(extra)
+    return request
+
+
+def modify_request(recorded_plan):
+    # 저장된 계획을 프론트엔드 travel_plans 구조로 바꾸고 항공편/숙박 일정을 더해 수정 요청 구성
+    travel_plans = {}
+    for day in recorded_plan['ds']:
+        schedules = [{'id': s['i'], 'name': s['n'], 'time': s['t'], 'lat': s['la'], 'lng': s['lo'], 'category': s['c'],
+                      'duration': s['du'], 'notes': s['no'], 'cost': s['co'], 'address': s['a']}
+                     for s in day['s'] if s['c'] != '숙소']
+        if day['d'] == 1:
+            schedules.insert(0, {'id': 'flight-1', 'type': 'Flight_OneWay', 'time': '09:30', 'name': 'ICN -> NRT',
+                                 'flightOfferDetails': {'flightOfferData': FLIGHTS[0]}})
+        schedules.append({'id': f'hotel-{day["d"]}', 'type': 'accommodation', 'time': '20:00', 'name': '신주쿠 프린스 호텔',
+                          'hotelDetails': HOTELS[0]})
+        travel_plans[str(day['d'])] = {'title': day['ti'], 'schedules': schedules}
+    return {
+        'action': 'modifyPlan',
+        'modificationDetails': {
+            'authToken': 'Bearer test-token',
+            'need': '둘째 날 일정을 더 여유롭게 바꾸고 저녁은 이자카야로 추천해줘',
+            'plans': {'planId': 'plan-bench', 'start_date': START_DATE,
+                      'day_order': list(travel_plans), 'travel_plans': travel_plans},
+            'flightInfos': FLIGHTS,
+            'accommodationInfos': HOTELS[:1],
+        },
+    }
+
+
+FLIGHTS = [
+    flight_offer('ICN', 'NRT', '2025-10-01T07:30:00', '2025-10-01T09:50:00', '701', (35.7720, 140.3929)),
+    flight_offer('NRT', 'ICN', '2025-10-03T19:30:00', '2025-10-03T22:10:00', '702', (37.4602, 126.4407)),
+]
+HOTELS = [
+    hotel_booking('신주쿠 프린스 호텔', '2025-10-01', '2025-10-02', 35.6946, 139.7004),
+    hotel_booking('긴자 그랜드 호텔', '2025-10-02', '2025-10-03', 35.6717, 139.7650),
+]
+
+
+def build_scenarios(recorded_plan):
+    """시나리오 이름 -> (경로, 요청). 경로: websocket(접수 -> SQS -> 워커) / rest(create_mobile) / modify"""
+    images = [image_data_url(150 * 1024, seed) for seed in range(2)]
+    create_scenarios = {
+        'text_only': create_request(),
+        'multi_flight': create_request(flightInfos=FLIGHTS),
+        'multi_hotel': create_request(accommodationInfos=HOTELS),
+        'with_images': create_request(images=images),
+    }
+    scenarios = {}
+    for name, request in create_scenarios.items():
+        scenarios[name] = ('websocket', request)
+        scenarios[f'{name}_rest'] = ('rest', request)
+    scenarios['modify'] = ('modify', modify_request(recorded_plan))
+    return scenarios
+
+
+def load_handler(name):
+    path = os.path.join(SERVERLESS_DIR, HANDLERS[name])
+    sys.path.insert(0, os.path.dirname(path))
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Harness:
+    def __init__(self, handlers, sqs, websocket):
+        self.handlers = handlers
+        self.sqs = sqs
+        self.websocket = websocket
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def _next_id(self):
+        with self._lock:
+            self._counter += 1
+            return self._counter
+
+    def run(self, path, request):
+        """요청 하나를 끝까지 처리하고 성공 여부를 반환."""
+        request_number = self._next_id()
+        if path == 'rest':
+            body = dict(request, clientRequestId=f'bench-{request_number}')
+            event = {'httpMethod': 'POST', 'headers': {}, 'body': json.dumps(body, ensure_ascii=False),
+                     'requestContext': {'requestId': f'bench-rest-{request_number}'}}
+            response = self.handlers['create_mobile'].lambda_handler(event, FakeContext())
+            return response.get('statusCode') == 200
+
+        intake, worker, final_action = (
+            ('requestPlanModificationHandler', 'modifyPlanAsync', 'plan_modified') if path == 'modify'
+            else ('requestPlanHandler', 'createPlanAsync', 'plan_created'))
+        connection_id = f'bench-conn-{request_number}'
+        body = request if path == 'modify' else dict(request, clientRequestId=f'bench-{request_number}')
+        event = {'requestContext': {'connectionId': connection_id, 'requestId': f'bench-ws-{request_number}'},
+                 'body': json.dumps(body, ensure_ascii=False)}
+        response = self.handlers[intake].lambda_handler(event, FakeContext())
+        messages = self.sqs.pop_sent()
+        if response.get('statusCode') != 200 or not messages:
+            return False
+        result = self.handlers[worker].lambda_handler(InMemorySQS.to_event(messages), FakeContext())
+        actions = [action for action, _ in self.websocket.pop_frames(connection_id)]
+        return not (result or {}).get('batchItemFailures') and final_action in actions
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure_latency(harness, path, request, iterations, concurrency):
+    def one(_):
+        start = time.perf_counter()
+        ok = harness.run(path, request)
+        return time.perf_counter() - start, ok
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        runs = list(executor.map(one, range(iterations)))
+    wall = time.perf_counter() - wall_start
+    latencies = [elapsed * 1000 for elapsed, _ in runs]
+    return {
+        'throughput_rps': iterations / wall,
+        'p50_ms': percentile(latencies, 0.50),
+        'p90_ms': percentile(latencies, 0.90),
+        'p99_ms': percentile(latencies, 0.99),
+        'errors': sum(1 for _, ok in runs if not ok),
+    }
+
+
+def measure_allocations(harness, path, request, iterations):
+    """요청 하나를 처리하는 동안의 최대 추가 메모리(KiB)와 처리 후 남은 메모리(KiB)의 중앙값."""
+    peaks, retained = [], []
+    tracemalloc.start()
+    try:
+        for _ in range(iterations):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            harness.run(path, request)
+            after, peak = tracemalloc.get_traced_memory()
+            peaks.append((peak - before) / 1024)
+            retained.append((after - before) / 1024)
+    finally:
+        tracemalloc.stop()
+    return {'alloc_peak_kib': statistics.median(peaks), 'alloc_retained_kib': statistics.median(retained)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--alloc-iterations', type=int, default=3)
+    parser.add_argument('--scenarios', help='쉼표로 구분한 시나리오 이름 (기본: 전체)')
+    parser.add_argument('--gemini-ttfb-ms', type=int, default=200)
+    parser.add_argument('--gemini-total-ms', type=int, default=600)
+    parser.add_argument('--gemini-chunks', type=int, default=8, help='스트리밍 응답을 나눠 보낼 청크 수')
+    parser.add_argument('--websocket-latency-ms', type=int, default=0)
+    parser.add_argument('--responses', default=os.path.join(BENCH_DIR, 'responses.jsonl'))
+    parser.add_argument('--json', help='결과를 저장할 파일')
+    parser.add_argument('--baseline', help='비교할 이전 결과 파일')
+    args = parser.parse_args()
+
+    gemini = FakeGeminiServer.from_file(args.responses, ttfb_ms=args.gemini_ttfb_ms,
+                                        total_ms=args.gemini_total_ms, chunks=args.gemini_chunks).start()
+    os.environ.update(FORCED_ENV, GEMINI_API_BASE=gemini.base_url)
+    for key, value in DEFAULT_ENV.items():
+        os.environ.setdefault(key, value)
+
+    # 핸들러 import와 실행 중 출력(print/구조화 로그/EMF)은 버리고 결과 표만 출력
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        import lambda_runtime
+        from local_dynamodb import LocalTable
+        sqs = InMemorySQS()
+        websocket = RecordingWebSocket(latency_ms=args.websocket_latency_ms)
+        lambda_runtime.use_client('sqs', sqs)
+        lambda_runtime.use_client('apigatewaymanagementapi', websocket, endpoint_url=WEBSOCKET_ENDPOINT)
+        lambda_runtime.use_table('travel-plans', LocalTable('travel-plans', ['planId']))
+        handlers = {name: load_handler(name) for name in HANDLERS}
+
+    recorded_plan = json.loads(next(entry for entry in gemini.responses if entry['name'] == 'create_plan')
+                               ['response']['candidates'][0]['content']['parts'][0]['text'])
+    scenarios = build_scenarios(recorded_plan)
+    if args.scenarios:
+        selected = args.scenarios.split(',')
+        unknown = [name for name in selected if name not in scenarios]
+        if unknown:
+            parser.error(f"알 수 없는 시나리오: {', '.join(unknown)} (가능: {', '.join(scenarios)})")
+        scenarios = {name: scenarios[name] for name in selected}
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    harness = Harness(handlers, sqs, websocket)
+    print(f"Gemini 지연: 첫 바이트 {args.gemini_ttfb_ms}ms / 전체 {args.gemini_total_ms}ms, "
+          f"반복 {args.iterations}회, 동시 {args.concurrency}")
+    print(f"{'시나리오':<20} {'처리량(rps)':>11} {'p50(ms)':>9} {'p90(ms)':>9} {'p99(ms)':>9} "
+          f"{'peak(KiB)':>10} {'잔여(KiB)':>10} {'오류':>5} {'p50 변화':>9}")
+    results = {}
+    for name, (path, request) in scenarios.items():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            harness.run(path, request)  # 워밍업 (연결 풀, 지연 import)
+            result = measure_latency(harness, path, request, args.iterations, args.concurrency)
+            result.update(measure_allocations(harness, path, request, args.alloc_iterations))
+        results[name] = result
+        delta = ''
+        if name in baseline:
+            delta = f"{result['p50_ms'] - baseline[name]['p50_ms']:+.1f}"
+        print(f"{name:<20} {result['throughput_rps']:>11.2f} {result['p50_ms']:>9.1f} {result['p90_ms']:>9.1f} "
+              f"{result['p99_ms']:>9.1f} {result['alloc_peak_kib']:>10.1f} {result['alloc_retained_kib']:>10.1f} "
+              f"{result['errors']:>5} {delta:>9}")
+
+    print(f"\nGemini 호출 {gemini.calls}회, SQS 메시지 {sqs.sent}개")
+    gemini.stop()
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"결과 저장: {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 핸들러 벤치마크용 로컬 대체 구현 (AWS/Gemini 호출 없음)
+# - FakeGeminiServer: 기록된 Gemini 응답(responses.jsonl)을 지연 시간을 흉내 내어 돌려주는 HTTP 서버
+#                     (generateContent, streamGenerateContent?alt=sse)
+# - InMemorySQS: send_message를 스레드별로 보관. pop_sent()로 꺼내 SQS 이벤트 레코드로 변환
+# - RecordingWebSocket: post_to_connection/get_connection을 기록만 하는 API Gateway Management API 대체
+# DynamoDB는 Lambda_Layer의 local_dynamodb.LocalTable을 그대로 사용한다.
+
+
+class FakeGeminiServer:
+    """기록된 응답을 돌려주는 가짜 Gemini API.
+    응답은 프롬프트에 match 문자열이 들어 있는 첫 항목(없으면 match가 null인 항목)을 사용한다.
+    ttfb_ms 뒤에 첫 바이트를 보내고, 스트리밍이면 나머지를 chunks개로 나누어 total_ms까지 고르게 보낸다."""
+
+    def __init__(self, responses, ttfb_ms=200, total_ms=600, chunks=8):
+        self.responses = responses
+        self.ttfb_ms = ttfb_ms
+        self.total_ms = total_ms
+        self.chunks = chunks
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        with open(path, encoding='utf-8') as f:
+            return cls([json.loads(line) for line in f if line.strip()], **kwargs)
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def pick(self, request_body):
+        text = request_body.decode('utf-8', errors='replace')
+        fallback = None
+        for entry in self.responses:
+            if entry.get('match') is None:
+                fallback = fallback or entry
+            elif entry['match'] in text:
+                return entry['response']
+        return fallback['response']
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # 연결 재사용 (GeminiClient 연결 풀)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                with fake._lock:
+                    fake.calls += 1
+                response = fake.pick(body)
+                if ':streamGenerateContent' in self.path:
+                    self._stream(response)
+                else:
+                    time.sleep(fake.total_ms / 1000)
+                    data = json.dumps(response, ensure_ascii=False).encode('utf-8')
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json; charset=UTF-8')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+
+            def _stream(self, response):
+                candidate = response['candidates'][0]
+                text = candidate['content']['parts'][0]['text']
+                size = max(1, -(-len(text) // fake.chunks))
+                pieces = [text[start:start + size] for start in range(0, len(text), size)]
+                interval = max(0, fake.total_ms - fake.ttfb_ms) / 1000 / max(1, len(pieces))
+                time.sleep(fake.ttfb_ms / 1000)
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for index, piece in enumerate(pieces):
+                    chunk = {'candidates': [{'content': {'parts': [{'text': piece}], 'role': 'model'}}]}
+                    if index == len(pieces) - 1:
+                        chunk['candidates'][0]['finishReason'] = candidate.get('finishReason', 'STOP')
+                        for key in ('usageMetadata', 'modelVersion'):
+                            if key in response:
+                                chunk[key] = response[key]
+                    if index:
+                        time.sleep(interval)
+                    event = f'data: {json.dumps(chunk, ensure_ascii=False)}\r\n\r\n'.encode('utf-8')
+                    self.wfile.write(f'{len(event):X}\r\n'.encode('ascii') + event + b'\r\n')
+                    self.wfile.flush()
+                self.wfile.write(b'0\r\n\r\n')
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+class InMemorySQS:
+    """boto3 SQS client의 send_message만 구현. 보낸 메시지는 보낸 스레드에서 pop_sent()로 꺼낸다."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self.sent = 0
+
+    def send_message(self, QueueUrl, MessageBody, MessageAttributes=None, **kwargs):
+        message = {
+            'MessageId': str(uuid.uuid4()),
+            'QueueUrl': QueueUrl,
+            'Body': MessageBody,
+            'MessageAttributes': MessageAttributes or {},
+            'SentTimestamp': int(time.time() * 1000),
+        }
+        outbox = getattr(self._local, 'outbox', None)
+        if outbox is None:
+            outbox = self._local.outbox = []
+        outbox.append(message)
+        self.sent += 1
+        return {'MessageId': message['MessageId']}
+
+    def pop_sent(self):
+        outbox = getattr(self._local, 'outbox', None) or []
+        self._local.outbox = []
+        return outbox
+
+    @staticmethod
+    def to_event(messages):
+        """Lambda SQS 이벤트 형식 ({'Records': [...]})."""
+        return {'Records': [{
+            'messageId': message['MessageId'],
+            'receiptHandle': message['MessageId'],
+            'body': message['Body'],
+            'attributes': {'ApproximateReceiveCount': '1', 'SentTimestamp': str(message['SentTimestamp'])},
+            'messageAttributes': {
+                name: {'stringValue': value.get('StringValue'), 'dataType': value.get('DataType', 'String')}
+                for name, value in message['MessageAttributes'].items()
+            },
+            'eventSource': 'aws:sqs',
+            'eventSourceARN': 'arn:aws:sqs:local:000000000000:' + message['QueueUrl'].rsplit('/', 1)[-1],
+        } for message in messages]}
+
+
+class RecordingWebSocket:
+    """API Gateway Management API client 대체. 연결별로 받은 action과 바이트 수를 기록한다."""
+
+    def __init__(self, latency_ms=0):
+        self.latency_ms = latency_ms
+        self._frames = {}
+        self._lock = threading.Lock()
+
+    def post_to_connection(self, ConnectionId, Data):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        data = Data if isinstance(Data, str) else Data.decode('utf-8')
+        action = json.loads(data).get('action')
+        with self._lock:
+            self._frames.setdefault(ConnectionId, []).append((action, len(data)))
+        return {}
+
+    def get_connection(self, ConnectionId):
+        return {'ConnectedAt': time.time(), 'Identity': {'SourceIp': '127.0.0.1'}}
+
+    def pop_frames(self, connection_id):
+        with self._lock:
+            return self._frames.pop(connection_id, [])
+
+
+class FakeContext:
+    """Lambda context 대체 (sqs_batch가 남은 시간으로 마감을 계산)."""
+
+    def __init__(self, timeout_seconds=900):
+        self.aws_request_id = str(uuid.uuid4())
+        self.function_name = 'bench'
+        self._deadline = time.time() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return int((self._deadline - time.time()) * 1000)
@@ -0,0 +1,77 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+# 모델 응답 JSON 추출기 벤치마크
+# corpus.jsonl 의 기록된 불량 응답들에 대해 복구율과 파싱 시간을 기존 방식(코드 블록 제거 + json.loads)과 비교한다.
+#
+# 사용법:
+#   python serverless/benchmarks/json_repair/bench_plan_json.py [--repeat 200] [--corpus 경로]
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', '..', 'Lambda_Layer', 'python'))
+
+from plan_json import extract_json  # noqa: E402
+
+
+def legacy_parse(text):
+    """기존 세 곳(createPlanAsync/modifyPlanAsync/create_mobile)에서 쓰던 방식."""
+    text = text.strip()
+    if text.startswith('```json'):
+        text = text[7:]
+    elif text.startswith('```'):
+        text = text[3:]
+    if text.endswith('```'):
+        text = text[:-3]
+    return json.loads(text.strip())
+
+
+def engine_parse(text):
+    return extract_json(text)[0]
+
+
+def count_days(value):
+    days = value.get('days') if isinstance(value, dict) else None
+    return len(days) if isinstance(days, (list, dict)) else 0
+
+
+def run(parser, case, repeat):
+    try:
+        value = parser(case['text'])
+    except ValueError:
+        return 0, None
+    start = time.perf_counter()
+    for _ in range(repeat):
+        parser(case['text'])
+    return count_days(value), (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', default=os.path.join(BENCH_DIR, 'corpus.jsonl'))
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding='utf-8') as f:
+        cases = [json.loads(line) for line in f if line.strip()]
+
+    print(f"{'케이스':<26} {'기대 일수':>8} {'기존':>6} {'추출기':>6} {'기존(ms)':>10} {'추출기(ms)':>10}")
+    totals = {'legacy': 0, 'engine': 0, 'recoverable': 0}
+    for case in cases:
+        legacy_days, legacy_time = run(legacy_parse, case, args.repeat)
+        engine_days, engine_time = run(engine_parse, case, args.repeat)
+        if case['expect_days']:
+            totals['recoverable'] += 1
+            totals['legacy'] += legacy_days == case['expect_days']
+            totals['engine'] += engine_days == case['expect_days']
+        print(f"{case['name']:<26} {case['expect_days']:>8} {legacy_days:>6} {engine_days:>6} "
+              f"{'-' if legacy_time is None else f'{legacy_time * 1000:.3f}':>10} "
+              f"{'-' if engine_time is None else f'{engine_time * 1000:.3f}':>10}")
+
+    print(f"\n복구 가능한 응답 {totals['recoverable']}개 중 기존 방식 {totals['legacy']}개, 추출기 {totals['engine']}개 복구")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 기존 travel-plans 항목에 목록 요약 속성을 채워 요약 인덱스(PlanSummaryIndex)에 넣는다
+# 인덱스는 summary_updated_at이 있는 항목만 담는 희소 GSI라 이 속성이 없는 예전 항목은 목록에 나오지 않는다.
+# 형식 설명은 Lambda_Layer/python/plan_summary_index.py 참고.
+# - 병렬 Scan(--segments)으로 summary_updated_at이 없는 항목을 찾아 update_item으로 요약 속성 SET
+# - summary_updated_at은 planId의 생성 시각(plan-밀리초-무작위), 형식이 다르면 현재 시각
+# - start_date/end_date/paid_plan이 이미 있는 항목은 그 값을 유지
+# - 조건부 쓰기(summary_updated_at 없음)라 여러 번 실행하거나 중간에 멈췄다가 다시 실행해도 안전
+# - --dry-run: 쓰지 않고 대상 수만 출력
+#
+# 사용법:
+#   python serverless/tools/backfill_plan_summary.py [--table travel-plans] [--segments 4] [--rate 25] [--limit 100] [--dry-run]
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+LAYER_DIR = os.path.normpath(os.path.join(TOOLS_DIR, '..', 'Lambda_Layer', 'python'))
+sys.path.insert(0, LAYER_DIR)
+
+from booking_artifacts import resolve_booking_refs, stored_bookings  # noqa: E402
+from lambda_runtime import get_table  # noqa: E402
+from local_dynamodb import is_conditional_check_failed  # noqa: E402
+from migrate_plan_storage import RateLimiter  # noqa: E402
+from plan_overflow import restore_overflow  # noqa: E402
+from plan_storage import read_plan  # noqa: E402
+from plan_summary_index import SUMMARY_SORT_ATTRIBUTE, summary_attributes  # noqa: E402
+
+# 요약 속성 중 사용자가 이미 가진 값을 덮어쓰지 않는 것
+KEEP_EXISTING = ('start_date', 'end_date', 'paid_plan')
+
+_PLAN_ID_MILLIS = re.compile(r'^plan-(\d{13})-')
+
+
+def created_at(item):
+    """planId의 생성 시각(초). 시간순 planId가 아니면 None (현재 시각 사용)."""
+    match = _PLAN_ID_MILLIS.match(str(item.get('planId') or ''))
+    return int(match.group(1)) / 1000 if match else None
+
+
+def build_update(item, key_names):
+    """요약 속성을 채우는 update_item 인자."""
+    item = resolve_booking_refs(restore_overflow(dict(item)))
+    plan = read_plan(item)
+    flights, accommodations = stored_bookings(item)
+    attributes = summary_attributes(plan, flights, accommodations, now=created_at(item))
+    assignments, values = [], {}
+    for name, value in attributes.items():
+        values[f':{name}'] = value
+        if name in KEEP_EXISTING:
+            assignments.append(f'{name} = if_not_exists({name}, :{name})')
+        else:
+            assignments.append(f'{name} = :{name}')
+    return {
+        'Key': {name: item[name] for name in key_names},
+        'UpdateExpression': 'SET ' + ', '.join(assignments),
+        'ConditionExpression': f'attribute_not_exists({SUMMARY_SORT_ATTRIBUTE})',
+        'ExpressionAttributeValues': values,
+    }
+
+
+class Backfill:
+    def __init__(self, table_name, segments, limiter, limit=None, dry_run=False):
+        self.table_name = table_name
+        self.segments = segments
+        self.limiter = limiter
+        self.limit = limit
+        self.dry_run = dry_run
+        self.stats = {'scanned': 0, 'updated': 0, 'conflicts': 0, 'failed': 0}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self.stats[name] += value
+            if self.limit and self.stats['updated'] >= self.limit:
+                self._stop.set()
+
+    def run_segment(self, segment):
+        table = get_table(self.table_name)  # 스레드별 Table 리소스
+        key_names = [key['AttributeName'] for key in table.key_schema]
+        scan_kwargs = {
+            'Segment': segment,
+            'TotalSegments': self.segments,
+            'FilterExpression': f'attribute_not_exists({SUMMARY_SORT_ATTRIBUTE})',
+        }
+        while not self._stop.is_set():
+            page = table.scan(**scan_kwargs)
+            self._add(scanned=page.get('ScannedCount', 0))
+            for item in page.get('Items', []):
+                if self._stop.is_set():
+                    break
+                self.backfill_item(table, item, key_names)
+            if 'LastEvaluatedKey' not in page:
+                break
+            scan_kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+    def backfill_item(self, table, item, key_names):
+        try:
+            update = build_update(item, key_names)
+        except Exception as e:  # plan_blob 손상, S3 객체 없음 등: 건너뛰고 다음 항목
+            print(f"[Backfill] 요약 속성 계산 실패, 건너뜀: {item.get('planId') or item.get('id')} ({e})")
+            self._add(failed=1)
+            return
+        if not self.dry_run:
+            self.limiter.wait()
+            try:
+                table.update_item(**update)
+            except Exception as e:
+                if not is_conditional_check_failed(e):
+                    raise
+                self._add(conflicts=1)  # 그 사이 생성 람다나 다른 실행이 먼저 채움
+                return
+        self._add(updated=1)
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.segments) as executor:
+            list(executor.map(self.run_segment, range(self.segments)))
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='travel-plans 항목에 목록 요약 속성(PlanSummaryIndex)을 채움')
+    parser.add_argument('--table', default='travel-plans', help='대상 테이블 이름')
+    parser.add_argument('--segments', type=int, default=4, help='병렬 Scan 세그먼트 수 (스레드 수)')
+    parser.add_argument('--rate', type=float, default=25.0, help='초당 update_item 상한 (0이면 제한 없음)')
+    parser.add_argument('--limit', type=int, help='이번 실행에서 채울 최대 항목 수')
+    parser.add_argument('--dry-run', action='store_true', help='쓰지 않고 대상 수만 출력')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    backfill = Backfill(args.table, args.segments, RateLimiter(args.rate), args.limit, args.dry_run)
+    stats = backfill.run()
+    print(f"[Backfill] {'(dry-run) ' if args.dry_run else ''}검사 {stats['scanned']}건, 채움 {stats['updated']}건, "
+          f"실패 {stats['failed']}건, 이미 채워짐 {stats['conflicts']}건, {time.time() - start_time:.1f}초")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+import argparse
+import contextlib
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 오프라인 일괄 여행 계획 생성 CLI (WebSocket/SQS/DynamoDB 없이 Gemini만 호출)
+# 입력 JSONL의 한 줄이 생성 요청 하나 (createPlanAsync의 requestData 형식, 또는 {"id": ..., "requestData": {...}}).
+# createPlanAsync의 프롬프트 구성(build_plan_request)과 비스트리밍 호출(generate_plan_blocking)을 그대로 사용하고,
+# 결과를 요청마다 한 줄씩 JSONL로 바로 기록한다: id, status, plan, timings(ms), usage, continuationRounds, repairs, error
+# - --concurrency: 동시에 진행할 요청 수 / --rate: 초당 Gemini 호출 수 상한 (재시도 포함)
+# - 재시작: 출력 파일에 이미 기록된 id는 건너뜀 (실패한 요청은 --retry-errors 를 주면 다시 실행)
+#   중단되어 마지막 줄이 잘린 경우 그 줄은 지우고 이어서 기록한다.
+# - Ctrl-C: 새 요청 시작을 멈추고 진행 중인 요청만 마무리한 뒤 종료 (다음 실행에서 이어서 진행)
+# 요청 id는 id, clientRequestId 순으로 쓰고 둘 다 없으면 line-<줄번호>. 진행 상황은 stderr로 출력한다.
+# 환경 변수는 createPlanAsync와 동일 (GEMINI_API_KEY 필수, GEMINI_API_BASE, GEMINI_MODEL, PLAN_STRUCTURED_OUTPUT 등)
+#
+# 사용법:
+#   GEMINI_API_KEY=... python serverless/tools/batch_generate_plans.py requests.jsonl -o results.jsonl
+#       [--concurrency 4] [--rate 2] [--retries 3] [--timeout 120] [--retry-errors] [--verbose]
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVERLESS_DIR = os.path.normpath(os.path.join(TOOLS_DIR, '..'))
+LAYER_DIR = os.path.join(SERVERLESS_DIR, 'Lambda_Layer', 'python')
+CREATE_PLAN_PATH = os.path.join(SERVERLESS_DIR, 'API gateway_WebSocket', 'travel', 'createPlanAsync.py')
+sys.path.insert(0, LAYER_DIR)
+
+# 일괄 생성은 매번 새로 생성하는 것이 목적이므로 응답 캐시는 쓰지 않음 (명시적으로 켜면 존중)
+os.environ.setdefault('PLAN_CACHE_ENABLED', 'false')
+os.environ.setdefault('METRICS_ENABLED', 'false')
+os.environ.setdefault('TRACE_EXPORTER', 'none')
+
+RETRY_BACKOFF_SECONDS = 2
+RETRY_BACKOFF_MAX_SECONDS = 30
+
+
+def load_create_plan():
+    """createPlanAsync를 모듈로 읽음 (폴더 이름에 공백이 있어 일반 import 불가)."""
+    spec = importlib.util.spec_from_file_location('createPlanAsync', CREATE_PLAN_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def iter_requests(path):
+    """(id, requestData 또는 None, 오류 메시지) 를 한 줄씩 생성. 파일 전체를 메모리에 올리지 않는다."""
+    with open(path, encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                item = json.loads(line)
+            except ValueError as e:
+                yield f'line-{line_number}', None, f'JSON 파싱 실패: {e}'
+                continue
+            if not isinstance(item, dict):
+                yield f'line-{line_number}', None, '요청은 JSON 객체여야 합니다.'
+                continue
+            request_data = item.get('requestData', item)
+            request_id = str(item.get('id') or request_data.get('clientRequestId') or f'line-{line_number}')
+            yield request_id, request_data, None
+
+
+def prepare_output(path, retry_errors):
+    """이미 기록된 결과를 읽어 건너뛸 id 목록을 만들고, 잘린 마지막 줄이 있으면 잘라낸다."""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    valid_size = 0
+    with open(path, 'rb') as f:
+        for raw in f:
+            if not raw.endswith(b'\n'):
+                break  # 기록 도중 중단된 줄
+            valid_size += len(raw)
+            try:
+                result = json.loads(raw)
+            except ValueError:
+                continue
+            if result.get('status') == 'ok' or not retry_errors:
+                done.add(result.get('id'))
+    if valid_size != os.path.getsize(path):
+        print(f"[Batch] 출력 파일의 잘린 마지막 줄을 지웁니다 ({os.path.getsize(path) - valid_size} bytes)", file=sys.stderr)
+        with open(path, 'r+b') as f:
+            f.truncate(valid_size)
+    return done
+
+
+class RateLimiter:
+    """초당 rate회로 호출 간격을 맞춤 (스레드 간 공유). rate가 0이면 제한 없음."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class ResultWriter:
+    """결과를 한 줄씩 append 후 즉시 flush (중단되어도 끝난 요청은 남음)."""
+
+    def __init__(self, path, encoder):
+        self._file = open(path, 'a', encoding='utf-8')
+        self._encoder = encoder
+        self._lock = threading.Lock()
+        self.counts = {'ok': 0, 'error': 0}
+        self.total_tokens = 0
+
+    def write(self, result):
+        line = json.dumps(result, ensure_ascii=False, cls=self._encoder)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+            self.counts[result['status']] += 1
+            self.total_tokens += int((result.get('usage') or {}).get('totalTokenCount') or 0)
+
+    def close(self):
+        self._file.close()
+
+
+def generate_one(create_plan, request_id, request_data, limiter, retries, timeout):
+    """요청 하나 실행. 재시도 가능한 Gemini 오류(429/5xx/타임아웃)는 지수 백오프로 retries회까지 재시도."""
+    result = {'id': request_id, 'status': 'error', 'plan': None, 'timings': {}, 'usage': None,
+              'continuationRounds': 0, 'repairs': [], 'attempts': 0, 'error': None}
+    start_time = time.time()
+    try:
+        plan_request = create_plan.build_plan_request(request_data, request_id)
+        result['timings']['prompt_build_ms'] = round((time.time() - start_time) * 1000, 1)
+        for attempt in range(retries + 1):
+            limiter.wait()
+            result['attempts'] = attempt + 1
+            try:
+                gemini_result, timings, continuation_rounds, repairs = create_plan.generate_plan_blocking(
+                    plan_request['payload'], timeout)
+                break
+            except create_plan.GeminiAPIError as e:
+                if not e.retryable or attempt == retries:
+                    raise
+                delay = min(RETRY_BACKOFF_SECONDS * 2 ** attempt, RETRY_BACKOFF_MAX_SECONDS)
+                print(f"[Batch] {request_id}: {e} -> {delay}초 후 재시도 ({attempt + 1}/{retries})", file=sys.stderr)
+                time.sleep(delay)
+
+        plan_text = create_plan.chunk_text(gemini_result)
+        result['plan'] = json.loads(plan_text, parse_float=create_plan.Decimal)
+        result['timings'].update({
+            'gemini_ttfb_ms': round(timings['ttfb'] * 1000, 1),
+            'gemini_total_ms': round(timings['gemini_total'] * 1000, 1),
+            'parse_ms': round(timings['parse'] * 1000, 1),
+        })
+        result['usage'] = gemini_result.get('usageMetadata')
+        result['continuationRounds'] = continuation_rounds
+        result['repairs'] = repairs
+        result['status'] = 'ok'
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+    result['timings']['total_ms'] = round((time.time() - start_time) * 1000, 1)
+    return result
+
+
+def run(args):
+    done = prepare_output(args.output, args.retry_errors)
+    if done:
+        print(f"[Batch] 이미 기록된 요청 {len(done)}건은 건너뜁니다.", file=sys.stderr)
+
+    # createPlanAsync 로그(print)는 요청별로 많으므로 --verbose 가 아니면 숨김
+    quiet = contextlib.redirect_stdout(open(os.devnull, 'w')) if not args.verbose else contextlib.nullcontext()
+    with quiet:
+        create_plan = load_create_plan()
+    if not os.environ.get('GEMINI_API_KEY'):
+        print("[Batch] 환경변수 'GEMINI_API_KEY'가 설정되지 않았습니다.", file=sys.stderr)
+        return 2
+
+    writer = ResultWriter(args.output, create_plan.DecimalEncoder)
+    limiter = RateLimiter(args.rate)
+    in_flight = threading.BoundedSemaphore(args.concurrency)
+    seen = set(done)
+    skipped = 0
+    interrupted = False
+    start_time = time.time()
+
+    def task(request_id, request_data):
+        try:
+            result = generate_one(create_plan, request_id, request_data, limiter, args.retries, args.timeout)
+            writer.write(result)
+            finished = writer.counts['ok'] + writer.counts['error']
+            print(f"[Batch] {finished}건 완료 ({request_id}: {result['status']}, {result['timings']['total_ms']:.0f}ms)",
+                  file=sys.stderr)
+        finally:
+            in_flight.release()
+
+    executor = ThreadPoolExecutor(max_workers=args.concurrency)
+    try:
+        with quiet:
+            for request_id, request_data, error in iter_requests(args.input):
+                if request_id in seen:
+                    skipped += 1
+                    continue
+                seen.add(request_id)
+                if error:
+                    writer.write({'id': request_id, 'status': 'error', 'plan': None, 'timings': {}, 'usage': None,
+                                  'continuationRounds': 0, 'repairs': [], 'attempts': 0, 'error': error})
+                    continue
+                # 진행 중인 요청 수만큼만 입력을 읽어 제출 (큰 입력 파일도 메모리 사용이 일정)
+                while not in_flight.acquire(timeout=0.5):
+                    pass
+                executor.submit(task, request_id, request_data)
+            executor.shutdown(wait=True)
+    except KeyboardInterrupt:
+        interrupted = True
+        print("[Batch] 중단 요청: 진행 중인 요청만 마무리합니다. 다시 실행하면 이어서 진행합니다.", file=sys.stderr)
+        executor.shutdown(wait=True, cancel_futures=True)
+    finally:
+        writer.close()
+
+    elapsed = time.time() - start_time
+    processed = writer.counts['ok'] + writer.counts['error']
+    print(f"[Batch] 성공 {writer.counts['ok']}건, 실패 {writer.counts['error']}건, 건너뜀 {skipped}건, "
+          f"{elapsed:.1f}초 ({processed / elapsed if elapsed else 0:.2f}건/초), 토큰 {writer.total_tokens}",
+          file=sys.stderr)
+    if interrupted:
+        return 130
+    return 1 if writer.counts['error'] else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSONL 생성 요청으로 여행 계획을 일괄 생성 (재시작 시 이어서 진행)')
+    parser.add_argument('input', help='생성 요청 JSONL 파일')
+    parser.add_argument('-o', '--output', required=True, help='결과 JSONL 파일 (있으면 이어서 기록)')
+    parser.add_argument('--concurrency', type=int, default=4, help='동시에 진행할 요청 수')
+    parser.add_argument('--rate', type=float, default=2.0, help='초당 Gemini 호출 수 상한 (0이면 제한 없음)')
+    parser.add_argument('--retries', type=int, default=3, help='재시도 가능한 Gemini 오류의 최대 재시도 횟수')
+    parser.add_argument('--timeout', type=int, default=120, help='요청당 Gemini 호출 타임아웃(초)')
+    parser.add_argument('--retry-errors', action='store_true', help='출력 파일에 실패로 기록된 요청도 다시 실행')
+    parser.add_argument('--verbose', action='store_true', help='createPlanAsync 로그를 stdout으로 출력')
+    args = parser.parse_args()
+    if args.concurrency < 1:
+        parser.error('--concurrency 는 1 이상이어야 합니다.')
+    sys.exit(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# 기존 travel-plans 항목을 압축 저장 형식으로 변환 (plan_data envelope -> plan_blob + 요약 속성)
+# 형식 설명은 Lambda_Layer/python/plan_storage.py 참고. 로더(load_web, load_mobile)를 먼저 배포한 뒤 실행한다.
+# - 병렬 Scan(--segments)으로 plan_data만 있는 항목을 찾아 update_item으로 SET plan_blob/요약 속성, REMOVE plan_data
+# - 조건부 쓰기(plan_data 있고 plan_blob 없음)라 여러 번 실행하거나 중간에 멈췄다가 다시 실행해도 안전
+# - start_date/end_date가 이미 있는 항목은 그 값을 유지
+# - 계획 JSON을 파싱할 수 없는 항목은 건너뛰고 planId를 출력 (예전 형식 그대로 둠)
+# - --dry-run: 쓰지 않고 변환 대상 수와 예상 크기 변화만 출력
+#
+# 사용법:
+#   python serverless/tools/migrate_plan_storage.py [--table travel-plans] [--segments 4] [--rate 25] [--limit 100] [--dry-run]
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+LAYER_DIR = os.path.normpath(os.path.join(TOOLS_DIR, '..', 'Lambda_Layer', 'python'))
+sys.path.insert(0, LAYER_DIR)
+
+from lambda_runtime import get_table  # noqa: E402
+from local_dynamodb import is_conditional_check_failed  # noqa: E402
+from plan_storage import encode_plan, plan_summary, read_plan  # noqa: E402
+
+# 요약 속성 중 사용자가 이미 가진 값을 덮어쓰지 않는 것
+KEEP_EXISTING = ('start_date', 'end_date')
+
+
+def item_size(value):
+    """DynamoDB 항목 크기 대략치 (JSON 바이트 수)."""
+    return len(json.dumps(value, ensure_ascii=False, default=str).encode('utf-8'))
+
+
+def build_update(item, key_names):
+    """변환할 항목의 update_item 인자. 계획을 파싱할 수 없으면 None."""
+    plan = read_plan(item)
+    if not isinstance(plan, dict):
+        return None
+    values = {':plan_blob': encode_plan(plan)}
+    assignments = ['plan_blob = :plan_blob']
+    for name, value in plan_summary(plan).items():
+        values[f':{name}'] = value
+        if name in KEEP_EXISTING:
+            assignments.append(f'{name} = if_not_exists({name}, :{name})')
+        else:
+            assignments.append(f'{name} = :{name}')
+    return {
+        'Key': {name: item[name] for name in key_names},
+        'UpdateExpression': 'SET ' + ', '.join(assignments) + ' REMOVE plan_data',
+        'ConditionExpression': 'attribute_exists(plan_data) AND attribute_not_exists(plan_blob)',
+        'ExpressionAttributeValues': values,
+    }
+
+
+class RateLimiter:
+    """초당 rate회로 쓰기 간격을 맞춤 (세그먼트 스레드 간 공유, 테이블 WCU 보호). rate가 0이면 제한 없음."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class Migration:
+    def __init__(self, table_name, segments, limiter, limit=None, dry_run=False):
+        self.table_name = table_name
+        self.segments = segments
+        self.limiter = limiter
+        self.limit = limit
+        self.dry_run = dry_run
+        self.stats = {'scanned': 0, 'migrated': 0, 'unparseable': 0, 'conflicts': 0,
+                      'bytes_before': 0, 'bytes_after': 0}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self.stats[name] += value
+            if self.limit and self.stats['migrated'] >= self.limit:
+                self._stop.set()
+
+    def run_segment(self, segment):
+        table = get_table(self.table_name)  # 스레드별 Table 리소스
+        key_names = [key['AttributeName'] for key in table.key_schema]
+        scan_kwargs = {
+            'Segment': segment,
+            'TotalSegments': self.segments,
+            'FilterExpression': 'attribute_exists(plan_data) AND attribute_not_exists(plan_blob)',
+        }
+        while not self._stop.is_set():
+            page = table.scan(**scan_kwargs)
+            self._add(scanned=page.get('ScannedCount', 0))
+            for item in page.get('Items', []):
+                if self._stop.is_set():
+                    break
+                self.migrate_item(table, item, key_names)
+            if 'LastEvaluatedKey' not in page:
+                break
+            scan_kwargs['ExclusiveStartKey'] = page['LastEvaluatedKey']
+
+    def migrate_item(self, table, item, key_names):
+        update = build_update(item, key_names)
+        if update is None:
+            print(f"[Migrate] 계획 JSON 파싱 실패, 건너뜀: {item.get('planId') or item.get('id')}")
+            self._add(unparseable=1)
+            return
+        before = item_size(item['plan_data'])
+        after = len(update['ExpressionAttributeValues'][':plan_blob'])
+        if not self.dry_run:
+            self.limiter.wait()
+            try:
+                table.update_item(**update)
+            except Exception as e:
+                if not is_conditional_check_failed(e):
+                    raise
+                self._add(conflicts=1)  # 그 사이 다른 실행이 먼저 변환함
+                return
+        self._add(migrated=1, bytes_before=before, bytes_after=after)
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.segments) as executor:
+            list(executor.map(self.run_segment, range(self.segments)))
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='travel-plans 항목을 압축 저장 형식(plan_blob)으로 변환')
+    parser.add_argument('--table', default='travel-plans', help='대상 테이블 이름')
+    parser.add_argument('--segments', type=int, default=4, help='병렬 Scan 세그먼트 수 (스레드 수)')
+    parser.add_argument('--rate', type=float, default=25.0, help='초당 update_item 상한 (0이면 제한 없음)')
+    parser.add_argument('--limit', type=int, help='이번 실행에서 변환할 최대 항목 수')
+    parser.add_argument('--dry-run', action='store_true', help='쓰지 않고 변환 대상과 예상 크기 변화만 출력')
+    args = parser.parse_args()
+
+    start_time = time.time()
+    migration = Migration(args.table, args.segments, RateLimiter(args.rate), args.limit, args.dry_run)
+    stats = migration.run()
+    saved = stats['bytes_before'] - stats['bytes_after']
+    ratio = stats['bytes_after'] / stats['bytes_before'] if stats['bytes_before'] else 0
+    print(f"[Migrate] {'(dry-run) ' if args.dry_run else ''}검사 {stats['scanned']}건, 변환 {stats['migrated']}건, "
+          f"파싱 실패 {stats['unparseable']}건, 이미 변환됨 {stats['conflicts']}건, {time.time() - start_time:.1f}초")
+    print(f"[Migrate] plan 크기 {stats['bytes_before']:,} -> {stats['bytes_after']:,} bytes "
+          f"({ratio:.0%}, {saved:,} bytes 감소)")
+
+
+if __name__ == '__main__':
+    main()
@@ -42,7 +42,8 @@ const TravelPlanner = ({ loadMode }) => {
     loadedAccommodationInfos, // 다중 숙박편
     isSharedPlan: isSharedPlanFromLoader,
     sharedEmails: sharedEmailsFromLoader,
-    originalOwner
+    originalOwner,
+    versionedPlan, setVersionedPlan // 서버에 저장된 계획 버전 (AI 수정 요청용)
   } = useTravelPlanLoader(user, planIdFromUrl, loadMode);
 
   const {
@@ -754,14 +755,16 @@ const TravelPlanner = ({ loadMode }) => {
       loadedFlightInfo,
       loadedFlightInfos, // 다중 항공편
       isRoundTrip,
-      loadedAccommodationInfos // 다중 숙박편
+      loadedAccommodationInfos, // 다중 숙박편
+      versionedPlan
     },
     {
       setPlanId,
       setTravelPlans,
       setDayOrder,
       getDayTitle: plannerGetDayTitle,
-      setLoadedAccommodationInfo
+      setLoadedAccommodationInfo,
+      setVersionedPlan
     },
     addAccommodationToSchedule // 커스텀 숙소 추가 함수 전달
   );
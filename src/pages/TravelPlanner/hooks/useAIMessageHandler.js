@@ -23,8 +23,16 @@ const useAIMessageHandler = (planData, updatePlanData) => {
     const currentCallback = callback;
     
     // WebSocket을 통해 백엔드로 보낼 데이터 구성
+    // 불러온 뒤 편집하지 않은 저장 계획이면 {planId, planVersion, need}만 보내고
+    // 서버(modifyPlanAsync)가 계획과 항공편/숙박 원본을 읽어 수정 결과를 다음 버전으로 저장
+    const versionedPlan = planData.versionedPlan;
+    const useStoredPlan = !!versionedPlan && versionedPlan.travelPlans === planData.travelPlans;
     // 기존 currentPlanData와 requestBody의 내용을 조합
-    const modificationDetails = {
+    const modificationDetails = useStoredPlan ? {
+      planId: versionedPlan.planId,
+      planVersion: versionedPlan.version,
+      need: message
+    } : {
       plans: { 
         planId: planData.planId, // 기존 planId가 있을 수 있음
         day_order: planData.dayOrder,
@@ -39,11 +47,15 @@ const useAIMessageHandler = (planData, updatePlanData) => {
     };
 
     console.log('[DEBUG] useAIMessageHandler - 전송할 modificationDetails 구조:');
-    console.log('  - plans:', modificationDetails.plans);
+    if (useStoredPlan) {
+      console.log('  - 저장된 계획 버전 요청:', modificationDetails.planId, 'version', modificationDetails.planVersion);
+    } else {
+      console.log('  - plans:', modificationDetails.plans);
+      console.log('  - flightInfo 존재:', !!modificationDetails.flightInfo);
+      console.log('  - flightInfos 길이:', modificationDetails.flightInfos.length);
+      console.log('  - accommodationInfos 길이:', modificationDetails.accommodationInfos.length);
+    }
     console.log('  - need:', modificationDetails.need);
-    console.log('  - flightInfo 존재:', !!modificationDetails.flightInfo);
-    console.log('  - flightInfos 길이:', modificationDetails.flightInfos.length);
-    console.log('  - accommodationInfos 길이:', modificationDetails.accommodationInfos.length);
     console.log('AI 계획 수정 요청 (WebSocket)을 위한 데이터:', JSON.stringify(modificationDetails, null, 2));
 
     try {
@@ -91,15 +103,27 @@ const useAIMessageHandler = (planData, updatePlanData) => {
             
             planJson.days.forEach((day) => {
               const dayKey = day.day ? day.day.toString() : (day.date || Math.random().toString(36).substr(2, 9)); 
+              // 버전 요청이면 서버에 저장된 계획에 없는 화면의 항공편/숙박 일정을 다시 앞에 붙임
+              const isBooking = (schedule) =>
+                ['Flight_OneWay', 'Flight_RoundTrip', 'accommodation'].includes(schedule.type) ||
+                !!schedule.flightOfferDetails || !!schedule.hotelDetails;
+              const localBookings = useStoredPlan
+                ? (planData.travelPlans[dayKey]?.schedules || []).filter(isBooking)
+                : [];
+              const aiSchedules = useStoredPlan ? (day.schedules || []).filter(schedule => !isBooking(schedule)) : (day.schedules || []);
               newTravelPlans[dayKey] = { 
                 title: day.title || `Day ${dayKey}`,
-                schedules: day.schedules || [] 
+                schedules: [...localBookings, ...aiSchedules] 
               };
               newDayOrder.push(dayKey);
             });
             
             updatePlanData.setTravelPlans(newTravelPlans);
             updatePlanData.setDayOrder(newDayOrder);
+            // 서버가 저장한 새 버전 (예전 전체 전송 요청은 저장하지 않으므로 planVersion 없음)
+            updatePlanData.setVersionedPlan(result.planVersion !== undefined
+              ? { planId: result.planId, version: result.planVersion, travelPlans: newTravelPlans }
+              : null);
 
             currentCallback({ type: 'success', content: result.message || 'AI가 계획을 성공적으로 수정했습니다.' });
           } else { 
@@ -121,6 +145,10 @@ const useAIMessageHandler = (planData, updatePlanData) => {
     } catch (error) {
       // websocketService.modifyTravelPlanAsync가 reject되면 호출됨 (타임아웃 또는 ai_modification_error)
       console.error('AI 계획 수정 요청 중 오류 발생 (WebSocket):', error);
+      // 버전 충돌/계획 없음: 저장 버전을 버리고 다음 요청은 화면의 계획 전체를 보냄
+      if (error.code === 'plan_version_conflict' || error.code === 'plan_not_found') {
+        updatePlanData.setVersionedPlan(null);
+      }
       currentCallback({
         type: 'error',
         content: 'AI 계획 수정 중 오류가 발생했습니다: ' + (error.message || '네트워크 또는 서버 오류')
@@ -135,9 +163,11 @@ const useAIMessageHandler = (planData, updatePlanData) => {
     planData.loadedFlightInfos,
     planData.loadedAccommodationInfos,
     planData.isRoundTrip, 
+    planData.versionedPlan,
     updatePlanData.setPlanId, 
     updatePlanData.setTravelPlans, 
-    updatePlanData.setDayOrder
+    updatePlanData.setDayOrder,
+    updatePlanData.setVersionedPlan
   ]);
 
   return handleAISendMessage;
@@ -40,6 +40,8 @@ const useTravelPlanLoader = (user, planIdFromUrl, loadMode) => {
   const [isSharedPlan, setIsSharedPlan] = useState(false);
   const [sharedEmails, setSharedEmails] = useState([]);
   const [originalOwner, setOriginalOwner] = useState(null);
+  // travel-plans에서 불러온 계획의 저장 버전 (AI 수정 시 계획 전체 대신 {planId, planVersion}만 전송)
+  const [versionedPlan, setVersionedPlan] = useState(null);
   
   const { createFlightSchedules } = useFlightHandlers();
 
@@ -63,6 +65,7 @@ const useTravelPlanLoader = (user, planIdFromUrl, loadMode) => {
     setIsSharedPlan(false);
     setSharedEmails([]);
     setOriginalOwner(null);
+    setVersionedPlan(null);
     setIsLoadingPlan(false);
   }, []);
 
@@ -1192,6 +1195,11 @@ const useTravelPlanLoader = (user, planIdFromUrl, loadMode) => {
     
     // 원래 소유자 정보 추출
     const originalOwner = data?.original_owner || data?.plan?.original_owner || data?.plan?.user_id;
+
+    // 내 travel-plans 항목이면 저장 버전 (plan_version이 없는 예전 항목은 0). 공유받은 계획은 서버에서 수정할 수 없음
+    const planVersion = data?.originalData?.planId && !isSharedWithMe
+      ? Number(data.originalData.plan_version ?? 0)
+      : null;
     
     // 최종 반환 데이터
     return {
@@ -1209,7 +1217,9 @@ const useTravelPlanLoader = (user, planIdFromUrl, loadMode) => {
       loadedFlightInfos: parsedFlightInfos,
       isRoundTrip: roundTripFlag,
       loadedAccommodationInfo: parsedAccommodationInfo,
-      loadedAccommodationInfos: parsedAccommodationInfos
+      loadedAccommodationInfos: parsedAccommodationInfos,
+      versionedPlanId: planVersion !== null ? data.originalData.planId : null,
+      planVersion: planVersion
     };
   }, []);
 
@@ -1447,6 +1457,10 @@ const useTravelPlanLoader = (user, planIdFromUrl, loadMode) => {
       setIsSharedPlan(result.isSharedPlan || false);
       setSharedEmails(result.sharedEmails || []);
       setOriginalOwner(result.originalOwner || null);
+      // 화면의 계획이 이 travelPlans 그대로일 때만 버전 요청을 보냄 (사용자가 편집하면 예전처럼 계획 전체 전송)
+      setVersionedPlan(result.planVersion !== null && result.planVersion !== undefined
+        ? { planId: result.versionedPlanId, version: result.planVersion, travelPlans: convertedPlans }
+        : null);
       
       // ✅ 추가: 로딩 완료 후 최종 상태 로그
       console.log('[useTravelPlanLoader] 📋 로딩 완료 - 최종 travelPlans 상태:', convertedPlans);
@@ -1540,7 +1554,9 @@ const useTravelPlanLoader = (user, planIdFromUrl, loadMode) => {
     sharedEmailFromLoader,
     isSharedPlan,
     sharedEmails,
-    originalOwner
+    originalOwner,
+    versionedPlan,
+    setVersionedPlan
   };
 };
 
@@ -1,7 +1,12 @@
+// 큰 메시지 분할 전송 (백엔드 websocket_push.py): frame_manifest 1개 + frame_chunk N개를 모아 원래 메시지로 복원
+// 이 시간 안에 조각이 다 오지 않으면 버림
+const FRAME_REASSEMBLY_TIMEOUT_MS = 60000;
+
 class WebSocketService {
   constructor() {
     this.ws = null;
     this.messageHandlers = new Map();
+    this.pendingFrames = new Map();
     this.isConnected = false;
   }
 
@@ -19,15 +24,12 @@ class WebSocketService {
         this.ws.onmessage = (event) => {
           try {
             const data = JSON.parse(event.data);
-            console.log('[WebSocket] 메시지 수신:', data);
-            
-            const handler = this.messageHandlers.get(data.action);
-            if (handler) {
-              console.log(`[WebSocket] ${data.action} 핸들러 실행`);
-              handler(data);
-            } else {
-              console.log(`[WebSocket] ${data.action}에 대한 핸들러가 없음. 등록된 핸들러:`, Array.from(this.messageHandlers.keys()));
+            if (data.action === 'frame_manifest' || data.action === 'frame_chunk') {
+              this.handleFrame(data);
+              return;
             }
+            console.log('[WebSocket] 메시지 수신:', data);
+            this.dispatchMessage(data);
           } catch (error) {
             console.error('[WebSocket] 메시지 파싱 오류:', error, '원본 데이터:', event.data);
           }
@@ -59,6 +61,52 @@ class WebSocketService {
     }
   }
 
+  dispatchMessage(data) {
+    const handler = this.messageHandlers.get(data.action);
+    if (handler) {
+      console.log(`[WebSocket] ${data.action} 핸들러 실행`);
+      handler(data);
+    } else {
+      console.log(`[WebSocket] ${data.action}에 대한 핸들러가 없음. 등록된 핸들러:`, Array.from(this.messageHandlers.keys()));
+    }
+  }
+
+  // 분할 전송된 조각을 frameId별로 모으고, 조각이 다 모이면 복원하여 원래 action의 핸들러로 전달
+  handleFrame(frame) {
+    let pending = this.pendingFrames.get(frame.frameId);
+    if (!pending) {
+      pending = {
+        manifest: null,
+        chunks: new Map(),
+        timer: setTimeout(() => {
+          console.error('[WebSocket] 분할 메시지 조각이 모두 도착하지 않아 버림:', frame.frameId);
+          this.pendingFrames.delete(frame.frameId);
+        }, FRAME_REASSEMBLY_TIMEOUT_MS)
+      };
+      this.pendingFrames.set(frame.frameId, pending);
+    }
+
+    if (frame.action === 'frame_manifest') {
+      pending.manifest = frame;
+    } else {
+      pending.chunks.set(frame.seq, frame.data);
+    }
+    if (!pending.manifest || pending.chunks.size < pending.manifest.chunkCount) {
+      return;
+    }
+
+    clearTimeout(pending.timer);
+    this.pendingFrames.delete(frame.frameId);
+    reassembleFrames(pending.manifest, pending.chunks)
+      .then((data) => {
+        console.log(`[WebSocket] 분할 메시지 복원 (${pending.manifest.chunkCount}개 조각, ${pending.manifest.byteLength}바이트):`, data.action);
+        this.dispatchMessage(data);
+      })
+      .catch((error) => {
+        console.error('[WebSocket] 분할 메시지 복원 실패:', error, pending.manifest);
+      });
+  }
+
   sendMessage(message) {
     if (this.ws && this.isConnected) {
       this.ws.send(JSON.stringify(message));
@@ -78,7 +126,8 @@ class WebSocketService {
   }
 
   // 여행 계획 생성 요청
-  async createTravelPlan(planDetails, authToken = null) {
+  // onDayReady: 스트리밍 생성 중 하루치 일정이 완성될 때마다 ({ dayIndex, day })로 호출됨 (선택)
+  async createTravelPlan(planDetails, authToken = null, onDayReady = null) {
     if (!this.isConnected) {
       await this.connect();
     }
@@ -87,14 +136,24 @@ class WebSocketService {
       // 타임아웃 설정 (3분)
       const timeout = setTimeout(() => {
         this.removeMessageHandler('plan_created');
+        this.removeMessageHandler('plan_day_ready');
         this.removeMessageHandler('error');
         reject(new Error('요청 시간이 초과되었습니다. (3분)'));
       }, 180000); // 3분
 
+      // 하루치 일정 도착 핸들러 (스트리밍 생성)
+      this.onMessage('plan_day_ready', (data) => {
+        console.log(`[WebSocket] plan_day_ready 수신: ${data.dayIndex + 1}일차`);
+        if (onDayReady) {
+          onDayReady({ dayIndex: data.dayIndex, day: data.day });
+        }
+      });
+
       // 성공 핸들러
       this.onMessage('plan_created', (data) => {
         clearTimeout(timeout);
         this.removeMessageHandler('plan_created');
+        this.removeMessageHandler('plan_day_ready');
         this.removeMessageHandler('error');
         console.log('[WebSocket] plan_created 처리 완료:', data);
         resolve(data);
@@ -104,6 +163,7 @@ class WebSocketService {
       this.onMessage('error', (data) => {
         clearTimeout(timeout);
         this.removeMessageHandler('plan_created');
+        this.removeMessageHandler('plan_day_ready');
         this.removeMessageHandler('error');
         console.log('[WebSocket] error 처리 완료:', data);
         reject(new Error(data.message || '알 수 없는 오류가 발생했습니다'));
@@ -130,8 +190,11 @@ class WebSocketService {
       
       console.log('[WebSocket] 사용할 토큰 (처음 20자):', token.substring(0, 20) + '...');
 
+      // clientRequestId: 같은 요청을 다시 보낼 때(재연결 후 재시도 등) 백엔드가 이미 생성된 계획을 돌려주도록 식별하는 ID
+      // 재시도할 때는 planDetails.clientRequestId에 처음 받은 값을 그대로 넘김
       const messageData = {
         ...planDetails,
+        clientRequestId: planDetails.clientRequestId || createClientRequestId(),
         authToken: token
       };
 
@@ -175,7 +238,9 @@ class WebSocketService {
         this.removeMessageHandler('modification_request_received');
         this.removeMessageHandler('status_update');
         console.log('[WebSocket] ai_modification_error 처리 완료:', data);
-        reject(new Error(data.message || 'AI 계획 수정 중 알 수 없는 오류가 발생했습니다'));
+        const error = new Error(data.message || 'AI 계획 수정 중 알 수 없는 오류가 발생했습니다');
+        error.code = data.code; // 예: plan_version_conflict (modifyPlanAsync의 PlanRequestError)
+        reject(error);
       });
 
       // 요청 접수 확인 핸들러 (신규 추가)
@@ -216,6 +281,40 @@ class WebSocketService {
   }
 }
 
+function createClientRequestId() {
+  if (typeof crypto !== 'undefined' && crypto.randomUUID) {
+    return crypto.randomUUID();
+  }
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 12)}`;
+}
+
+// frame_chunk의 data를 seq 순서로 이어 붙여 base64 디코딩 -> (gzip이면) 압축 해제 -> sha256 확인 -> JSON
+async function reassembleFrames(manifest, chunks) {
+  let encoded = '';
+  for (let seq = 0; seq < manifest.chunkCount; seq += 1) {
+    encoded += chunks.get(seq);
+  }
+  if (encoded.length !== manifest.encodedLength) {
+    throw new Error(`조각 길이가 맞지 않습니다: ${encoded.length} / ${manifest.encodedLength}`);
+  }
+
+  let bytes = Uint8Array.from(atob(encoded), (char) => char.charCodeAt(0));
+  if (manifest.encoding === 'gzip+base64') {
+    const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip'));
+    bytes = new Uint8Array(await new Response(stream).arrayBuffer());
+  }
+
+  // crypto.subtle은 보안 컨텍스트(https, localhost)에서만 사용 가능
+  if (typeof crypto !== 'undefined' && crypto.subtle) {
+    const digest = await crypto.subtle.digest('SHA-256', bytes);
+    const hex = Array.from(new Uint8Array(digest), (byte) => byte.toString(16).padStart(2, '0')).join('');
+    if (hex !== manifest.sha256) {
+      throw new Error('체크섬이 맞지 않습니다');
+    }
+  }
+  return JSON.parse(new TextDecoder().decode(bytes));
+}
+
 // 싱글톤 인스턴스
 const websocketService = new WebSocketService();
 